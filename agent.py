@@ -0,0 +1,452 @@
+import itertools
+import random
+import re
+
+import decision
+import skill as sk
+from decision import DecisionRequest
+from player import Player
+from skill import SkillInfo, skill_info_dict
+
+
+class Agent:
+    """
+    玩家的决策接口
+    游戏通过 decide 发出决策请求，默认实现按请求类型转交给 select_skill_id / select_skill_targets
+    """
+
+    @property
+    def name(self) -> str:
+        """
+        agent 名称，用于结果记录，默认为类名
+        """
+        return type(self).__name__
+
+    def decide(self, game, request: DecisionRequest):
+        """
+        回答一次决策请求，可以直接返回答案，也可以返回 awaitable
+
+        Args:
+            game (Game): 当前游戏
+            request (DecisionRequest): 决策请求
+
+        Returns:
+            int | list[int] | Awaitable: 招式编号或目标编号列表
+        """
+        player = game.players[request.player_id]
+
+        if request.is_skill_decision():
+            legal_skills = [skill_info_dict[skill_id] for skill_id in request.options]
+            return self.select_skill_id(game, player, legal_skills)
+
+        legal_targets = [game.players[target_id] for target_id in request.options]
+        targets = self.select_skill_targets(
+            game, player, legal_targets, request.target_num
+        )
+        return [target.id for target in targets]
+
+    def get_answer_distribution(self, game, request: DecisionRequest) -> list[tuple]:
+        """
+        回答决策请求的概率分布，用于精确枚举对手的动作
+        默认把 agent 视为确定性的，只调用一次 decide
+
+        Args:
+            game (Game): 当前游戏
+            request (DecisionRequest): 决策请求
+
+        Returns:
+            list[tuple[int | list[int], float]]: (答案, 概率) 列表
+        """
+        return [(self.decide(game, request), 1.0)]
+
+    def select_skill_id(
+        self, game, player: Player, legal_skills: list[SkillInfo]
+    ) -> int:
+        """
+        选择招式编号
+
+        Args:
+            game (Game): 当前游戏
+            player (Player): 做决策的玩家
+            legal_skills (list[SkillInfo]): 可选招式信息
+
+        Returns:
+            int: 招式编号
+        """
+        raise NotImplementedError()
+
+    def select_skill_targets(
+        self, game, player: Player, legal_targets: list[Player], target_num: int
+    ) -> list[Player]:
+        """
+        选择招式目标
+
+        Args:
+            game (Game): 当前游戏
+            player (Player): 做决策的玩家
+            legal_targets (list[Player]): 可选目标列表
+            target_num (int): 目标数量
+
+        Returns:
+            list[Player]: 选择的目标列表（目标可重复）
+        """
+        raise NotImplementedError()
+
+
+class TerminalAgent(Agent):
+    """
+    人类玩家通过终端输入决策
+    """
+
+    def select_skill_id(
+        self, game, player: Player, legal_skills: list[SkillInfo]
+    ) -> int:
+        print("可选择的招式如下：")
+        for skill in legal_skills:
+            print(f"{skill.id}: {skill.name}")
+
+        skill_id = input("请输入招式编号：")
+
+        legal_skill_ids = [s.id for s in legal_skills]
+        while not str.isdigit(skill_id) or int(skill_id) not in legal_skill_ids:
+            print("可选择的招式如下：")
+            for skill in legal_skills:
+                print(f"{skill.id}: {skill.name}")
+            skill_id = input(
+                f"输入的编号 {skill_id} 不在合法编号 {legal_skill_ids} 内\n请输入合法编号："
+            )
+
+        return int(skill_id)
+
+    def select_skill_targets(
+        self, game, player: Player, legal_targets: list[Player], target_num: int
+    ) -> list[Player]:
+        def is_valid_input(s: str, legal_target_ids: list[int], target_num: int):
+            if not s or not all(re.fullmatch(r"-?\d+", num) for num in s.split()):
+                return False
+
+            target_ids = list(map(int, s.split()))
+            if len(target_ids) != target_num:
+                return False
+
+            if any(target_id not in legal_target_ids for target_id in target_ids):
+                return False
+
+            return True
+
+        legal_target_ids = [target.id for target in legal_targets]
+
+        print("可选择的目标有：")
+        for target in legal_targets:
+            print(f"{target.id}：{target}")
+
+        target_id_str = input(f"请输入 {target_num} 个目标（目标可重复）：")
+
+        while not is_valid_input(target_id_str, legal_target_ids, target_num):
+            print("输入有误，可选择的目标有：")
+            for target in legal_targets:
+                print(f"{target.id}：{target}")
+
+            target_id_str = input(f"请输入 {target_num} 个目标（目标可重复）：")
+
+        target_ids = list(map(int, target_id_str.split()))
+
+        return [game.players[target_id] for target_id in target_ids]
+
+
+class RandomAgent(Agent):
+    """
+    在合法选择中均匀随机决策的 agent，相同种子的决策序列相同
+    每次选择恰好消耗一个随机数，antithetic 为 True 时使用 1 - u 代替 u，得到对偶的决策序列
+    """
+
+    def __init__(self, seed=None, antithetic=False, banned_skill_ids=()):
+        self.rng = random.Random(seed)
+        self.antithetic = antithetic
+        self.banned_skill_ids = frozenset(banned_skill_ids)
+
+    def draw_index(self, n: int) -> int:
+        """
+        从 [0, n) 中随机取一个下标
+
+        Args:
+            n (int): 选项数量
+
+        Returns:
+            int: 下标
+        """
+        u = self.rng.random()
+        if self.antithetic:
+            u = 1.0 - u
+        return min(int(u * n), n - 1)
+
+    def decide(self, game, request: DecisionRequest):
+        options = request.options
+
+        if request.is_skill_decision():
+            # 禁用的招式不参与选择，全部被禁用时退回原列表
+            allowed_skill_ids = [
+                skill_id for skill_id in options if skill_id not in self.banned_skill_ids
+            ] or options
+
+            return allowed_skill_ids[self.draw_index(len(allowed_skill_ids))]
+
+        return [
+            options[self.draw_index(len(options))] for _ in range(request.target_num)
+        ]
+
+    def get_answer_distribution(self, game, request: DecisionRequest) -> list[tuple]:
+        options = request.options
+
+        if request.is_skill_decision():
+            allowed_skill_ids = [
+                skill_id for skill_id in options if skill_id not in self.banned_skill_ids
+            ] or options
+
+            return [(skill_id, 1 / len(allowed_skill_ids)) for skill_id in allowed_skill_ids]
+
+        probability = len(options) ** -request.target_num
+        return [
+            (list(target_ids), probability)
+            for target_ids in itertools.product(options, repeat=request.target_num)
+        ]
+
+
+# HeuristicAgent 的参数名，参数以同样顺序的元组表示
+HEURISTIC_PARAM_NAMES = (
+    "meditate",  # 打坐的基础分
+    "attack",  # 攻击招式的基础分
+    "attack_per_cost",  # 攻击招式每点消耗的加分，贵的招式伤害更高
+    "defend",  # 回天、镜反、饿鬼道对每个有威胁的对手的加分
+    "mirror_bonus",  # 镜反相对回天的额外分
+    "heal",  # 治疗招式对每点已损失生命的加分
+    "save_six_paths",  # 查克拉不足以发动六道模式时打坐的加分
+    "save_seal",  # 查克拉不足以发动尸鬼封尽时打坐的加分
+    "six_paths",  # 六道模式的基础分
+    "seal",  # 尸鬼封尽的基础分
+    "utility",  # 其他招式的基础分
+    "cost",  # 每点消耗的惩罚
+)
+DEFAULT_HEURISTIC_PARAMS = (1.0, 1.0, 0.3, 0.5, 0.2, 0.5, 0.5, 0.3, 1.0, 0.5, 0.3, 0.2)
+
+ATTACK_SKILL_IDS = frozenset(
+    (
+        sk.RASENGAN_ID,
+        sk.TWIN_RASENGAN_ID,
+        sk.CHIDORI_ID,
+        sk.EIGHT_TRIGRAMS_SIXTY_FOUR_PALMS_ID,
+        sk.RASENSHURIKEN_ID,
+        sk.CHIDORI_CURRENT_ID,
+        sk.HUMAN_PATH_ID,
+        sk.ASURA_PATH_ID,
+    )
+)
+DEFENSE_SKILL_IDS = frozenset((sk.REVOLVING_HEAVEN_ID, sk.MIRROR_RETURN_ID, sk.PRETA_PATH_ID))
+HEAL_SKILL_IDS = frozenset((sk.HEAL_ID, sk.NARAKA_PATH_ID))
+# 以自己为首选目标的招式
+SELF_TARGET_SKILL_IDS = frozenset((sk.HEAL_ID, sk.IMPURE_WORLD_REINCARNATION_ID))
+
+
+def get_current_hp(player: Player) -> int:
+    return player.second_hp if player.is_in_second_life else player.hp
+
+
+def get_current_max_hp(player: Player) -> int:
+    return player.second_max_hp if player.is_in_second_life else player.max_hp
+
+
+class HeuristicAgent(Agent):
+    """
+    按参数化打分选择招式的 agent：每个合法招式按类别、威胁和查克拉计划打分，取最高分
+    目标选择生命值最低的对手，治疗和秽土转生优先选择自己
+    相同参数和种子的决策序列相同，种子只用于打破同分
+    """
+
+    def __init__(self, params: tuple = DEFAULT_HEURISTIC_PARAMS, seed=None):
+        """
+        Args:
+            params (tuple[float]): 按 HEURISTIC_PARAM_NAMES 顺序的参数
+            seed (int): 打破同分用的随机种子
+        """
+        self.params = dict(zip(HEURISTIC_PARAM_NAMES, params))
+        self.rng = random.Random(seed)
+
+    def get_threat_num(self, game, player: Player) -> int:
+        """
+        同一空间内有查克拉发动攻击的对手数量
+        """
+        return sum(
+            1
+            for other in game.get_available_players()
+            if other is not player
+            and other.is_in_kamui_zone == player.is_in_kamui_zone
+            and other.mp >= 1
+            and not other.is_bound()
+        )
+
+    def score_skill(self, game, player: Player, skill_id: int) -> float:
+        params = self.params
+        cost = skill_info_dict[skill_id].cost
+        score = -params["cost"] * cost
+
+        if skill_id == sk.MEDITATION_ID:
+            score += params["meditate"]
+            if not player.is_in_sixpaths_mode() and player.mp < skill_info_dict[sk.SIX_PATHS_MODE_ID].cost:
+                score += params["save_six_paths"]
+            if player.mp < skill_info_dict[sk.DEAD_DEMON_CONSUMING_SEAL_ID].cost:
+                score += params["save_seal"]
+        elif skill_id in ATTACK_SKILL_IDS:
+            score += params["attack"] + params["attack_per_cost"] * cost
+        elif skill_id in DEFENSE_SKILL_IDS:
+            score += params["defend"] * self.get_threat_num(game, player)
+            if skill_id == sk.MIRROR_RETURN_ID:
+                score += params["mirror_bonus"]
+        elif skill_id in HEAL_SKILL_IDS:
+            score += params["heal"] * (get_current_max_hp(player) - get_current_hp(player))
+        elif skill_id == sk.SIX_PATHS_MODE_ID:
+            score += params["six_paths"]
+        elif skill_id == sk.DEAD_DEMON_CONSUMING_SEAL_ID:
+            score += params["seal"]
+        else:
+            score += params["utility"]
+
+        return score
+
+    def select_targets(self, game, player: Player, request: DecisionRequest) -> list[int]:
+        options = request.options
+
+        if request.skill_id in SELF_TARGET_SKILL_IDS and player.id in options:
+            return [player.id] * request.target_num
+
+        target_id = min(
+            options,
+            key=lambda target_id: (
+                target_id == player.id,
+                get_current_hp(game.players[target_id]),
+                -game.players[target_id].mp,
+            ),
+        )
+        return [target_id] * request.target_num
+
+    def decide(self, game, request: DecisionRequest):
+        player = game.players[request.player_id]
+
+        if not request.is_skill_decision():
+            return self.select_targets(game, player, request)
+
+        best_skill_ids = []
+        best_score = float("-inf")
+
+        for skill_id in request.options:
+            score = self.score_skill(game, player, skill_id)
+            if score > best_score:
+                best_skill_ids, best_score = [skill_id], score
+            elif score == best_score:
+                best_skill_ids.append(skill_id)
+
+        if len(best_skill_ids) == 1:
+            return best_skill_ids[0]
+        return best_skill_ids[self.rng.randrange(len(best_skill_ids))]
+
+
+# RuleAgent 的招式优先级，从高到低；没有列出的招式排在最后
+RULE_SKILL_PRIORITY = (
+    sk.ASURA_PATH_ID,
+    sk.HUMAN_PATH_ID,
+    sk.ANIMAL_PATH_ID,
+    sk.SIX_PATHS_MODE_ID,
+    sk.RASENSHURIKEN_ID,
+    sk.CHIDORI_ID,
+    sk.TWIN_RASENGAN_ID,
+    sk.RASENGAN_ID,
+    sk.MEDITATION_ID,
+)
+# 按招式编号查询的优先级，数值越大越优先
+RULE_SKILL_RANKS = tuple(
+    len(RULE_SKILL_PRIORITY) - RULE_SKILL_PRIORITY.index(skill_id)
+    if skill_id in RULE_SKILL_PRIORITY
+    else 0
+    for skill_id in range(sk.SKILL_NUM)
+)
+# 受到威胁时的反制招式，按优先级排列
+RULE_COUNTER_SKILL_IDS = (sk.PRETA_PATH_ID, sk.MIRROR_RETURN_ID, sk.REVOLVING_HEAVEN_ID)
+# 攒查克拉的目标：不足以发动六道模式时打坐
+RULE_SAVE_MP = skill_info_dict[sk.SIX_PATHS_MODE_ID].cost
+
+
+class RuleAgent(Agent):
+    """
+    确定性的规则 agent，决策只查预先计算的表，开销可以忽略，用于压测和吞吐测试
+        六道模式中生命值低时使用地狱道
+        被看透的对手载入的预选攻击招式打向自己时（包括同一空间内的千鸟流）反制
+        六道模式中按优先级使用六道招式，否则查克拉不足六道模式时打坐
+        攻击招式只在 (回合 + 座位) 为偶数的回合使用，避免相同的 agent 互相打出的球总是全部抵消
+        其余情况（包括写轮眼复制和看透预选）按 RULE_SKILL_RANKS 选最高的招式
+    目标选择生命值最低的对手，治疗和秽土转生优先选择自己
+    """
+
+    def is_threatened(self, game, player: Player) -> bool:
+        """
+        是否有被看透的对手选择了打向自己的攻击招式（产生球、可以被反制的招式）
+        选择招式时看透玩家上回合的预选已经载入 skill_ids 和 skill_targets，预选本身已被清空；
+        没有指定目标的范围攻击（千鸟流）打向与使用者处于同一空间的所有其他玩家
+        """
+        for opponent in game.players:
+            skill_id = game.skill_ids[opponent.id]
+            if opponent is player or not opponent.is_exposed or skill_id not in ATTACK_SKILL_IDS:
+                continue
+
+            if skill_info_dict[skill_id].target_num:
+                targets = game.skill_targets[opponent.id]
+            else:
+                targets = game.get_legal_skill_targets(opponent)
+
+            if player in targets:
+                return True
+
+        return False
+
+    def select_skill(self, game, player: Player, request: DecisionRequest) -> int:
+        options = request.options
+
+        if request.kind == decision.SKILL:
+            if player.is_in_sixpaths_mode():
+                if (
+                    sk.NARAKA_PATH_ID in options
+                    and get_current_hp(player) * 2 <= get_current_max_hp(player)
+                ):
+                    return sk.NARAKA_PATH_ID
+            elif player.mp < RULE_SAVE_MP and sk.MEDITATION_ID in options:
+                return sk.MEDITATION_ID
+
+            if self.is_threatened(game, player):
+                for skill_id in RULE_COUNTER_SKILL_IDS:
+                    if skill_id in options:
+                        return skill_id
+
+            if (request.round_count + player.id) % 2:
+                options = [
+                    skill_id for skill_id in options if skill_id not in ATTACK_SKILL_IDS
+                ] or options
+
+        return max(options, key=RULE_SKILL_RANKS.__getitem__)
+
+    def decide(self, game, request: DecisionRequest):
+        player = game.players[request.player_id]
+
+        if request.is_skill_decision():
+            return self.select_skill(game, player, request)
+
+        options = request.options
+        if request.skill_id in SELF_TARGET_SKILL_IDS and player.id in options:
+            return [player.id] * request.target_num
+
+        target_id = min(
+            options,
+            key=lambda target_id: (
+                target_id == player.id,
+                get_current_hp(game.players[target_id]),
+                target_id,
+            ),
+        )
+        return [target_id] * request.target_num
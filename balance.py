@@ -0,0 +1,356 @@
+import argparse
+import math
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import skill as sk
+from agent import RandomAgent
+from headless import MAX_ROUNDS, get_winner_id, play_game
+from skill import skill_info_dict
+from tournament import split_seed_range
+
+
+@contextmanager
+def override_costs(cost_overrides: dict):
+    """
+    临时修改 skill_info_dict 中招式的查克拉消耗
+
+    Args:
+        cost_overrides (dict[int, int]): 招式编号到新消耗的映射
+    """
+    original_costs = {
+        skill_id: skill_info_dict[skill_id].cost for skill_id in cost_overrides
+    }
+    for skill_id, cost in cost_overrides.items():
+        skill_info_dict[skill_id].cost = cost
+
+    try:
+        yield
+    finally:
+        for skill_id, cost in original_costs.items():
+            skill_info_dict[skill_id].cost = cost
+
+
+class Arm:
+    """
+    对比实验中的一组设置：关注座位的 agent 以及规则（招式消耗）修改
+    其他座位始终为随机 agent，消耗修改对所有人生效
+    """
+
+    def __init__(
+        self,
+        banned_skill_ids: tuple = (),
+        cost_overrides: dict = None,
+        focal_agent_factory=None,
+    ):
+        """
+        Args:
+            banned_skill_ids (tuple): 关注座位的随机 agent 禁用的招式
+            cost_overrides (dict[int, int]): 招式编号到新消耗的映射
+            focal_agent_factory (Callable[[int, bool], Agent]): 以 (种子, 是否对偶) 创建关注座位的 agent，
+                必须可被 pickle，为 None 时使用随机 agent
+        """
+        self.banned_skill_ids = tuple(banned_skill_ids)
+        self.cost_overrides = dict(cost_overrides or {})
+        self.focal_agent_factory = focal_agent_factory
+
+    def play(
+        self,
+        seed: int,
+        player_num: int,
+        focal_seat: int,
+        antithetic: bool,
+        max_rounds: int,
+    ) -> int:
+        """
+        进行一局比赛
+
+        Returns:
+            int: 关注的座位是否获胜
+        """
+        agents = [
+            RandomAgent(seed * player_num + i, antithetic)
+            for i in range(player_num)
+        ]
+        if self.focal_agent_factory:
+            agents[focal_seat] = self.focal_agent_factory(
+                seed * player_num + focal_seat, antithetic
+            )
+        else:
+            agents[focal_seat].banned_skill_ids = frozenset(self.banned_skill_ids)
+
+        with override_costs(self.cost_overrides):
+            game = play_game(agents, max_rounds)
+
+        return int(get_winner_id(game) == focal_seat)
+
+
+def play_paired_games(task: tuple) -> list[tuple[int, int]]:
+    """
+    工作进程的入口：对一段种子分别用两组设置进行比赛
+    同一种子下两组使用相同的随机数（公共随机数），开启对偶时每个种子再各加一局对偶随机数的比赛
+
+    Args:
+        task (tuple): (起始种子, 结束种子, 基线组, 变体组, 玩家数量, 关注座位, 是否对偶, 最大回合数)
+
+    Returns:
+        list[tuple[int, int]]: 每局的 (基线是否获胜, 变体是否获胜)，对偶的两局相邻
+    """
+    (
+        start,
+        stop,
+        baseline_arm,
+        variant_arm,
+        player_num,
+        focal_seat,
+        antithetic,
+        max_rounds,
+    ) = task
+    streams = (False, True) if antithetic else (False,)
+
+    return [
+        (
+            baseline_arm.play(seed, player_num, focal_seat, a, max_rounds),
+            variant_arm.play(seed, player_num, focal_seat, a, max_rounds),
+        )
+        for seed in range(start, stop)
+        for a in streams
+    ]
+
+
+def play_paired_seeds(task: tuple) -> list[tuple[float, float]]:
+    """
+    工作进程的入口：同 play_paired_games，但将每个种子的对偶比赛合并为一个样本
+
+    Returns:
+        list[tuple[float, float]]: 每个种子的 (基线胜率, 变体胜率)
+    """
+    antithetic = task[6]
+    outcomes = play_paired_games(task)
+
+    if not antithetic:
+        return outcomes
+
+    return [
+        (
+            (outcomes[i][0] + outcomes[i + 1][0]) / 2,
+            (outcomes[i][1] + outcomes[i + 1][1]) / 2,
+        )
+        for i in range(0, len(outcomes), 2)
+    ]
+
+
+class PairedEstimate:
+    """
+    配对样本的在线估计，效果定义为 变体胜率 - 基线胜率
+    """
+
+    def __init__(self, games_per_sample: int = 1):
+        self.games_per_sample = games_per_sample
+        self.sample_num = 0
+        self.baseline_sum = 0.0
+        self.variant_sum = 0.0
+        self.diff_sum = 0.0
+        self.diff_square_sum = 0.0
+
+    def add(self, baseline: float, variant: float):
+        diff = variant - baseline
+
+        self.sample_num += 1
+        self.baseline_sum += baseline
+        self.variant_sum += variant
+        self.diff_sum += diff
+        self.diff_square_sum += diff * diff
+
+    @property
+    def baseline_rate(self) -> float:
+        return self.baseline_sum / self.sample_num if self.sample_num else 0.0
+
+    @property
+    def variant_rate(self) -> float:
+        return self.variant_sum / self.sample_num if self.sample_num else 0.0
+
+    @property
+    def effect(self) -> float:
+        return self.diff_sum / self.sample_num if self.sample_num else 0.0
+
+    @property
+    def standard_error(self) -> float:
+        """
+        配对差值的标准误
+        """
+        if self.sample_num < 2:
+            return math.inf
+
+        variance = (
+            self.diff_square_sum - self.sample_num * self.effect**2
+        ) / (self.sample_num - 1)
+        return math.sqrt(max(variance, 0.0) / self.sample_num)
+
+    @property
+    def independent_standard_error(self) -> float:
+        """
+        相同局数下两组独立模拟时的标准误，用于衡量方差缩减效果
+        """
+        game_num = self.sample_num * self.games_per_sample
+        if not game_num:
+            return math.inf
+
+        p, q = self.baseline_rate, self.variant_rate
+        return math.sqrt((p * (1 - p) + q * (1 - q)) / game_num)
+
+    def confidence_interval(self, z: float = 1.96) -> tuple[float, float]:
+        return (
+            self.effect - z * self.standard_error,
+            self.effect + z * self.standard_error,
+        )
+
+    def __str__(self):
+        low, high = self.confidence_interval()
+        reduction = (
+            (self.independent_standard_error / self.standard_error) ** 2
+            if self.standard_error
+            else math.inf
+        )
+        return (
+            f"基线 {self.baseline_rate:.4f}，变体 {self.variant_rate:.4f}，"
+            f"差值 {self.effect:+.4f}，95% 置信区间 [{low:+.4f}, {high:+.4f}]，"
+            f"方差缩减 {reduction:.1f} 倍"
+        )
+
+
+def estimate_variant_effect(
+    player_num: int,
+    game_num: int,
+    banned_skill_ids: tuple = (),
+    cost_overrides: dict = None,
+    focal_seat: int = 0,
+    first_seed: int = 0,
+    antithetic: bool = True,
+    processes: int = None,
+    chunk_size: int = 64,
+    max_rounds: int = MAX_ROUNDS,
+) -> PairedEstimate:
+    """
+    用配对模拟估计变体对关注座位胜率的影响
+
+    Args:
+        player_num (int): 玩家数量
+        game_num (int): 配对种子数量，开启对偶时每组实际进行 2 * game_num 局
+        banned_skill_ids (tuple): 变体中关注座位禁用的招式
+        cost_overrides (dict[int, int]): 变体中的招式消耗修改
+        focal_seat (int): 关注的座位
+        first_seed (int): 起始种子
+        antithetic (bool): 是否使用对偶随机数
+        processes (int): 进程数，为 1 时在当前进程中执行
+        chunk_size (int): 每个任务包含的种子数
+        max_rounds (int): 最大回合数
+
+    Returns:
+        PairedEstimate: 估计结果
+    """
+    baseline_arm = Arm()
+    variant_arm = Arm(banned_skill_ids, cost_overrides)
+    tasks = [
+        (
+            start,
+            stop,
+            baseline_arm,
+            variant_arm,
+            player_num,
+            focal_seat,
+            antithetic,
+            max_rounds,
+        )
+        for start, stop in split_seed_range(
+            first_seed, first_seed + game_num, chunk_size
+        )
+    ]
+    estimate = PairedEstimate(2 if antithetic else 1)
+
+    if processes == 1:
+        for task in tasks:
+            for baseline, variant in play_paired_seeds(task):
+                estimate.add(baseline, variant)
+    else:
+        with Pool(processes) as pool:
+            for samples in pool.imap_unordered(play_paired_seeds, tasks):
+                for baseline, variant in samples:
+                    estimate.add(baseline, variant)
+
+    return estimate
+
+
+def analyze_skills(
+    player_num: int, game_num: int, skill_ids: list[int], **kwargs
+) -> dict[int, PairedEstimate]:
+    """
+    估计每个招式对胜率的贡献：关注座位禁用该招式后的胜率变化
+    贡献 = 基线胜率 - 禁用后胜率 = -estimate.effect
+
+    Args:
+        player_num (int): 玩家数量
+        game_num (int): 每个招式的配对种子数量
+        skill_ids (list[int]): 要分析的招式
+        **kwargs: 传给 estimate_variant_effect 的其他参数
+
+    Returns:
+        dict[int, PairedEstimate]: 招式编号到估计结果的映射
+    """
+    return {
+        skill_id: estimate_variant_effect(
+            player_num, game_num, banned_skill_ids=(skill_id,), **kwargs
+        )
+        for skill_id in skill_ids
+    }
+
+
+def parse_cost_override(s: str) -> tuple[int, int]:
+    skill_id, cost = s.split("=")
+    return int(skill_id), int(cost)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="招式平衡性分析（配对模拟 + 对偶随机数）")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("game_num", type=int, help="每个招式的配对种子数量")
+    parser.add_argument(
+        "--skills", type=int, nargs="*", default=None, help="要分析的招式编号，默认全部"
+    )
+    parser.add_argument(
+        "--cost",
+        type=parse_cost_override,
+        nargs="*",
+        default=None,
+        help="改为评估消耗修改的影响，格式为 招式编号=消耗，例如 12=4",
+    )
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--no-antithetic", action="store_true")
+    args = parser.parse_args()
+
+    options = dict(
+        first_seed=args.first_seed,
+        antithetic=not args.no_antithetic,
+        processes=args.processes,
+    )
+
+    if args.cost:
+        cost_overrides = dict(args.cost)
+        estimate = estimate_variant_effect(
+            args.player_num, args.game_num, cost_overrides=cost_overrides, **options
+        )
+        print(
+            "消耗修改",
+            {skill_info_dict[k].name: v for k, v in cost_overrides.items()},
+            "对座位 0 的影响：",
+            estimate,
+        )
+    else:
+        skill_ids = args.skills if args.skills is not None else range(sk.SKILL_NUM)
+        for skill_id, estimate in analyze_skills(
+            args.player_num, args.game_num, skill_ids, **options
+        ).items():
+            print(
+                f"{skill_id}: {skill_info_dict[skill_id].name}，贡献 {-estimate.effect:+.4f}；{estimate}"
+            )
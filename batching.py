@@ -0,0 +1,196 @@
+import asyncio
+import random
+from array import array
+
+import skill as sk
+from agent import Agent
+from decision import DECISION_KINDS, DecisionRequest
+from observation import ObservationEncoder
+
+
+class RequestEncoder:
+    """
+    最简单的定长编码：决策类型、自身生命值 / 查克拉和合法选项掩码
+    编码器接口：feature_num 为每行的特征数，encode 把一个请求写入 out[offset : offset + feature_num]
+    （必须写满整行），完整的观测编码见 ObservationEncoder
+    """
+
+    def __init__(self, max_player_num: int = 8):
+        self.max_player_num = max_player_num
+        self.feature_num = len(DECISION_KINDS) + 3 + sk.SKILL_NUM + max_player_num
+        self.zeros = array("f", bytes(4 * self.feature_num))
+
+    def encode(self, game, request: DecisionRequest, out: memoryview, offset: int = 0):
+        """
+        Args:
+            game (Game): 请求所在的游戏
+            request (DecisionRequest): 决策请求
+            out (memoryview): float32 视图
+            offset (int): 写入的起始下标
+        """
+        out[offset : offset + self.feature_num] = self.zeros
+
+        out[offset + DECISION_KINDS.index(request.kind)] = 1.0
+
+        offset += len(DECISION_KINDS)
+        player = game.players[request.player_id]
+        out[offset] = player.hp
+        out[offset + 1] = player.mp
+        out[offset + 2] = request.target_num
+
+        offset += 3
+        if request.is_skill_decision():
+            for skill_id in request.options:
+                if skill_id >= 0:
+                    out[offset + skill_id] = 1.0
+        else:
+            offset += sk.SKILL_NUM
+            for target_id in request.options:
+                out[offset + target_id] = 1.0
+
+
+class RandomBatchPolicy:
+    """
+    批量策略的示例：忽略观测，在合法选项中随机选择
+    批量策略接口：policy(observations, requests) -> answers
+        observations 为 len(requests) * feature_num 个 float32 的连续 memoryview，
+        可以零拷贝地转为 numpy.frombuffer(observations, numpy.float32).reshape(-1, feature_num)
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def __call__(self, observations: memoryview, requests: list[DecisionRequest]) -> list:
+        return [
+            self.rng.choice(request.options)
+            if request.is_skill_decision()
+            else [self.rng.choice(request.options) for _ in range(request.target_num)]
+            for request in requests
+        ]
+
+
+class DecisionBatcher:
+    """
+    批量决策层：收集多局游戏的决策请求，编码到一个预先分配的数组后一次调用批量策略，再把答案分发回去
+    同步用法：作为 GameScheduler 的 answer_batch，按 max_batch_size 分块调用策略
+    异步用法：通过 BatchingAgent 提交请求，待处理请求达到 max_batch_size 或最早的请求等待超过
+             max_latency 秒时刷新
+    """
+
+    def __init__(
+        self,
+        policy,
+        encoder=None,
+        max_batch_size: int = 256,
+        max_latency: float = 0.005,
+    ):
+        self.policy = policy
+        self.encoder = encoder or ObservationEncoder()
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.buffer = array("f", bytes(4 * max_batch_size * self.encoder.feature_num))
+        self.view = memoryview(self.buffer)
+
+        # 异步模式下等待刷新的 (游戏, 请求, future)
+        self.pending = []
+        self.flush_handle = None
+
+        self.batch_num = 0
+        self.decision_num = 0
+
+    def infer(self, items: list[tuple]) -> list:
+        """
+        编码一批（不超过 max_batch_size 个）请求并调用一次策略
+
+        Args:
+            items (list[tuple[Game, DecisionRequest]]): (游戏, 请求) 列表
+
+        Returns:
+            list: 与请求一一对应的答案
+        """
+        feature_num = self.encoder.feature_num
+
+        for i, (game, request) in enumerate(items):
+            self.encoder.encode(game, request, self.view, i * feature_num)
+
+        self.batch_num += 1
+        self.decision_num += len(items)
+
+        return self.policy(
+            self.view[: len(items) * feature_num], [request for _, request in items]
+        )
+
+    def __call__(self, items: list[tuple]) -> list:
+        """
+        同步回答任意数量的请求，可直接作为 GameScheduler.step / run 的 answer_batch
+
+        Args:
+            items (list[tuple[Game, DecisionRequest]]): (游戏, 请求) 列表
+
+        Returns:
+            list: 与请求一一对应的答案
+        """
+        answers = []
+        for start in range(0, len(items), self.max_batch_size):
+            answers.extend(self.infer(items[start : start + self.max_batch_size]))
+        return answers
+
+    def submit(self, game, request: DecisionRequest) -> asyncio.Future:
+        """
+        异步提交一个请求
+
+        Returns:
+            asyncio.Future: 刷新后得到答案
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((game, request, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_latency, self.flush)
+
+        return future
+
+    def flush(self):
+        """
+        立即处理所有待处理的异步请求，一批推理出错时该批的请求得到同一个异常，其余批次照常处理
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        while self.pending:
+            batch = self.pending[: self.max_batch_size]
+            del self.pending[: self.max_batch_size]
+
+            try:
+                answers = self.infer([(game, request) for game, request, _ in batch])
+            except Exception as e:
+                # 推理失败时把异常交给这一批的所有等待者，否则它们会永远等待
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), answer in zip(batch, answers):
+                if not future.done():
+                    future.set_result(answer)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.decision_num / self.batch_num if self.batch_num else 0.0
+
+
+class BatchingAgent(Agent):
+    """
+    把决策交给 DecisionBatcher 的 agent，用于在事件循环中运行的游戏（例如服务器上的对局）
+    """
+
+    def __init__(self, batcher: DecisionBatcher):
+        self.batcher = batcher
+
+    def decide(self, game, request: DecisionRequest):
+        return self.batcher.submit(game, request)
@@ -0,0 +1,405 @@
+"""
+固定对手策略下的近似最优反应和策略的可利用度
+
+最优反应 agent 在自己每次选择招式时，对每个合法宏动作（见 lookahead）估计胜率并取最高者：
+    对手本回合的联合动作不多时（例如 2 人局或确定性的对手），按策略给出的概率精确枚举
+    否则按对手策略采样对手本回合的动作，所有候选使用相同的采样（共同随机数）
+对手的每个联合动作（或每次采样）由 ExpectedOutcomeEvaluator.resolve_candidates 一次结算所有候选，
+之后每个候选从自己的结算结果开始，所有座位按被评估的策略模拟至多 rollout_rounds 回合，未分胜负时按存活人数估值。
+各联合动作（或采样）的评估在进程池中并行，同一进程内的回合结算经由评估器的缓存复用。
+
+可利用度 = 一个座位换成最优反应后的胜率 - 该座位使用原策略的胜率
+"""
+
+import argparse
+import math
+from multiprocessing import Pool
+
+import decision
+from agent import Agent, HeuristicAgent, RuleAgent
+from expectation import ExpectedOutcomeEvaluator
+from game import Game, run_sync
+from headless import MAX_ROUNDS, get_winner_id, play_game, quiet
+from lookahead import (
+    get_joint_distribution,
+    get_macro_actions,
+    get_macro_distribution,
+    sample_other_macros,
+)
+from state_codec import get_state_values, set_state_values
+from tournament import make_random_agents
+
+# 采样时每个候选宏动作的模拟次数
+ROLLOUT_NUM = 8
+# 精确枚举时对手每个联合动作的模拟次数
+BRANCH_ROLLOUT_NUM = 2
+# 每次模拟的最大回合数
+ROLLOUT_ROUNDS = 30
+# 精确枚举时对手联合动作数量的上限，超过后改为采样
+EXACT_MAX_BRANCHES = 64
+
+# 每个进程一份的结算评估器和用于模拟的游戏，按玩家数量区分
+OUTCOME_EVALUATORS = {}
+SIMULATION_GAMES = {}
+
+
+def make_rule_agents(seed: int, player_num: int) -> list:
+    return [RuleAgent() for _ in range(player_num)]
+
+
+def make_heuristic_agents(seed: int, player_num: int) -> list:
+    return [HeuristicAgent(seed=seed * player_num + i) for i in range(player_num)]
+
+
+# 命令行可选的被评估策略
+POLICY_FACTORIES = {
+    "random": make_random_agents,
+    "rule": make_rule_agents,
+    "heuristic": make_heuristic_agents,
+}
+
+
+def get_simulation_game(player_num: int) -> Game:
+    if player_num not in SIMULATION_GAMES:
+        SIMULATION_GAMES[player_num] = Game(player_num, [None] * player_num)
+    return SIMULATION_GAMES[player_num]
+
+
+def get_outcome_evaluator(player_num: int) -> ExpectedOutcomeEvaluator:
+    if player_num not in OUTCOME_EVALUATORS:
+        OUTCOME_EVALUATORS[player_num] = ExpectedOutcomeEvaluator(player_num)
+    return OUTCOME_EVALUATORS[player_num]
+
+
+def rollout(
+    game: Game, agents: list[Agent], player_id: int, rollout_rounds: int, max_rounds: int
+) -> float:
+    """
+    从结算后的状态开始，完成看透预选后按 agents 模拟
+
+    Args:
+        game (Game): 刚结算完一回合的游戏
+        agents (list[Agent]): 每个座位的 agent
+        player_id (int): 估值的玩家编号
+        rollout_rounds (int): 最大模拟回合数
+        max_rounds (int): 整局的最大回合数，超过后按平局处理
+
+    Returns:
+        float: 获胜为 1，游戏结束但没有获胜为 0，模拟结束时未分胜负则存活玩家平分
+    """
+    game.agents = agents
+    run_sync(game.finish_round_async())
+
+    last_round = min(game.round_count + rollout_rounds - 1, max_rounds)
+    while not game.is_game_over() and game.round_count <= last_round:
+        game.run_round()
+
+    available_players = game.get_available_players()
+    if game.players[player_id] not in available_players:
+        return 0.0
+    if not game.is_game_over() and game.round_count > max_rounds:
+        return 0.0
+    return 1.0 / len(available_players)
+
+
+def evaluate_branch(task: tuple) -> tuple:
+    """
+    工作进程的入口：对手的一个联合动作（或一组采样）下，估计最优反应玩家所有候选宏动作的估值
+    每个联合动作用 resolve_candidates 一次结算所有候选，再从各自的结算结果开始模拟
+
+    Args:
+        task (tuple): (状态序列, 玩家数量, 玩家编号, 候选宏动作列表, 对手的宏动作或 None, 权重,
+            策略工厂, 模拟种子列表, 模拟回合数, 最大回合数)；
+            对手的宏动作为 None 时每个种子按策略采样对手的动作
+
+    Returns:
+        tuple: (宏动作到加权估值之和的映射, 结算缓存命中数, 未命中数)
+    """
+    (values, player_num, player_id, macros, other_macros, weight, policy_factory, seeds,
+     rollout_rounds, max_rounds) = task
+    evaluator = get_outcome_evaluator(player_num)
+    game = get_simulation_game(player_num)
+    cache = evaluator.joint_outcomes
+    hit_num, miss_num = cache.hit_num, cache.miss_num
+    macro_values = dict.fromkeys(macros, 0.0)
+
+    with quiet():
+        if other_macros is not None:
+            outcomes = evaluator.resolve_candidates(values, player_id, other_macros, macros)
+
+        for seed in seeds:
+            if other_macros is None:
+                # 对手本回合的动作和之后的模拟来自同一组由种子确定的 agent，所有候选使用相同的采样
+                set_state_values(game, values)
+                sampled_macros = sample_other_macros(
+                    policy_factory(seed, player_num), game, player_id
+                )
+                outcomes = evaluator.resolve_candidates(values, player_id, sampled_macros, macros)
+
+            for macro, next_values in outcomes.items():
+                # 每个候选用新建的 agent 模拟；采样时重放一次采样，使 agent 的随机数状态与采样之后一致
+                agents = policy_factory(seed, player_num)
+                if other_macros is None:
+                    set_state_values(game, values)
+                    sample_other_macros(agents, game, player_id)
+
+                set_state_values(game, next_values)
+                macro_values[macro] += weight * rollout(
+                    game, agents, player_id, rollout_rounds, max_rounds
+                )
+
+    return macro_values, cache.hit_num - hit_num, cache.miss_num - miss_num
+
+
+class BestResponseAgent(Agent):
+    """
+    针对固定策略的近似最优反应：选择招式时评估所有宏动作，目标按选中的宏动作回答
+    其他决策（写轮眼、影分身、看透预选）交给被评估的策略
+    """
+
+    def __init__(
+        self,
+        policy_factory=make_random_agents,
+        seed: int = 0,
+        rollout_num: int = ROLLOUT_NUM,
+        branch_rollout_num: int = BRANCH_ROLLOUT_NUM,
+        rollout_rounds: int = ROLLOUT_ROUNDS,
+        max_branches: int = EXACT_MAX_BRANCHES,
+        max_rounds: int = MAX_ROUNDS,
+        pool: Pool = None,
+    ):
+        """
+        Args:
+            policy_factory (Callable[[int, int], list[Agent]]): 被评估策略的 agent 工厂，对手模型和模拟都使用它，必须可被 pickle
+            seed (int): 模拟种子的起点
+            rollout_num (int): 采样时每个候选的模拟次数
+            branch_rollout_num (int): 精确枚举时对手每个联合动作的模拟次数
+            rollout_rounds (int): 每次模拟的最大回合数
+            max_branches (int): 精确枚举的对手联合动作数量上限
+            max_rounds (int): 整局的最大回合数
+            pool (Pool): 并行评估候选的进程池，为 None 时在当前进程中执行
+        """
+        self.policy_factory = policy_factory
+        self.seed = seed
+        self.rollout_num = rollout_num
+        self.branch_rollout_num = branch_rollout_num
+        self.rollout_rounds = rollout_rounds
+        self.max_branches = max_branches
+        self.max_rounds = max_rounds
+        self.pool = pool
+
+        self.policy_agent = None
+        self.macro = None
+        self.exact_num = 0
+        self.sampled_num = 0
+        self.hit_num = 0
+        self.miss_num = 0
+
+    def get_policy_agent(self, game, player_id: int) -> Agent:
+        if self.policy_agent is None:
+            self.policy_agent = self.policy_factory(self.seed, game.player_num)[player_id]
+        return self.policy_agent
+
+    def get_seeds(self, round_count: int, seed_num: int) -> list[int]:
+        # 每个 (种子, 回合) 一段不重叠的模拟种子，回合数不超过 max_rounds
+        first_seed = (self.seed * (self.max_rounds + 1) + round_count) * seed_num
+        return list(range(first_seed, first_seed + seed_num))
+
+    def search(self, game, player_id: int) -> tuple:
+        """
+        评估玩家本回合所有合法的宏动作
+
+        Args:
+            game (Game): 选择招式时的游戏，不会被修改
+            player_id (int): 最优反应玩家的编号
+
+        Returns:
+            tuple[int, tuple]: 估值最高的宏动作
+        """
+        macro_values = self.evaluate_macros(game, player_id)
+        # 同分时取靠前的宏动作，结果与并行的完成顺序无关
+        return max(macro_values, key=macro_values.get)
+
+    def evaluate_macros(self, game, player_id: int) -> dict:
+        """
+        估计玩家本回合每个合法宏动作的期望估值
+
+        Args:
+            game (Game): 选择招式时的游戏，不会被修改
+            player_id (int): 最优反应玩家的编号
+
+        Returns:
+            dict[tuple, float]: 宏动作到估值的映射，按 get_macro_actions 的顺序；
+                只有一个合法宏动作时不做模拟，估值为 None
+        """
+        player_num = game.player_num
+        values = tuple(get_state_values(game))
+        scratch = get_simulation_game(player_num)
+
+        with quiet():
+            set_state_values(scratch, values)
+            macros = get_macro_actions(scratch, scratch.players[player_id])
+            if len(macros) == 1:
+                return {macros[0]: None}
+
+            # 对手的动作分布不依赖模拟种子
+            agents = self.policy_factory(self.seed, player_num)
+            distributions = {
+                player.id: get_macro_distribution(agents[player.id], scratch, player)
+                for player in scratch.players
+                if player.id != player_id
+            }
+
+        if math.prod(len(distribution) for distribution in distributions.values()) <= self.max_branches:
+            seeds = self.get_seeds(game.round_count, self.branch_rollout_num)
+            tasks = [
+                (values, player_num, player_id, macros, joint_macros, probability / len(seeds),
+                 self.policy_factory, seeds, self.rollout_rounds, self.max_rounds)
+                for joint_macros, probability in get_joint_distribution(distributions)
+            ]
+            self.exact_num += 1
+        else:
+            seeds = self.get_seeds(game.round_count, self.rollout_num)
+            tasks = [
+                (values, player_num, player_id, macros, None, 1.0 / len(seeds),
+                 self.policy_factory, [seed], self.rollout_rounds, self.max_rounds)
+                for seed in seeds
+            ]
+            self.sampled_num += 1
+
+        # 按任务顺序累加，估值与并行的完成顺序无关
+        results = (
+            map(evaluate_branch, tasks)
+            if self.pool is None
+            else self.pool.imap(evaluate_branch, tasks)
+        )
+
+        macro_values = dict.fromkeys(macros, 0.0)
+        for branch_values, hit_num, miss_num in results:
+            for macro, value in branch_values.items():
+                macro_values[macro] += value
+            self.hit_num += hit_num
+            self.miss_num += miss_num
+
+        return macro_values
+
+    def decide(self, game, request):
+        if request.kind == decision.SKILL:
+            self.macro = self.search(game, request.player_id)
+            return self.macro[0]
+
+        if (
+            request.kind == decision.TARGETS
+            and self.macro is not None
+            and request.skill_id == self.macro[0]
+            and request.is_legal(list(self.macro[1]))
+        ):
+            return list(self.macro[1])
+
+        return self.get_policy_agent(game, request.player_id).decide(game, request)
+
+
+def evaluate_exploitability(
+    policy_factory=make_random_agents,
+    player_num: int = 2,
+    game_num: int = 100,
+    first_seed: int = 0,
+    processes: int = None,
+    max_rounds: int = MAX_ROUNDS,
+    **search_kwargs,
+) -> dict:
+    """
+    在相同的种子上分别让一个座位使用原策略和最优反应，比较该座位的胜率
+    每局的座位为 seed % player_num，其他座位始终使用原策略
+
+    Args:
+        policy_factory (Callable[[int, int], list[Agent]]): 被评估策略的 agent 工厂，必须可被 pickle
+        player_num (int): 玩家数量
+        game_num (int): 局数，种子为 [first_seed, first_seed + game_num)
+        first_seed (int): 起始种子
+        processes (int): 评估候选的进程数，为 1 时在当前进程中执行
+        max_rounds (int): 最大回合数
+        **search_kwargs: 传给 BestResponseAgent 的其他参数
+
+    Returns:
+        dict: 原策略胜率、最优反应胜率、可利用度、精确枚举和采样的决策次数、转移缓存命中率
+    """
+    pool = Pool(processes) if processes != 1 else None
+    policy_win_num = 0
+    best_response_win_num = 0
+    exact_num = sampled_num = hit_num = miss_num = 0
+
+    try:
+        for seed in range(first_seed, first_seed + game_num):
+            seat = seed % player_num
+
+            game = play_game(policy_factory(seed, player_num), max_rounds)
+            policy_win_num += get_winner_id(game) == seat
+
+            agents = policy_factory(seed, player_num)
+            best_response = BestResponseAgent(
+                policy_factory, seed, max_rounds=max_rounds, pool=pool, **search_kwargs
+            )
+            agents[seat] = best_response
+            game = play_game(agents, max_rounds)
+            best_response_win_num += get_winner_id(game) == seat
+
+            exact_num += best_response.exact_num
+            sampled_num += best_response.sampled_num
+            hit_num += best_response.hit_num
+            miss_num += best_response.miss_num
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    policy_win_rate = policy_win_num / game_num
+    best_response_win_rate = best_response_win_num / game_num
+
+    return {
+        "game_num": game_num,
+        "policy_win_rate": policy_win_rate,
+        "best_response_win_rate": best_response_win_rate,
+        "exploitability": best_response_win_rate - policy_win_rate,
+        "exact_decisions": exact_num,
+        "sampled_decisions": sampled_num,
+        "transition_hit_rate": hit_num / max(hit_num + miss_num, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算策略的近似最优反应和可利用度")
+    parser.add_argument("game_num", type=int, help="局数")
+    parser.add_argument("--policy", choices=sorted(POLICY_FACTORIES), default="random")
+    parser.add_argument("--player-num", type=int, default=2)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--rollout-num", type=int, default=ROLLOUT_NUM)
+    parser.add_argument("--branch-rollout-num", type=int, default=BRANCH_ROLLOUT_NUM)
+    parser.add_argument("--rollout-rounds", type=int, default=ROLLOUT_ROUNDS)
+    parser.add_argument("--max-branches", type=int, default=EXACT_MAX_BRANCHES)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    report = evaluate_exploitability(
+        POLICY_FACTORIES[args.policy],
+        args.player_num,
+        args.game_num,
+        args.first_seed,
+        args.processes,
+        rollout_num=args.rollout_num,
+        branch_rollout_num=args.branch_rollout_num,
+        rollout_rounds=args.rollout_rounds,
+        max_branches=args.max_branches,
+    )
+
+    print(f"原策略胜率 {report['policy_win_rate']:.4f}")
+    print(f"最优反应胜率 {report['best_response_win_rate']:.4f}")
+    print(f"可利用度 {report['exploitability']:.4f}")
+    print(
+        f"精确枚举 {report['exact_decisions']} 次，采样 {report['sampled_decisions']} 次，"
+        f"结算缓存命中率 {report['transition_hit_rate']:.2%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,615 @@
+"""
+同时行动博弈的蒙特卡洛反事实遗憾最小化（MCCFR，external sampling）
+
+信息集为玩家做决策时看到的全部公开状态：所有玩家的状态字段，以及被看透玩家已经载入的预选招式和目标。
+同一回合内能行动的玩家同时决策，彼此看不到对方本回合的选择，因此它们的信息集只差玩家编号。
+动作为 lookahead 中的宏动作，看透玩家在回合结束时的预选是另一类信息集。
+信息集键是状态帧（去掉回合数）加玩家编号和阶段的 64 位哈希，遗憾和平均策略存放在连续的 array 中。
+
+每次迭代从当前平均策略对局若干回合后的状态出发，每个玩家轮流作为遍历者：
+遍历者展开所有宏动作，其他玩家按当前策略采样一个宏动作并累计平均策略，
+展开 depth 回合后按存活玩家的生命值份额估值。
+多进程时每批迭代在同一份表的快照上进行，各进程返回增量表，主进程按顺序合并。
+信息集按精确状态区分、不做抽象，实际对局中的大部分决策状态在表中找不到，只能使用均匀策略。
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import struct
+import sys
+from array import array
+from multiprocessing import Pool
+
+import decision
+from agent import Agent, get_current_hp
+from game import Game, run_sync
+from headless import MAX_ROUNDS, get_winner_id, play_game, quiet
+from lookahead import (
+    ScriptedAgent,
+    TransitionCache,
+    get_macro_actions,
+    get_preselect_macro_actions,
+)
+from state_codec import get_state_struct, get_state_values, set_state_values
+from tournament import make_random_agents, split_seed_range
+
+# 信息集的阶段：选择招式 / 看透预选
+SKILL_PHASE = 0
+PRESELECT_PHASE = 1
+# 每次遍历展开的回合数
+SEARCH_DEPTH = 2
+# 每次迭代的起始状态在多少回合以内
+ROOT_ROUNDS = 8
+# 表文件头：魔数、玩家数量、迭代次数、信息集数量、动作总数
+TABLE_MAGIC = b"CFRT"
+TABLE_HEADER = struct.Struct("<4sBQQQ")
+
+# 每个进程一份的回合转移缓存
+TRANSITION_CACHE = TransitionCache()
+
+
+def get_infoset_key(values, player_id: int, phase: int, player_num: int) -> int:
+    """
+    信息集的 64 位键，不区分回合数
+
+    Args:
+        values (Sequence[int]): 决策时的状态序列
+        player_id (int): 做决策的玩家编号
+        phase (int): SKILL_PHASE 或 PRESELECT_PHASE
+
+    Returns:
+        int: 有符号 64 位整数
+    """
+    data = get_state_struct(player_num).pack(0, *values[1:]) + bytes((player_id, phase))
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+
+def sample_index(probabilities: list[float], rng: random.Random) -> int:
+    u = rng.random()
+    for i, probability in enumerate(probabilities):
+        u -= probability
+        if u < 0:
+            return i
+    return len(probabilities) - 1
+
+
+def get_leaf_value(game: Game, player_id: int) -> float:
+    """
+    展开结束时玩家的估值：存活玩家按当前生命值分配 1，已结束的游戏胜者为 1
+
+    Args:
+        game (Game): 游戏
+        player_id (int): 玩家编号
+
+    Returns:
+        float: 估值
+    """
+    available_players = game.get_available_players()
+    player = game.players[player_id]
+
+    if player not in available_players:
+        return 0.0
+    if len(available_players) == 1:
+        return 1.0
+
+    total_hp = sum(get_current_hp(other) for other in available_players)
+    return get_current_hp(player) / total_hp if total_hp > 0 else 1.0 / len(available_players)
+
+
+class RegretTable:
+    """
+    按信息集存放的累计遗憾和累计策略
+    每个信息集占用 regrets / strategy_sums 中连续的一段，由 offsets 和 sizes 定位
+    """
+
+    def __init__(self, player_num: int):
+        self.player_num = player_num
+        self.iteration_num = 0
+        self.indices = {}
+        self.keys = array("q")
+        self.offsets = array("q")
+        self.sizes = array("H")
+        self.regrets = array("d")
+        self.strategy_sums = array("d")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_byte_size(self) -> int:
+        """
+        Returns:
+            int: 各 array 的数据加上 indices 字典（哈希表和其中的 int 对象）占用的字节数
+        """
+        array_size = sum(
+            len(values) * values.itemsize
+            for values in (self.keys, self.offsets, self.sizes, self.regrets, self.strategy_sums)
+        )
+        index_size = sys.getsizeof(self.indices) + sum(
+            sys.getsizeof(key) + sys.getsizeof(index) for key, index in self.indices.items()
+        )
+        return array_size + index_size
+
+    def find(self, key: int) -> int:
+        return self.indices.get(key, -1)
+
+    def get_index(self, key: int, action_num: int) -> int:
+        """
+        获取信息集的下标，不存在时新建一段全零的记录
+
+        Args:
+            key (int): 信息集键
+            action_num (int): 动作数量
+
+        Returns:
+            int: 下标
+        """
+        index = self.indices.get(key)
+        if index is not None:
+            return index
+
+        index = len(self.keys)
+        self.indices[key] = index
+        self.keys.append(key)
+        self.offsets.append(len(self.regrets))
+        self.sizes.append(action_num)
+
+        zeros = array("d", bytes(8 * action_num))
+        self.regrets.extend(zeros)
+        self.strategy_sums.extend(zeros)
+        return index
+
+    def get_strategy(self, index: int) -> list[float]:
+        """
+        遗憾匹配得到的当前策略，没有正遗憾时为均匀策略
+        """
+        offset, size = self.offsets[index], self.sizes[index]
+        positives = [max(regret, 0.0) for regret in self.regrets[offset : offset + size]]
+        total = sum(positives)
+
+        if total <= 0:
+            return [1.0 / size] * size
+        return [positive / total for positive in positives]
+
+    def get_average_strategy(self, index: int) -> list[float]:
+        """
+        累计策略归一化得到的平均策略，收敛到近似均衡的是它而不是当前策略
+        """
+        offset, size = self.offsets[index], self.sizes[index]
+        sums = self.strategy_sums[offset : offset + size]
+        total = sum(sums)
+
+        if total <= 0:
+            return [1.0 / size] * size
+        return [value / total for value in sums]
+
+    def lookup(self, key: int, action_num: int, average: bool = False) -> list[float]:
+        """
+        查询信息集的策略，没有记录时为均匀策略
+
+        Args:
+            key (int): 信息集键
+            action_num (int): 动作数量
+            average (bool): 是否使用平均策略
+
+        Returns:
+            list[float]: 各动作的概率
+        """
+        index = self.find(key)
+        if index < 0 or self.sizes[index] != action_num:
+            return [1.0 / action_num] * action_num
+        return self.get_average_strategy(index) if average else self.get_strategy(index)
+
+    def add(self, key: int, regrets: list[float] = None, strategy: list[float] = None):
+        """
+        累加一个信息集的遗憾或策略
+
+        Args:
+            key (int): 信息集键
+            regrets (list[float]): 各动作的瞬时遗憾
+            strategy (list[float]): 各动作的策略权重
+        """
+        action_num = len(regrets if regrets is not None else strategy)
+        index = self.get_index(key, action_num)
+        if self.sizes[index] != action_num:
+            # 64 位键冲突，丢弃这次更新
+            return
+        offset = self.offsets[index]
+
+        if regrets is not None:
+            for i, regret in enumerate(regrets):
+                self.regrets[offset + i] += regret
+        if strategy is not None:
+            for i, weight in enumerate(strategy):
+                self.strategy_sums[offset + i] += weight
+
+    def merge(self, other: "RegretTable"):
+        """
+        把另一张表（通常是工作进程的增量）累加进来
+        """
+        for key, offset, size in zip(other.keys, other.offsets, other.sizes):
+            self.add(
+                key,
+                other.regrets[offset : offset + size],
+                other.strategy_sums[offset : offset + size],
+            )
+
+    def save(self, path: str):
+        """
+        写入临时文件后原子替换，进程在任何时刻被杀都不会留下半张表
+
+        Args:
+            path (str): 表文件
+        """
+        temp_path = path + ".tmp"
+
+        with open(temp_path, "wb") as f:
+            f.write(
+                TABLE_HEADER.pack(
+                    TABLE_MAGIC, self.player_num, self.iteration_num, len(self.keys), len(self.regrets)
+                )
+            )
+            for values in (self.keys, self.offsets, self.sizes, self.regrets, self.strategy_sums):
+                values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RegretTable":
+        """
+        Args:
+            path (str): save 写入的表文件
+
+        Returns:
+            RegretTable: 表
+        """
+        with open(path, "rb") as f:
+            magic, player_num, iteration_num, infoset_num, value_num = TABLE_HEADER.unpack(
+                f.read(TABLE_HEADER.size)
+            )
+            if magic != TABLE_MAGIC:
+                raise ValueError(f"{path} 不是遗憾表文件")
+
+            table = cls(player_num)
+            table.iteration_num = iteration_num
+            table.keys.fromfile(f, infoset_num)
+            table.offsets.fromfile(f, infoset_num)
+            table.sizes.fromfile(f, infoset_num)
+            table.regrets.fromfile(f, value_num)
+            table.strategy_sums.fromfile(f, value_num)
+
+        table.indices = {key: index for index, key in enumerate(table.keys)}
+        return table
+
+
+class CFRAgent(Agent):
+    """
+    按遗憾表的平均策略（或当前策略）随机选择宏动作的 agent，表中没有的信息集使用均匀策略
+    """
+
+    def __init__(self, table: RegretTable, seed=None, average: bool = True):
+        """
+        Args:
+            table (RegretTable): 遗憾表，玩家数量必须与游戏一致
+            seed (int): 随机种子
+            average (bool): 使用平均策略还是当前策略
+        """
+        self.table = table
+        self.rng = random.Random(seed)
+        self.average = average
+        self.macro = None
+
+    def decide(self, game, request):
+        player = game.players[request.player_id]
+
+        if request.kind in (decision.SKILL, decision.PRESELECT_SKILL):
+            if request.kind == decision.SKILL:
+                phase, macros = SKILL_PHASE, get_macro_actions(game, player)
+            else:
+                phase, macros = PRESELECT_PHASE, get_preselect_macro_actions(game, player)
+
+            key = get_infoset_key(get_state_values(game), player.id, phase, game.player_num)
+            strategy = self.table.lookup(key, len(macros), self.average)
+            self.macro = macros[sample_index(strategy, self.rng)]
+            return self.macro[0]
+
+        if (
+            request.kind in (decision.TARGETS, decision.PRESELECT_TARGETS)
+            and self.macro is not None
+            and request.skill_id == self.macro[0]
+            and request.is_legal(list(self.macro[1]))
+        ):
+            return list(self.macro[1])
+
+        return request.default_answer()
+
+
+class Traversal:
+    """
+    以一个玩家为遍历者的一次 external sampling 遍历
+    策略从 table 读取，遗憾和平均策略写入 delta
+    """
+
+    def __init__(
+        self,
+        table: RegretTable,
+        delta: RegretTable,
+        game: Game,
+        traverser: int,
+        rng: random.Random,
+        max_rounds: int,
+    ):
+        self.table = table
+        self.delta = delta
+        self.game = game
+        self.traverser = traverser
+        self.rng = rng
+        self.max_rounds = max_rounds
+
+    def traverse(self, values: tuple, depth: int) -> float:
+        """
+        从回合开始时的状态展开
+
+        Args:
+            values (tuple[int]): 回合开始时的状态序列
+            depth (int): 剩余展开回合数
+
+        Returns:
+            float: 遍历者的估值
+        """
+        game = self.game
+        set_state_values(game, values)
+
+        if game.is_game_over():
+            return float(get_winner_id(game) == self.traverser)
+        if game.round_count > self.max_rounds:
+            return 0.0
+        if depth == 0:
+            return get_leaf_value(game, self.traverser)
+
+        # 与实际对局中做决策时的状态一致：被看透玩家的预选已经载入
+        game.load_exposed_selection()
+        values = tuple(get_state_values(game))
+        macros_by_player = {
+            player.id: get_macro_actions(game, player) for player in game.get_movable_players()
+        }
+        return self.traverse_phase(values, macros_by_player, SKILL_PHASE, depth)
+
+    def traverse_phase(self, values: tuple, macros_by_player: dict, phase: int, depth: int) -> float:
+        """
+        一批同时决策：遍历者展开所有宏动作，其他玩家按当前策略采样
+        """
+        player_num = self.game.player_num
+        chosen = {}
+        traverser_node = None
+
+        for player_id, macros in macros_by_player.items():
+            key = get_infoset_key(values, player_id, phase, player_num)
+            strategy = self.table.lookup(key, len(macros))
+
+            if player_id == self.traverser:
+                traverser_node = key, macros, strategy
+            else:
+                chosen[player_id] = macros[sample_index(strategy, self.rng)]
+                self.delta.add(key, strategy=strategy)
+
+        if traverser_node is None:
+            return self.advance(values, chosen, phase, depth)
+
+        key, macros, strategy = traverser_node
+        utilities = [
+            self.advance(values, {**chosen, self.traverser: macro}, phase, depth)
+            for macro in macros
+        ]
+        value = sum(p * u for p, u in zip(strategy, utilities))
+        self.delta.add(key, regrets=[u - value for u in utilities])
+        return value
+
+    def advance(self, values: tuple, chosen: dict, phase: int, depth: int) -> float:
+        """
+        按选定的宏动作推进：选择招式阶段结算本回合并进入预选阶段，预选阶段结束后进入下一回合
+        """
+        game = self.game
+        macros = tuple(chosen.get(i) for i in range(game.player_num))
+
+        if phase == SKILL_PHASE:
+            TRANSITION_CACHE.resolve(game, values, macros)
+            if game.is_game_over():
+                return float(get_winner_id(game) == self.traverser)
+
+            macros_by_player = {
+                player.id: get_preselect_macro_actions(game, player)
+                for player in game.get_exposed_players()
+            }
+            return self.traverse_phase(
+                tuple(get_state_values(game)), macros_by_player, PRESELECT_PHASE, depth
+            )
+
+        set_state_values(game, values)
+        game.agents = [ScriptedAgent(macro) for macro in macros]
+        run_sync(game.finish_round_async())
+        return self.traverse(tuple(get_state_values(game)), depth - 1)
+
+
+def sample_root(table: RegretTable, rng: random.Random, root_rounds: int, max_rounds: int) -> tuple:
+    """
+    用平均策略从初始状态对局随机的回合数，得到迭代的起始状态
+
+    Returns:
+        tuple[int]: 回合开始时的状态序列
+    """
+    player_num = table.player_num
+    game = Game(player_num, [CFRAgent(table, rng.getrandbits(32)) for _ in range(player_num)])
+
+    for _ in range(rng.randrange(root_rounds + 1)):
+        if game.is_game_over() or game.round_count > max_rounds:
+            break
+        game.run_round()
+
+    if game.is_game_over():
+        game = Game(player_num, [None] * player_num)
+
+    return tuple(get_state_values(game))
+
+
+def run_iterations(task: tuple) -> RegretTable:
+    """
+    工作进程的入口：在表的快照上进行一段迭代
+
+    Args:
+        task (tuple): (遗憾表, 起始迭代, 结束迭代（不含）, 展开回合数, 起始状态回合数, 最大回合数)
+
+    Returns:
+        RegretTable: 这段迭代的增量
+    """
+    table, start, stop, depth, root_rounds, max_rounds = task
+    player_num = table.player_num
+    delta = RegretTable(player_num)
+    game = Game(player_num, [None] * player_num)
+
+    with quiet():
+        for iteration in range(start, stop):
+            rng = random.Random(iteration)
+            values = sample_root(table, rng, root_rounds, max_rounds)
+
+            for traverser in range(player_num):
+                Traversal(table, delta, game, traverser, rng, max_rounds).traverse(values, depth)
+
+    return delta
+
+
+class CFRTrainer:
+    """
+    分批进行 MCCFR 迭代，每批结束后合并增量并保存遗憾表
+    迭代的随机数只由迭代序号决定，批次边界是 batch_size 的整数倍；在批次边界保存的表继续训练时
+    （批次大小和进程数不变）与不中断的结果相同，上次训练停在批次中间时最后一批的策略快照不同
+    """
+
+    def __init__(
+        self,
+        player_num: int,
+        path: str = None,
+        depth: int = SEARCH_DEPTH,
+        root_rounds: int = ROOT_ROUNDS,
+        max_rounds: int = MAX_ROUNDS,
+    ):
+        """
+        Args:
+            player_num (int): 玩家数量
+            path (str): 遗憾表文件，存在时从中继续训练，为 None 时不保存
+            depth (int): 每次遍历展开的回合数
+            root_rounds (int): 起始状态的最大回合数
+            max_rounds (int): 最大回合数
+        """
+        self.path = path
+        self.depth = depth
+        self.root_rounds = root_rounds
+        self.max_rounds = max_rounds
+
+        if path and os.path.exists(path):
+            self.table = RegretTable.load(path)
+            if self.table.player_num != player_num:
+                raise ValueError(
+                    f"{path} 的玩家数量为 {self.table.player_num}，与 {player_num} 不一致"
+                )
+        else:
+            self.table = RegretTable(player_num)
+
+    def run(self, iteration_num: int, processes: int = None, batch_size: int = 64, callback=None):
+        """
+        再进行 iteration_num 次迭代
+
+        Args:
+            iteration_num (int): 迭代次数
+            processes (int): 进程数，为 1 时在当前进程中执行
+            batch_size (int): 每批迭代次数，同一批的迭代使用相同的策略快照
+            callback (Callable[[RegretTable], None]): 每批结束后调用
+        """
+        pool = Pool(processes) if processes != 1 else None
+        worker_num = 1 if pool is None else processes or os.cpu_count()
+        last_iteration = self.table.iteration_num + iteration_num
+
+        try:
+            while self.table.iteration_num < last_iteration:
+                # 批次边界对齐到 batch_size 的整数倍，中断后恢复时的批次划分与不中断时相同
+                start = self.table.iteration_num
+                stop = min((start // batch_size + 1) * batch_size, last_iteration)
+                tasks = [
+                    (self.table, chunk_start, chunk_stop, self.depth, self.root_rounds, self.max_rounds)
+                    for chunk_start, chunk_stop in split_seed_range(
+                        start, stop, math.ceil((stop - start) / worker_num)
+                    )
+                ]
+
+                deltas = map(run_iterations, tasks) if pool is None else pool.imap(run_iterations, tasks)
+                for delta in list(deltas):
+                    self.table.merge(delta)
+                self.table.iteration_num = stop
+
+                if self.path:
+                    self.table.save(self.path)
+                if callback:
+                    callback(self.table)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+
+def evaluate_against_random(table: RegretTable, game_num: int, first_seed: int = 0) -> float:
+    """
+    一个座位使用平均策略、其他座位为随机 agent 时该座位的胜率
+
+    Args:
+        table (RegretTable): 遗憾表
+        game_num (int): 局数，座位为 seed % player_num
+        first_seed (int): 起始种子
+
+    Returns:
+        float: 胜率
+    """
+    player_num = table.player_num
+    win_num = 0
+
+    for seed in range(first_seed, first_seed + game_num):
+        seat = seed % player_num
+        agents = make_random_agents(seed, player_num)
+        agents[seat] = CFRAgent(table, seed)
+        win_num += get_winner_id(play_game(agents)) == seat
+
+    return win_num / game_num
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用 MCCFR 训练近似均衡策略")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("iteration_num", type=int, help="本次训练的迭代次数")
+    parser.add_argument("table", help="遗憾表文件，存在时继续训练")
+    parser.add_argument("--depth", type=int, default=SEARCH_DEPTH)
+    parser.add_argument("--root-rounds", type=int, default=ROOT_ROUNDS)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--eval-games", type=int, default=0, help="训练后对随机 agent 评估的局数")
+    args = parser.parse_args()
+
+    trainer = CFRTrainer(args.player_num, args.table, args.depth, args.root_rounds)
+
+    def report(table: RegretTable):
+        print(
+            f"迭代 {table.iteration_num}：{len(table)} 个信息集，"
+            f"{table.get_byte_size() / 1024 / 1024:.1f} MiB"
+        )
+
+    trainer.run(args.iteration_num, args.processes, args.batch_size, report)
+
+    if args.eval_games:
+        win_rate = evaluate_against_random(trainer.table, args.eval_games)
+        print(f"对随机 agent 胜率 {win_rate:.4f}（随机水平 {1 / args.player_num:.4f}）")
+
+
+if __name__ == "__main__":
+    main()
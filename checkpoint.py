@@ -0,0 +1,91 @@
+import bisect
+import json
+import os
+
+
+def merge_ranges(ranges) -> list[list[int]]:
+    """
+    合并相邻或重叠的区间
+
+    Args:
+        ranges (Iterable[tuple[int, int]]): [起始, 结束) 区间
+
+    Returns:
+        list[list[int]]: 按起始排序、互不相邻的区间
+    """
+    merged = []
+
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+
+    return merged
+
+
+def is_covered(merged: list[list[int]], start: int, stop: int) -> bool:
+    """
+    判断区间是否完全包含在 merge_ranges 的结果中
+
+    Args:
+        merged (list[list[int]]): merge_ranges 返回的区间
+        start (int): 起始
+        stop (int): 结束（不含）
+
+    Returns:
+        bool: 是否被覆盖
+    """
+    i = bisect.bisect_right(merged, [start, float("inf")]) - 1
+    return i >= 0 and merged[i][0] <= start and stop <= merged[i][1]
+
+
+class TournamentCheckpoint:
+    """
+    比赛的检查点：比赛设置、已完成的种子区间、汇总统计和结果文件的写入位置
+    每局的 agent 都由局种子确定随机数流，已完成区间即可确定所有随机数流的位置
+    整个检查点写入临时文件后原子替换，进程在任何时刻被杀都不会留下半个检查点
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): 检查点文件
+        """
+        self.path = path
+
+    def load(self) -> dict:
+        """
+        Returns:
+            dict: 上次保存的检查点，不存在时为 None
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, config: dict, completed: set, stats_state: dict, position: int):
+        """
+        保存检查点，调用前结果必须已经写到 position
+
+        Args:
+            config (dict): 比赛设置，恢复时必须一致
+            completed (Iterable[tuple[int, int]]): 已完成的种子区间，保存时合并相邻区间
+            stats_state (dict): SummaryStats.get_state 返回的快照
+            position (int): 结果写出器 sync 返回的位置
+        """
+        checkpoint = {
+            "config": config,
+            "completed": merge_ranges(completed),
+            "stats": stats_state,
+            "position": position,
+        }
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, self.path)
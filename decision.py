@@ -0,0 +1,97 @@
+import skill as sk
+
+# 决策类型
+SKILL = "skill"  # 选择招式
+TARGETS = "targets"  # 选择招式目标
+SHADOW_CLONE_TARGETS = "shadow_clone_targets"  # 选择影分身招式的目标
+SHARINGAN_SKILL = "sharingan_skill"  # 选择写轮眼复制的招式
+SHARINGAN_TARGETS = "sharingan_targets"  # 选择写轮眼复制招式的目标
+PRESELECT_SKILL = "preselect_skill"  # 看透玩家预选招式
+PRESELECT_TARGETS = "preselect_targets"  # 看透玩家预选目标
+
+SKILL_KINDS = (SKILL, SHARINGAN_SKILL, PRESELECT_SKILL)
+TARGETS_KINDS = (TARGETS, SHADOW_CLONE_TARGETS, SHARINGAN_TARGETS, PRESELECT_TARGETS)
+DECISION_KINDS = SKILL_KINDS + TARGETS_KINDS
+
+
+class DecisionRequest:
+    """
+    游戏向玩家发出的一次决策请求
+    选择招式时答案为招式编号，选择目标时答案为 target_num 个目标编号的列表（目标可重复）
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        player_id: int,
+        round_count: int,
+        options: list[int],
+        target_num: int = 0,
+        skill_id: int = sk.NONE_ACTION_ID,
+    ):
+        """
+        Args:
+            kind (str): 决策类型
+            player_id (int): 做决策的玩家编号
+            round_count (int): 所在回合
+            options (list[int]): 可选的招式编号或目标编号
+            target_num (int): 需要选择的目标数量，选择招式时为 0
+            skill_id (int): 选择目标时对应的招式编号
+        """
+        self.kind = kind
+        self.player_id = player_id
+        self.round_count = round_count
+        self.options = options
+        self.target_num = target_num
+        self.skill_id = skill_id
+
+    def __repr__(self):
+        return (
+            f"DecisionRequest({self.kind!r}, player_id={self.player_id}, "
+            f"round_count={self.round_count}, options={self.options}, "
+            f"target_num={self.target_num}, skill_id={self.skill_id})"
+        )
+
+    def is_skill_decision(self) -> bool:
+        return self.kind in SKILL_KINDS
+
+    def is_legal(self, answer) -> bool:
+        """
+        检查答案是否合法
+
+        Args:
+            answer (int | list[int]): 答案
+
+        Returns:
+            bool: 是否合法
+        """
+        if self.is_skill_decision():
+            return type(answer) is int and answer in self.options
+
+        return (
+            isinstance(answer, list)
+            and len(answer) == self.target_num
+            and all(type(target_id) is int and target_id in self.options for target_id in answer)
+        )
+
+    def default_answer(self):
+        """
+        玩家超时或掉线时使用的答案：能打坐就打坐，否则选第一个选项
+
+        Returns:
+            int | list[int]: 答案
+        """
+        if self.is_skill_decision():
+            return sk.MEDITATION_ID if sk.MEDITATION_ID in self.options else self.options[0]
+
+        return [self.options[0]] * self.target_num
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "player_id": self.player_id,
+            "round_count": self.round_count,
+            "options": self.options,
+            "target_num": self.target_num,
+            "skill_id": self.skill_id,
+        }
@@ -0,0 +1,198 @@
+"""
+以观测的规范形式为键的决策缓存
+
+观测与 ObservationEncoder 相同：每个玩家的数值和布尔字段、是否有效、是否与自己同一空间、被谁心转身、
+看透玩家可见的选择，以及回合数和决策请求。规范化消除两种对称：
+    空间对称：只记录每个玩家是否与决策者同一空间，所有人同时换到另一空间的局面相同
+    座位对称：决策者固定在 0 号位，其他玩家按自身字段排序，字段完全相同的玩家之间
+        枚举所有排列取编码最小者，心转身、看透目标和可选目标等引用按排列后的座位编码
+键相同的两个观测之间存在保持所有字段的座位映射，缓存的目标答案按这个映射换回实际的玩家编号。
+
+引擎在同一优先级内按玩家编号结算招式，座位对称忽略了这一点；决策依赖自己的绝对座位的 agent
+（例如 RuleAgent 按回合与座位的奇偶选择攻击）应使用 permute_players=False，只消除空间对称。
+"""
+
+import inspect
+import itertools
+import math
+
+import skill as sk
+from agent import Agent
+from decision import DecisionRequest
+from lookahead import LRUCache
+from observation import PLAYER_FLAG_FIELDS, PLAYER_VALUE_FIELDS
+
+# 决策缓存的默认最大条目数
+DECISION_CACHE_SIZE = 1 << 16
+# 字段相同的玩家之间最多枚举的排列数，超过后按玩家编号排列，只会少命中，不会混淆不同的局面
+MAX_CANONICAL_PERMUTATIONS = 720
+# 规范形式中的布尔字段，空间改为相对决策者记录
+CANONICAL_FLAG_FIELDS = tuple(field for field in PLAYER_FLAG_FIELDS if field != "is_in_kamui_zone")
+
+
+def get_visible_selection(game, player) -> tuple:
+    """
+    看透玩家对所有人可见的选择：回合结束时为预选，回合开始后为已载入的招式
+
+    Returns:
+        tuple[int, list[Player]]: 招式编号和目标，没有看透时为 (NONE_ACTION_ID, [])
+    """
+    if not player.is_exposed:
+        return sk.NONE_ACTION_ID, []
+
+    skill_id = game.preselected_skill_ids[player.id]
+    targets = game.preselected_skill_targets[player.id]
+    if skill_id == sk.NONE_ACTION_ID:
+        skill_id = game.skill_ids[player.id]
+        targets = game.skill_targets[player.id]
+
+    return skill_id, targets
+
+
+def get_canonical_observation(game, request: DecisionRequest, permute_players: bool = True) -> tuple:
+    """
+    决策请求对应观测的规范形式
+
+    Args:
+        game (Game): 请求所在的游戏
+        request (DecisionRequest): 决策请求
+        permute_players (bool): 是否消除座位对称，为 False 时其他玩家按编号排列，并且键中包含决策者的编号
+
+    Returns:
+        tuple[tuple, list[int]]: (可哈希的规范观测, 规范座位到玩家编号的映射)，0 号座位是决策者
+    """
+    players = game.players
+    me = players[request.player_id]
+
+    # 不含玩家引用的字段，用于排序和划分字段相同的玩家
+    records = {
+        player.id: (
+            player.is_available(),
+            player.is_in_kamui_zone == me.is_in_kamui_zone,
+            *(getattr(player, field) for field in PLAYER_VALUE_FIELDS),
+            *(getattr(player, field) for field in CANONICAL_FLAG_FIELDS),
+        )
+        for player in players
+    }
+    selections = {player.id: get_visible_selection(game, player) for player in players}
+
+    others = [player.id for player in players if player is not me]
+    if permute_players:
+        others.sort(key=lambda player_id: records[player_id])
+        groups = [list(group) for _, group in itertools.groupby(others, key=records.__getitem__)]
+    else:
+        groups = [[player_id] for player_id in others]
+
+    if math.prod(math.factorial(len(group)) for group in groups) > MAX_CANONICAL_PERMUTATIONS:
+        groups = [[player_id] for player_id in others]
+
+    def encode(order: list[int]) -> tuple:
+        seats = {player_id: seat for seat, player_id in enumerate(order)}
+        seats[-1] = -1
+
+        encoded_players = tuple(
+            records[player_id]
+            + (
+                seats[players[player_id].charmed_by],
+                selections[player_id][0],
+                tuple(sorted(seats[target.id] for target in selections[player_id][1])),
+            )
+            for player_id in order
+        )
+
+        if request.is_skill_decision():
+            options = tuple(request.options)
+        else:
+            options = tuple(sorted(seats[target_id] for target_id in request.options))
+
+        return encoded_players, options
+
+    best = None
+    for permutation in itertools.product(*(itertools.permutations(group) for group in groups)):
+        order = [me.id] + [player_id for group in permutation for player_id in group]
+        encoded = encode(order)
+        if best is None or encoded < best[0]:
+            best = encoded, order
+
+    encoded, order = best
+    observation = (
+        None if permute_players else me.id,
+        game.player_num,
+        game.round_count,
+        request.kind,
+        request.target_num,
+        request.skill_id,
+        encoded,
+    )
+    return observation, order
+
+
+class DecisionCache(LRUCache):
+    """
+    规范观测 -> 规范答案的 LRU 缓存，可以在多个座位、多局之间共享
+    """
+
+    def __init__(self, max_size: int = DECISION_CACHE_SIZE, permute_players: bool = True):
+        """
+        Args:
+            max_size (int): 最大条目数
+            permute_players (bool): 是否消除座位对称
+        """
+        super().__init__(max_size)
+        self.permute_players = permute_players
+
+    def decide(self, decide, game, request: DecisionRequest):
+        """
+        查询缓存，未命中时调用 decide 并缓存答案
+
+        Args:
+            decide (Callable[[Game, DecisionRequest], Any]): 原决策函数
+            game (Game): 当前游戏
+            request (DecisionRequest): 决策请求
+
+        Returns:
+            int | list[int] | Awaitable: 与 decide 相同，异步的答案不缓存
+        """
+        observation, order = get_canonical_observation(game, request, self.permute_players)
+        answer = self.get(observation)
+
+        if answer is not None:
+            if not request.is_skill_decision():
+                answer = [order[seat] for seat in answer]
+            if request.is_legal(answer):
+                return answer
+
+        answer = decide(game, request)
+        if inspect.isawaitable(answer):
+            return answer
+
+        if request.is_skill_decision():
+            self.put(observation, answer)
+        else:
+            seats = {player_id: seat for seat, player_id in enumerate(order)}
+            self.put(observation, tuple(seats[target_id] for target_id in answer))
+
+        return answer
+
+
+class CachedAgent(Agent):
+    """
+    用 DecisionCache 包装另一个 agent 的决策，适合开销大、只依赖观测的 agent（搜索类 agent）
+    随机 agent 被包装后，相同观测总是得到第一次的答案
+    """
+
+    def __init__(self, agent: Agent, cache: DecisionCache = None):
+        """
+        Args:
+            agent (Agent): 被包装的 agent
+            cache (DecisionCache): 决策缓存，为 None 时新建；多个 CachedAgent 可以共享同一个缓存
+        """
+        self.agent = agent
+        self.cache = cache if cache is not None else DecisionCache()
+
+    @property
+    def name(self) -> str:
+        return self.agent.name
+
+    def decide(self, game, request: DecisionRequest):
+        return self.cache.decide(self.agent.decide, game, request)
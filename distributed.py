@@ -0,0 +1,424 @@
+"""
+跨机器的分布式比赛：协调者把种子区间分给通过 TCP 连接的 worker，worker 进行比赛并把结果传回
+协议为每行一个 JSON 对象：
+    worker -> 协调者
+        {"type": "ready"}                                      请求任务
+        {"type": "result", "start": 0, "stop": 256, "results": [...]}
+    协调者 -> worker
+        {"type": "task", "start": 0, "stop": 256, "player_num": 3, "max_rounds": 200, "cost_overrides": {...}}
+        {"type": "wait", "seconds": 1.0}                       暂时没有任务，稍后再请求
+        {"type": "done"}                                       全部完成，worker 退出
+worker 断开或租约超时的区间会重新分配，同一区间的重复结果只记录一次
+已完成的区间、汇总统计和结果文件的位置写入检查点，协调者重启后回滚到检查点并跳过已完成的区间
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import socket
+import time
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+from balance import override_costs, parse_cost_override
+from checkpoint import TournamentCheckpoint, is_covered
+from headless import MAX_ROUNDS, quiet
+from results import ResultStore, ResultWriter, SummaryStats
+from server import encode_message
+from tournament import make_random_agents, play_seed_range, split_seed_range
+
+# worker 在没有任务时等待的秒数
+WAIT_SECONDS = 1.0
+# worker 把区间切分给本地进程池时每段的局数
+WORKER_CHUNK_SIZE = 16
+# 单条消息的最大字节数，一个区间的全部结果在一行中
+MAX_MESSAGE_SIZE = 1 << 28
+
+
+class Coordinator:
+    """
+    分布式比赛的协调者：分配种子区间、收集结果、重试丢失的区间并记录检查点
+    """
+
+    def __init__(
+        self,
+        player_num: int,
+        game_num: int,
+        writer: ResultWriter | ResultStore,
+        first_seed: int = 0,
+        chunk_size: int = 256,
+        max_rounds: int = MAX_ROUNDS,
+        cost_overrides: dict = None,
+        lease_timeout: float = 600.0,
+        checkpoint: TournamentCheckpoint = None,
+        checkpoint_interval: float = 60.0,
+    ):
+        """
+        Args:
+            player_num (int): 玩家数量
+            game_num (int): 比赛局数，种子为 [first_seed, first_seed + game_num)
+            writer (ResultWriter | ResultStore): 结果写出器
+            first_seed (int): 起始种子
+            chunk_size (int): 每个区间包含的局数
+            max_rounds (int): 最大回合数
+            cost_overrides (dict[int, int]): 招式消耗修改，发给所有 worker
+            lease_timeout (float): 区间分配后多少秒未返回结果则重新分配
+            checkpoint (TournamentCheckpoint): 检查点，为 None 时不保存进度；
+                检查点已存在则先把 writer 回滚到检查点的位置，恢复汇总统计并跳过已完成的区间
+            checkpoint_interval (float): 保存检查点的最短间隔（秒），全部完成时总会保存一次
+        """
+        self.player_num = player_num
+        self.writer = writer
+        self.max_rounds = max_rounds
+        self.cost_overrides = cost_overrides or {}
+        self.lease_timeout = lease_timeout
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.last_save_time = time.monotonic()
+
+        # 费用修改的键在 JSON 中会变成字符串，检查点中按 [招式, 消耗] 列表记录
+        self.config = {
+            "player_num": player_num,
+            "game_num": game_num,
+            "first_seed": first_seed,
+            "chunk_size": chunk_size,
+            "max_rounds": max_rounds,
+            "cost_overrides": sorted(
+                [skill_id, cost] for skill_id, cost in self.cost_overrides.items()
+            ),
+        }
+        self.completed = set()
+        saved = checkpoint.load() if checkpoint else None
+
+        if saved:
+            if saved["config"] != self.config:
+                raise ValueError(f"检查点的比赛设置 {saved['config']} 与本次 {self.config} 不一致")
+
+            writer.truncate(saved["position"])
+            writer.stats.load_state(saved["stats"])
+            self.completed = {tuple(seed_range) for seed_range in saved["completed"]}
+
+        self.pending_ranges = deque(
+            seed_range
+            for seed_range in split_seed_range(first_seed, first_seed + game_num, chunk_size)
+            if not (saved and is_covered(saved["completed"], *seed_range))
+        )
+        self.range_num = len(self.pending_ranges)
+        self.leases = {}  # 区间 -> (worker 编号, 租约到期时间)
+        self.completed_num = 0
+        self.retry_num = 0
+        self.worker_ids = itertools.count()
+        self.worker_writers = set()
+        self.worker_tasks = set()
+        self.finished = asyncio.Event()
+
+        if not self.pending_ranges:
+            self.finished.set()
+
+    def requeue(self, seed_range: tuple):
+        self.leases.pop(seed_range, None)
+        self.pending_ranges.appendleft(seed_range)
+        self.retry_num += 1
+
+    def requeue_expired(self):
+        now = time.monotonic()
+        for seed_range, (_, deadline) in list(self.leases.items()):
+            if deadline <= now:
+                self.requeue(seed_range)
+
+    def next_message(self, worker_id: int) -> dict:
+        """
+        为请求任务的 worker 生成回复
+
+        Args:
+            worker_id (int): worker 编号
+
+        Returns:
+            dict: task / wait / done 消息
+        """
+        if self.finished.is_set():
+            return {"type": "done"}
+
+        if not self.pending_ranges:
+            self.requeue_expired()
+            if not self.pending_ranges:
+                return {"type": "wait", "seconds": WAIT_SECONDS}
+
+        start, stop = seed_range = self.pending_ranges.popleft()
+        self.leases[seed_range] = (worker_id, time.monotonic() + self.lease_timeout)
+
+        return {
+            "type": "task",
+            "start": start,
+            "stop": stop,
+            "player_num": self.player_num,
+            "max_rounds": self.max_rounds,
+            "cost_overrides": self.cost_overrides,
+        }
+
+    def complete(self, start: int, stop: int, results: list[dict]):
+        """
+        记录一个区间的结果，已完成的区间（超时后被重复执行）直接忽略
+
+        Args:
+            start (int): 起始种子
+            stop (int): 结束种子（不含）
+            results (list[dict]): 各局结果
+        """
+        seed_range = (start, stop)
+        if seed_range in self.completed:
+            return
+
+        self.leases.pop(seed_range, None)
+        if seed_range in self.pending_ranges:
+            self.pending_ranges.remove(seed_range)
+
+        for result in results:
+            self.writer.write(result)
+        self.completed.add(seed_range)
+
+        # 落盘和保存检查点会阻塞事件循环，按间隔批量进行
+        if self.checkpoint and time.monotonic() - self.last_save_time >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+        self.completed_num += 1
+        if self.completed_num == self.range_num:
+            self.finished.set()
+
+    def save_checkpoint(self):
+        """
+        等待结果落盘后保存检查点，恢复时回滚到检查点记录的位置，不会重复计入任何一局
+        """
+        self.checkpoint.save(
+            self.config, self.completed, self.writer.stats.get_state(), self.writer.sync()
+        )
+        self.last_save_time = time.monotonic()
+
+    async def handle_worker(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        worker_id = next(self.worker_ids)
+        self.worker_writers.add(writer)
+        self.worker_tasks.add(asyncio.current_task())
+
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+
+                if message.get("type") == "result":
+                    self.complete(message["start"], message["stop"], message["results"])
+                elif message.get("type") != "ready":
+                    continue
+
+                reply = self.next_message(worker_id)
+                writer.write(encode_message(reply))
+                await writer.drain()
+
+                if reply["type"] == "done":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            # 断开的 worker 持有的区间重新分配
+            for seed_range, (lease_worker_id, _) in list(self.leases.items()):
+                if lease_worker_id == worker_id:
+                    self.requeue(seed_range)
+            self.worker_writers.discard(writer)
+            self.worker_tasks.discard(asyncio.current_task())
+            writer.close()
+
+    async def run(self, host: str = "0.0.0.0", port: int = 8766) -> SummaryStats:
+        """
+        监听 worker 连接直到所有区间完成
+
+        Returns:
+            SummaryStats: 汇总统计，从检查点恢复时包含之前运行的结果
+        """
+        server = await asyncio.start_server(
+            self.handle_worker, host, port, limit=MAX_MESSAGE_SIZE
+        )
+
+        async with server:
+            await self.finished.wait()
+
+            # 通知仍连接的 worker 退出后关闭连接：等待中的 worker 读到 done，
+            # 仍在执行多余区间的 worker 发送结果时发现连接已关闭；
+            # 等所有连接的处理任务结束后再关闭服务器，避免它们在事件循环结束时被取消
+            done_message = encode_message({"type": "done"})
+            for writer in list(self.worker_writers):
+                writer.write(done_message)
+                writer.close()
+            await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+
+        if self.checkpoint:
+            self.save_checkpoint()
+        else:
+            self.writer.flush()
+        return self.writer.stats
+
+
+def run_task(message: dict, pool: Pool = None, agent_factory=make_random_agents) -> list[dict]:
+    """
+    执行协调者分配的区间，有进程池时进一步切分并行执行
+
+    Args:
+        message (dict): task 消息
+        pool (Pool): 本地进程池
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂
+
+    Returns:
+        list[dict]: 各局结果
+    """
+    # JSON 的键只能是字符串
+    cost_overrides = {
+        int(skill_id): cost for skill_id, cost in message["cost_overrides"].items()
+    }
+    tasks = [
+        (start, stop, message["player_num"], agent_factory, message["max_rounds"],
+         cost_overrides)
+        for start, stop in split_seed_range(
+            message["start"], message["stop"], WORKER_CHUNK_SIZE
+        )
+    ]
+
+    if pool is None:
+        results_list = map(play_seed_range_with_costs, tasks)
+    else:
+        results_list = pool.map(play_seed_range_with_costs, tasks)
+
+    return [result for results in results_list for result in results]
+
+
+def play_seed_range_with_costs(task: tuple) -> list[dict]:
+    """
+    在修改招式消耗的情况下进行一段种子的比赛，消耗修改只在执行的进程内生效
+
+    Args:
+        task (tuple): play_seed_range 的任务后接消耗修改
+
+    Returns:
+        list[dict]: 各局结果
+    """
+    *range_task, cost_overrides = task
+    with override_costs(cost_overrides):
+        return play_seed_range(tuple(range_task))
+
+
+def run_worker(
+    host: str,
+    port: int,
+    processes: int = 1,
+    agent_factory=make_random_agents,
+) -> int:
+    """
+    连接协调者并持续执行分配的区间，直到收到 done 或连接断开
+
+    Args:
+        host (str): 协调者地址
+        port (int): 协调者端口
+        processes (int): 本地进程数
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂，需与协调者约定一致
+
+    Returns:
+        int: 完成的局数
+    """
+    game_num = 0
+
+    with (
+        socket.create_connection((host, port)) as connection,
+        connection.makefile("rb") as reader,
+        Pool(processes) if processes > 1 else nullcontext() as pool,
+    ):
+        try:
+            connection.sendall(encode_message({"type": "ready"}))
+
+            while line := reader.readline():
+                message = json.loads(line)
+
+                if message["type"] == "done":
+                    break
+
+                if message["type"] == "wait":
+                    time.sleep(message["seconds"])
+                    connection.sendall(encode_message({"type": "ready"}))
+                    continue
+
+                with quiet():
+                    results = run_task(message, pool, agent_factory)
+
+                connection.sendall(
+                    encode_message(
+                        {
+                            "type": "result",
+                            "start": message["start"],
+                            "stop": message["stop"],
+                            "results": results,
+                        }
+                    )
+                )
+                game_num += len(results)
+        except ConnectionError:
+            # 协调者完成后会直接关闭连接，正在执行的区间已由其他 worker 完成
+            pass
+
+    return game_num
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式比赛的协调者和 worker")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="分配种子区间并收集结果")
+    coordinator_parser.add_argument("player_num", type=int, help="玩家数量")
+    coordinator_parser.add_argument("game_num", type=int, help="比赛局数")
+    coordinator_parser.add_argument("output", help="结果文件，以 .db 结尾时写入 SQLite 结果库，否则为 JSONL")
+    coordinator_parser.add_argument("--checkpoint", help="检查点文件，默认为 <output>.checkpoint")
+    coordinator_parser.add_argument("--first-seed", type=int, default=0)
+    coordinator_parser.add_argument("--chunk-size", type=int, default=256)
+    coordinator_parser.add_argument("--lease-timeout", type=float, default=600.0)
+    coordinator_parser.add_argument(
+        "--checkpoint-interval", type=float, default=60.0, help="保存检查点的间隔（秒）"
+    )
+    coordinator_parser.add_argument(
+        "--cost", action="append", default=[], metavar="SKILL=COST", help="修改招式消耗，可重复"
+    )
+    coordinator_parser.add_argument("--host", default="0.0.0.0")
+    coordinator_parser.add_argument("--port", type=int, default=8766)
+
+    worker_parser = subparsers.add_parser("worker", help="连接协调者执行比赛")
+    worker_parser.add_argument("--host", default="127.0.0.1")
+    worker_parser.add_argument("--port", type=int, default=8766)
+    worker_parser.add_argument("--processes", type=int, default=1)
+
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        print(f"完成 {run_worker(args.host, args.port, args.processes)} 局")
+        return
+
+    cost_overrides = dict(parse_cost_override(cost) for cost in args.cost)
+    checkpoint = TournamentCheckpoint(args.checkpoint or args.output + ".checkpoint")
+    writer_class = ResultStore if args.output.endswith(".db") else ResultWriter
+
+    with writer_class(args.output, args.player_num) as writer:
+        coordinator = Coordinator(
+            args.player_num,
+            args.game_num,
+            writer,
+            first_seed=args.first_seed,
+            chunk_size=args.chunk_size,
+            cost_overrides=cost_overrides,
+            lease_timeout=args.lease_timeout,
+            checkpoint=checkpoint,
+            checkpoint_interval=args.checkpoint_interval,
+        )
+        stats = asyncio.run(coordinator.run(args.host, args.port))
+
+    print(stats)
+    print(f"重新分配 {coordinator.retry_num} 次")
+
+
+if __name__ == "__main__":
+    main()
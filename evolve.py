@@ -0,0 +1,286 @@
+import argparse
+import functools
+import json
+import os
+import random
+from multiprocessing import Pool
+
+from agent import DEFAULT_HEURISTIC_PARAMS, HEURISTIC_PARAM_NAMES, HeuristicAgent
+from headless import MAX_ROUNDS, get_winner_id, play_game
+from tournament import make_random_agents
+
+# 参数保留的小数位数，使变异后的重复候选可以命中适应度缓存
+PARAM_DIGITS = 2
+
+
+def get_factory_id(factory) -> str:
+    """
+    工厂在不同进程和运行之间保持不变的标识：函数为 模块.限定名，
+    functools.partial 附带绑定的参数，其他可调用对象使用其类型和 repr
+
+    Args:
+        factory (Callable): agent 工厂
+
+    Returns:
+        str: 标识
+    """
+    if isinstance(factory, functools.partial):
+        arguments = [repr(arg) for arg in factory.args]
+        arguments += [f"{name}={value!r}" for name, value in sorted(factory.keywords.items())]
+        return f"{get_factory_id(factory.func)}({', '.join(arguments)})"
+
+    qualname = getattr(factory, "__qualname__", None)
+    if qualname is not None:
+        return f"{factory.__module__}.{qualname}"
+
+    factory_type = type(factory)
+    return f"{factory_type.__module__}.{factory_type.__qualname__}:{factory!r}"
+
+
+def evaluate_params(task: tuple) -> tuple[tuple, float]:
+    """
+    工作进程的入口：在一组种子上评估一组参数
+    每个种子的座位轮换，其他座位由 opponent_factory 生成，所有候选使用相同的种子和对手
+
+    Args:
+        task (tuple): (参数, 种子列表, 玩家数量, 对手工厂, 最大回合数)
+
+    Returns:
+        tuple[tuple, float]: 参数和胜率
+    """
+    params, seeds, player_num, opponent_factory, max_rounds = task
+    win_num = 0
+
+    for seed in seeds:
+        focal_seat = seed % player_num
+        agents = opponent_factory(seed, player_num)
+        agents[focal_seat] = HeuristicAgent(params, seed)
+        win_num += get_winner_id(play_game(agents, max_rounds)) == focal_seat
+
+    return params, win_num / len(seeds)
+
+
+class FitnessCache:
+    """
+    参数到适应度的缓存，可以持久化到 JSON 文件供下次搜索复用
+    键包含评估设置（玩家数量、种子、最大回合数和对手工厂），设置不同的结果不会混用
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.fitnesses = {}
+        self.hit_num = 0
+        self.miss_num = 0
+
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for key, fitness in json.load(f):
+                    self.fitnesses[tuple(key)] = fitness
+
+    @staticmethod
+    def make_key(params: tuple, setting: tuple) -> tuple:
+        return (*setting, *params)
+
+    def get(self, params: tuple, setting: tuple) -> float:
+        fitness = self.fitnesses.get(self.make_key(params, setting))
+        if fitness is None:
+            self.miss_num += 1
+        else:
+            self.hit_num += 1
+        return fitness
+
+    def put(self, params: tuple, setting: tuple, fitness: float):
+        self.fitnesses[self.make_key(params, setting)] = fitness
+
+    def save(self):
+        if not self.path:
+            return
+
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump([[list(key), fitness] for key, fitness in self.fitnesses.items()], f)
+
+
+def round_params(params) -> tuple:
+    return tuple(round(value, PARAM_DIGITS) for value in params)
+
+
+class EvolutionSearch:
+    """
+    HeuristicAgent 参数的 (mu + lambda) 进化搜索
+    每代的候选在同一组种子上并行评估（共同随机数），已评估过的候选直接使用缓存的适应度
+    """
+
+    def __init__(
+        self,
+        player_num: int = 3,
+        population_size: int = 24,
+        elite_num: int = 6,
+        mutation_scale: float = 0.3,
+        seed_num: int = 400,
+        first_seed: int = 0,
+        opponent_factory=make_random_agents,
+        max_rounds: int = MAX_ROUNDS,
+        cache: FitnessCache = None,
+        seed: int = 0,
+        opponent_id: str = None,
+    ):
+        """
+        Args:
+            player_num (int): 玩家数量
+            population_size (int): 每代候选数量
+            elite_num (int): 保留到下一代的最优候选数量
+            mutation_scale (float): 高斯变异的标准差
+            seed_num (int): 评估每个候选的局数
+            first_seed (int): 评估种子的起点，种子为 [first_seed, first_seed + seed_num)
+            opponent_factory (Callable[[int, int], list[Agent]]): 对手工厂，必须可被 pickle
+            max_rounds (int): 最大回合数
+            cache (FitnessCache): 适应度缓存
+            seed (int): 变异和交叉的随机种子
+            opponent_id (str): 适应度缓存中对手的标识，为 None 时由 get_factory_id 生成；
+                repr 不能区分的可调用对象应显式提供
+        """
+        self.player_num = player_num
+        self.population_size = population_size
+        self.elite_num = elite_num
+        self.mutation_scale = mutation_scale
+        self.seeds = list(range(first_seed, first_seed + seed_num))
+        self.opponent_factory = opponent_factory
+        self.max_rounds = max_rounds
+        self.cache = cache or FitnessCache()
+        self.rng = random.Random(seed)
+
+        # 缓存键中的评估设置，对手的标识在不同进程和运行之间保持不变
+        if opponent_id is None:
+            opponent_id = get_factory_id(opponent_factory)
+        self.setting = (player_num, first_seed, seed_num, max_rounds, opponent_id)
+        self.population = [round_params(DEFAULT_HEURISTIC_PARAMS)]
+        self.fitnesses = {}
+
+    def mutate(self, params: tuple) -> tuple:
+        return round_params(
+            value + self.rng.gauss(0.0, self.mutation_scale) for value in params
+        )
+
+    def crossover(self, a: tuple, b: tuple) -> tuple:
+        return tuple(x if self.rng.random() < 0.5 else y for x, y in zip(a, b))
+
+    def breed(self, elites: list[tuple]) -> list[tuple]:
+        """
+        由精英生成下一代：精英原样保留，其余为两个精英交叉后变异
+
+        Args:
+            elites (list[tuple]): 按适应度从高到低排列的精英
+
+        Returns:
+            list[tuple]: 下一代候选
+        """
+        population = list(elites)
+
+        while len(population) < self.population_size:
+            child = self.crossover(self.rng.choice(elites), self.rng.choice(elites))
+            population.append(self.mutate(child))
+
+        return population
+
+    def evaluate(self, population: list[tuple], pool: Pool = None):
+        """
+        评估一代候选，只有缓存中没有的候选会被实际模拟
+
+        Args:
+            population (list[tuple]): 候选参数
+            pool (Pool): 进程池，为 None 时在当前进程中执行
+        """
+        tasks = []
+
+        for params in dict.fromkeys(population):
+            fitness = self.cache.get(params, self.setting)
+            if fitness is None:
+                tasks.append(
+                    (params, self.seeds, self.player_num, self.opponent_factory, self.max_rounds)
+                )
+            else:
+                self.fitnesses[params] = fitness
+
+        results = map(evaluate_params, tasks) if pool is None else pool.imap_unordered(evaluate_params, tasks)
+        for params, fitness in results:
+            self.fitnesses[params] = fitness
+            self.cache.put(params, self.setting, fitness)
+
+    def get_best(self) -> tuple[tuple, float]:
+        best = max(self.fitnesses, key=self.fitnesses.get)
+        return best, self.fitnesses[best]
+
+    def run(self, generation_num: int, processes: int = None, callback=None) -> tuple[tuple, float]:
+        """
+        进化 generation_num 代
+
+        Args:
+            generation_num (int): 代数
+            processes (int): 进程数，为 1 时在当前进程中执行
+            callback (Callable[[int, tuple, float], None]): 每代结束后以 (代数, 最优参数, 最优适应度) 调用
+
+        Returns:
+            tuple[tuple, float]: 最优参数和适应度
+        """
+        pool = Pool(processes) if processes != 1 else None
+        population = self.breed(self.population)
+
+        try:
+            for generation in range(generation_num):
+                self.evaluate(population, pool)
+
+                ranked = sorted(dict.fromkeys(population), key=self.fitnesses.get, reverse=True)
+                self.population = ranked[: self.elite_num]
+
+                if callback:
+                    callback(generation, *self.get_best())
+
+                population = self.breed(self.population)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self.cache.save()
+
+        return self.get_best()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="进化搜索 HeuristicAgent 的参数")
+    parser.add_argument("generation_num", type=int, help="代数")
+    parser.add_argument("--player-num", type=int, default=3)
+    parser.add_argument("--population-size", type=int, default=24)
+    parser.add_argument("--elite-num", type=int, default=6)
+    parser.add_argument("--seed-num", type=int, default=400, help="评估每个候选的局数")
+    parser.add_argument("--holdout-num", type=int, default=2000, help="最终在新种子上复核的局数")
+    parser.add_argument("--cache", default=None, help="适应度缓存文件")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    search = EvolutionSearch(
+        args.player_num,
+        args.population_size,
+        args.elite_num,
+        seed_num=args.seed_num,
+        cache=FitnessCache(args.cache),
+    )
+
+    def report(generation: int, params: tuple, fitness: float):
+        print(f"第 {generation} 代：最优胜率 {fitness:.4f}，缓存命中 {search.cache.hit_num}")
+
+    best_params, best_fitness = search.run(args.generation_num, args.processes, report)
+
+    # 在搜索没有用过的种子上复核，避免对评估种子过拟合
+    first_holdout_seed = search.seeds[-1] + 1
+    holdout_seeds = list(range(first_holdout_seed, first_holdout_seed + args.holdout_num))
+    _, holdout_fitness = evaluate_params(
+        (best_params, holdout_seeds, args.player_num, search.opponent_factory, search.max_rounds)
+    )
+
+    print(f"最优胜率 {best_fitness:.4f}，新种子上胜率 {holdout_fitness:.4f}")
+    for name, value in zip(HEURISTIC_PARAM_NAMES, best_params):
+        print(f"{name:>16}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+"""
+对手混合策略下一回合结算结果的精确分布
+
+给定每个对手在 (招式, 目标) 宏动作上的概率分布（见 lookahead.get_macro_distribution），
+枚举所有联合动作并逐一结算，把相同的结算结果合并，得到候选动作的精确下一状态分布，不做蒙特卡洛采样。
+
+结算直接写入选择并执行招式和球的流程，跳过决策请求；需要附加决策的回合（写轮眼、影分身）
+退回完整的 Game.resolve_round_async，附加决策使用默认答案，与 TransitionCache 一致。
+两级缓存在所有候选和所有调用之间共享，状态以 state_codec.pack_values 的打包形式保存：
+    (状态, 联合宏动作) -> 结算结果
+    (招式执行后的玩家状态, 抵消后剩下的球) -> 结算结果
+很多联合动作的球在 handle_balls_counteract 之后完全相同，第二级缓存使它们只执行一次球效果。
+
+resolve_candidates 在对手动作固定时一次结算一个玩家的所有候选宏动作，
+对手的招式实例和排在候选招式之前的执行结果在候选之间共享，一步前瞻应使用它而不是逐个结算。
+"""
+
+import argparse
+import copy
+import operator
+import time
+
+import skill as sk
+from agent import RandomAgent, get_current_hp
+from game import Game
+from headless import quiet
+from lookahead import (
+    LRUCache,
+    TransitionCache,
+    get_joint_distribution,
+    get_macro_actions,
+    get_macro_distribution,
+    get_movable_ids,
+)
+from player import STATE_FIELDS, Player
+from skill import BallMatrix, Skill, skill_info_dict
+from state_codec import get_state_values, pack_values, set_state_values, unpack_values
+
+# 每级缓存的最大条目数
+OUTCOME_CACHE_SIZE = 1 << 16
+# 按 STATE_FIELDS 的顺序读取玩家状态
+get_player_fields = operator.attrgetter(*STATE_FIELDS)
+
+
+def get_ball_key(ball_matrix: BallMatrix) -> tuple:
+    """
+    球矩阵中剩余球的规范表示，按执行顺序排列，玩家引用替换为编号
+
+    Args:
+        ball_matrix (BallMatrix): 球矩阵
+
+    Returns:
+        tuple: 可哈希的表示
+    """
+    return tuple(
+        (type(ball).__name__,)
+        + tuple(
+            (name, value.id if isinstance(value, Player) else value)
+            for name, value in vars(ball).items()
+        )
+        for ball in ball_matrix.get_all_balls()
+    )
+
+
+def get_player_key(game: Game) -> tuple:
+    """
+    决定球结算结果的玩家状态：所有玩家的状态字段和预选
+    """
+    return (
+        game.round_count,
+        tuple(get_player_fields(player) for player in game.players),
+        tuple(game.preselected_skill_ids),
+        tuple(
+            tuple(target.id for target in targets)
+            for targets in game.preselected_skill_targets
+        ),
+    )
+
+
+class ExpectedOutcomeEvaluator:
+    """
+    按对手的混合策略精确计算一回合的结算结果分布
+    """
+
+    def __init__(self, player_num: int, cache_size: int = OUTCOME_CACHE_SIZE):
+        """
+        Args:
+            player_num (int): 玩家数量
+            cache_size (int): 每级缓存的最大条目数
+        """
+        self.game = Game(player_num, [None] * player_num)
+        self.joint_outcomes = LRUCache(cache_size)
+        self.ball_outcomes = LRUCache(cache_size)
+        self.transitions = TransitionCache(cache_size)
+        self.resolve_num = 0
+
+    def needs_decisions(self, macros: tuple) -> bool:
+        """
+        结算过程中是否会出现宏动作之外的决策（写轮眼复制、影分身目标）
+        """
+        game = self.game
+
+        for player in game.get_available_players():
+            macro = macros[player.id]
+            skill_id = macro[0] if macro is not None else game.skill_ids[player.id]
+
+            if skill_id == sk.SHARINGAN_ID or player.shadow_clone_num:
+                return True
+
+        return False
+
+    def resolve(self, values: tuple, macros: tuple) -> tuple:
+        """
+        结算一个联合动作
+
+        Args:
+            values (tuple[int]): 回合开始时（或选择招式时）的状态序列
+            macros (tuple): 每个座位的宏动作，不需要选择招式的玩家为 None
+
+        Returns:
+            tuple[int]: 结算后的状态序列，还没有进行看透预选
+        """
+        key = (pack_values(values), macros)
+        packed = self.joint_outcomes.get(key)
+        if packed is not None:
+            return unpack_values(packed)
+
+        game = self.game
+        set_state_values(game, values)
+
+        with quiet():
+            game.load_exposed_selection()
+
+            if self.needs_decisions(macros):
+                next_values = self.transitions.resolve(game, values, macros)
+            else:
+                next_values = self.resolve_directly(macros)
+
+        self.joint_outcomes.put(key, pack_values(next_values))
+        return next_values
+
+    def resolve_directly(self, macros: tuple) -> tuple:
+        """
+        不经过决策请求，直接写入选择后执行招式，球的结算按抵消后的结果缓存
+        """
+        game = self.game
+        players = game.players
+
+        for player in game.get_movable_players():
+            if macros[player.id] is None:
+                raise ValueError(f"{player} 需要选择招式，但没有给出宏动作")
+
+            skill_id, target_ids = macros[player.id]
+            game.skill_ids[player.id] = skill_id
+            game.skill_targets[player.id] = [players[target_id] for target_id in target_ids]
+
+        game.skill_history.clear()
+        game.load_selected_skills()
+        game.update_player_status()
+        game.apply_skills()
+        return self.resolve_balls()
+
+    def resolve_balls(self) -> tuple:
+        """
+        招式执行完后结算球、魂吸并清理，结果按抵消后剩下的球缓存
+
+        Returns:
+            tuple[int]: 结算后的状态序列
+        """
+        game = self.game
+        game.handle_balls_counteract()
+
+        ball_key = (get_player_key(game), get_ball_key(game.ball_matrix))
+        packed = self.ball_outcomes.get(ball_key)
+        if packed is not None:
+            return unpack_values(packed)
+
+        self.resolve_num += 1
+        game.handle_balls()
+        game.handle_life_steal()
+        game.clear_skills()
+        next_values = tuple(get_state_values(game))
+        self.ball_outcomes.put(ball_key, pack_values(next_values))
+        return next_values
+
+    def get_skill_sequence(self, skill_instances: list[Skill]) -> list[Skill]:
+        """
+        与 Game.apply_skills 相同的招式执行顺序：先攻招式，然后是去除重复后的其余招式
+
+        Args:
+            skill_instances (list[Skill]): 按玩家编号排列的招式实例
+
+        Returns:
+            list[Skill]: 按执行顺序排列的招式实例
+        """
+        game = self.game
+
+        # 心转身的重复标记由 preprocess_skill_list 设置，同一实例会在不同的组合中重复检查
+        for skill_instance in skill_instances:
+            if skill_instance.id == sk.MIND_BODY_SWITCH_ID:
+                skill_instance.is_target_repeated = False
+
+        game.skill_instances = list(skill_instances)
+        game.sort_skill_list()
+        priority_skills = [skill for skill in game.skill_instances if skill.priority == 0]
+        game.preprocess_skill_list()
+
+        return priority_skills + [skill for skill in game.skill_instances if skill.priority > 0]
+
+    def take_snapshot(self) -> tuple:
+        """
+        回合内的快照：玩家状态字段和球矩阵中的球（复制，之后的篡改招式不会影响快照）
+        招式和球只改变玩家和球矩阵，回合内游戏的其他状态不需要保存
+        """
+        game = self.game
+        return (
+            [get_player_fields(player) for player in game.players],
+            [[[copy.copy(ball) for ball in balls] for balls in row] for row in game.ball_matrix.matrix],
+        )
+
+    def restore_snapshot(self, snapshot: tuple, ball_matrix: BallMatrix):
+        """
+        恢复快照，球放回 ball_matrix，使招式实例持有的球矩阵引用保持有效
+        """
+        game = self.game
+        player_fields, matrix = snapshot
+
+        for player, fields in zip(game.players, player_fields):
+            for field, value in zip(STATE_FIELDS, fields):
+                setattr(player, field, value)
+
+        ball_matrix.matrix = [[[copy.copy(ball) for ball in balls] for balls in row] for row in matrix]
+        game.ball_matrix = ball_matrix
+
+    def resolve_candidates(
+        self, values: tuple, player_id: int, other_macros: dict, macros: list = None
+    ) -> dict:
+        """
+        其他玩家的宏动作固定时，批量结算一个玩家所有候选宏动作的回合结果
+
+        候选之间共享的工作只做一次：其他玩家的招式实例（含耗蓝）和状态更新，
+        以及执行顺序在候选招式之前的其他玩家招式（先攻阶段、空间和状态招式、已插入的球）。
+        每个候选从对应的前缀快照恢复，只执行自己的招式和之后的部分。
+        结果与逐个调用 resolve 完全一致，需要附加决策的候选仍逐个走完整结算。
+
+        Args:
+            values (tuple[int]): 回合开始时的状态序列
+            player_id (int): 玩家编号
+            other_macros (dict[int, tuple]): 其他玩家编号到宏动作的映射，不需要选择招式的玩家可以省略
+            macros (list[tuple]): 候选宏动作，为 None 时使用玩家所有合法的宏动作
+
+        Returns:
+            dict[tuple, tuple[int]]: 宏动作到结算后状态序列的映射，顺序与候选一致
+        """
+        game = self.game
+        player_num = game.player_num
+        set_state_values(game, values)
+
+        with quiet():
+            game.load_exposed_selection()
+
+            if macros is None:
+                player = game.players[player_id]
+                macros = (
+                    get_macro_actions(game, player)
+                    if player_id in get_movable_ids(game)
+                    else [None]
+                )
+
+            results = dict.fromkeys(macros)
+            shared_macros = []
+            separate_macros = []
+            packed_values = pack_values(values)
+
+            for macro in macros:
+                joint_macros = tuple(
+                    macro if i == player_id else other_macros.get(i) for i in range(player_num)
+                )
+                packed = self.joint_outcomes.get((packed_values, joint_macros))
+
+                if packed is not None:
+                    results[macro] = unpack_values(packed)
+                elif self.needs_decisions(joint_macros):
+                    separate_macros.append(joint_macros)
+                else:
+                    shared_macros.append(joint_macros)
+
+            if shared_macros:
+                for joint_macros, next_values in zip(
+                    shared_macros, self.resolve_shared(player_id, shared_macros)
+                ):
+                    results[joint_macros[player_id]] = next_values
+                    self.joint_outcomes.put((packed_values, joint_macros), pack_values(next_values))
+
+        # resolve 会重新设置状态，放在共享结算之后
+        for joint_macros in separate_macros:
+            results[joint_macros[player_id]] = self.resolve(values, joint_macros)
+
+        return results
+
+    def resolve_shared(self, player_id: int, joint_macros_list: list[tuple]) -> list[tuple]:
+        """
+        resolve_candidates 的共享结算，游戏必须处于载入看透选择之后
+
+        Args:
+            player_id (int): 玩家编号
+            joint_macros_list (list[tuple]): 每个候选的联合宏动作，只有该玩家的宏动作不同
+
+        Returns:
+            list[tuple[int]]: 每个候选结算后的状态序列
+        """
+        game = self.game
+        players = game.players
+        player = players[player_id]
+        game.skill_history.clear()
+
+        for other in game.get_movable_players():
+            if other.id == player_id:
+                continue
+            if joint_macros_list[0][other.id] is None:
+                raise ValueError(f"{other} 需要选择招式，但没有给出宏动作")
+
+            skill_id, target_ids = joint_macros_list[0][other.id]
+            game.skill_ids[other.id] = skill_id
+            game.skill_targets[other.id] = [players[target_id] for target_id in target_ids]
+
+        # 其他玩家的招式只实例化一次，按玩家编号排列
+        fixed_instances = {}
+        for other in game.get_available_players():
+            if other.id != player_id:
+                skill_instance = game.load_selected_skill(other)
+                if skill_instance is not None:
+                    fixed_instances[other.id] = skill_instance
+
+        # 候选招式在同一状态下实例化，记下实例化后的查克拉和写轮眼标记再还原
+        # 招式可能直接设置查克拉（如秽土转生），实例化的影响不能在执行之后再补上，
+        # 因此前缀快照按实例化后的这两个值分组，耗蓝相同的候选共享同一组快照
+        mp = player.mp
+        is_using_sharingan = player.is_using_sharingan
+        candidates = []
+        for joint_macros in joint_macros_list:
+            macro = joint_macros[player_id]
+            if macro is not None:
+                skill_id, target_ids = macro
+                game.skill_ids[player_id] = skill_id
+                game.skill_targets[player_id] = [players[target_id] for target_id in target_ids]
+
+            skill_instance = game.load_selected_skill(player) if player.is_available() else None
+            candidates.append((skill_instance, (player.mp, player.is_using_sharingan)))
+            player.mp = mp
+            player.is_using_sharingan = is_using_sharingan
+
+        game.update_player_status()
+
+        # 只有其他玩家招式时的执行顺序
+        ball_matrix = game.ball_matrix
+        fixed_sequence = self.get_skill_sequence(
+            [fixed_instances[i] for i in sorted(fixed_instances)]
+        )
+        base_snapshot = self.take_snapshot()
+        snapshot_groups = {}
+        outcomes = []
+
+        for skill_instance, instantiated in candidates:
+            # 执行每个前缀之后的快照
+            snapshots = snapshot_groups.get(instantiated)
+            if snapshots is None:
+                self.restore_snapshot(base_snapshot, ball_matrix)
+                player.mp, player.is_using_sharingan = instantiated
+                snapshots = [self.take_snapshot()]
+                for fixed_skill in fixed_sequence:
+                    fixed_skill.apply()
+                    snapshots.append(self.take_snapshot())
+                snapshot_groups[instantiated] = snapshots
+
+            if skill_instance is None:
+                sequence = fixed_sequence
+            else:
+                skill_instances = dict(fixed_instances)
+                skill_instances[player_id] = skill_instance
+                sequence = self.get_skill_sequence(
+                    [skill_instances[i] for i in sorted(skill_instances)]
+                )
+
+            shared_num = 0
+            for fixed_skill, skill in zip(fixed_sequence, sequence):
+                if fixed_skill is not skill:
+                    break
+                shared_num += 1
+
+            self.restore_snapshot(snapshots[shared_num], ball_matrix)
+            for skill in sequence[shared_num:]:
+                skill.apply()
+
+            outcomes.append(self.resolve_balls())
+
+        return outcomes
+
+    def get_outcome_distribution(
+        self, values: tuple, player_id: int, macro: tuple, distributions: dict
+    ) -> list[tuple]:
+        """
+        玩家使用一个宏动作时本回合结算结果的精确分布
+
+        Args:
+            values (tuple[int]): 选择招式时的状态序列
+            player_id (int): 玩家编号
+            macro (tuple): 玩家的宏动作
+            distributions (dict[int, list[tuple[tuple, float]]]): 其他玩家编号到宏动作分布的映射
+
+        Returns:
+            list[tuple[tuple[int], float]]: (结算后的状态序列, 概率)，相同的结果已合并，按概率从高到低排列
+        """
+        player_num = self.game.player_num
+        outcomes = {}
+
+        for joint_macros, probability in get_joint_distribution(distributions):
+            macros = tuple(
+                macro if i == player_id else joint_macros.get(i) for i in range(player_num)
+            )
+            next_values = self.resolve(values, macros)
+            outcomes[next_values] = outcomes.get(next_values, 0.0) + probability
+
+        return sorted(outcomes.items(), key=lambda item: item[1], reverse=True)
+
+    def get_outcome_distributions(
+        self, values: tuple, player_id: int, distributions: dict, macros: list = None
+    ) -> dict:
+        """
+        玩家每个候选宏动作的结算结果精确分布，每个对手联合动作用 resolve_candidates 批量结算所有候选
+
+        Args:
+            values (tuple[int]): 选择招式时的状态序列
+            player_id (int): 玩家编号
+            distributions (dict[int, list[tuple[tuple, float]]]): 其他玩家编号到宏动作分布的映射
+            macros (list[tuple]): 候选宏动作，为 None 时使用玩家所有合法的宏动作
+
+        Returns:
+            dict[tuple, list[tuple[tuple[int], float]]]: 宏动作到 get_outcome_distribution 格式结果的映射
+        """
+        outcomes = None
+
+        for joint_macros, probability in get_joint_distribution(distributions):
+            results = self.resolve_candidates(values, player_id, joint_macros, macros)
+            if outcomes is None:
+                outcomes = {macro: {} for macro in results}
+
+            for macro, next_values in results.items():
+                macro_outcomes = outcomes[macro]
+                macro_outcomes[next_values] = macro_outcomes.get(next_values, 0.0) + probability
+
+        return {
+            macro: sorted(macro_outcomes.items(), key=lambda item: item[1], reverse=True)
+            for macro, macro_outcomes in outcomes.items()
+        }
+
+    def get_expected_value(
+        self, values: tuple, player_id: int, macro: tuple, distributions: dict, value_function
+    ) -> float:
+        """
+        结算结果估值的期望
+
+        Args:
+            values (tuple[int]): 选择招式时的状态序列
+            player_id (int): 玩家编号
+            macro (tuple): 玩家的宏动作
+            distributions (dict): 其他玩家编号到宏动作分布的映射
+            value_function (Callable[[tuple[int]], float]): 结算后状态的估值
+
+        Returns:
+            float: 期望估值
+        """
+        return sum(
+            probability * value_function(next_values)
+            for next_values, probability in self.get_outcome_distribution(
+                values, player_id, macro, distributions
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="随机对手下初始状态每个宏动作的精确结算分布")
+    parser.add_argument("--player-num", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="显示期望生命值最高的前几个宏动作")
+    args = parser.parse_args()
+
+    evaluator = ExpectedOutcomeEvaluator(args.player_num)
+    game = evaluator.game
+    values = tuple(get_state_values(game))
+
+    with quiet():
+        macros = get_macro_actions(game, game.players[0])
+        distributions = {
+            player.id: get_macro_distribution(RandomAgent(), game, player)
+            for player in game.players[1:]
+        }
+
+    def get_hp(next_values: tuple) -> float:
+        set_state_values(game, next_values)
+        return get_current_hp(game.players[0])
+
+    start_time = time.perf_counter()
+    results = []
+    outcome_num = 0
+
+    for macro, outcomes in evaluator.get_outcome_distributions(values, 0, distributions, macros).items():
+        outcome_num += len(outcomes)
+        results.append(
+            (sum(probability * get_hp(next_values) for next_values, probability in outcomes), macro)
+        )
+
+    elapsed = time.perf_counter() - start_time
+    joint_num = len(macros) * len(get_joint_distribution(distributions))
+
+    print(
+        f"{len(macros)} 个宏动作，{joint_num} 个联合动作，{outcome_num} 个不同结果，"
+        f"球结算 {evaluator.resolve_num} 次，用时 {elapsed:.2f} 秒"
+    )
+    for hp, (skill_id, targets) in sorted(results, reverse=True)[: args.top]:
+        print(f"{skill_info_dict[skill_id].name:>8} {list(targets)}  期望生命值 {hp:.3f}")
+
+
+if __name__ == "__main__":
+    main()
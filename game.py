@@ -1,9 +1,47 @@
 import skill as sk
+import decision
 from skill import Skill, SkillInfo, skill_info_dict, BallMatrix
 from player import Player
+from agent import TerminalAgent
+from decision import DecisionRequest
+from state_codec import encode_state
 
 from collections import defaultdict
-import re
+import inspect
+
+
+def run_sync(coroutine):
+    """
+    不借助事件循环同步执行协程
+    所有 agent 都直接返回答案时协程不会挂起，一次 send 即可执行完毕
+
+    Args:
+        coroutine (Coroutine): 要执行的协程
+
+    Returns:
+        Any: 协程的返回值
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+    coroutine.close()
+    raise RuntimeError("协程在等待异步决策，需要在事件循环中运行")
+
+
+class ExternalDecisions:
+    """
+    交给游戏外部回答的一批决策请求
+    await 时把请求列表交给驱动协程的一方（见 Game.steps），并以其 send 回来的答案列表作为结果
+    """
+
+    def __init__(self, requests: list[DecisionRequest]):
+        self.requests = requests
+
+    def __await__(self):
+        answers = yield self.requests
+        return answers
 
 
 class Game:
@@ -29,11 +67,18 @@ class Game:
         看透玩家选择招式
     """
 
-    def __init__(self, player_num):
+    def __init__(self, player_num, agents=None, keyframe_interval=0):
         self.round_count = 1
 
         self.player_num = player_num
-        self.players = [Player(i) for i in range(player_num)]
+        # 默认所有玩家都由人类通过终端输入操作，agent 为 None 的玩家由外部通过 steps 回答
+        self.agents = (
+            agents if agents else [TerminalAgent() for _ in range(player_num)]
+        )
+        self.players = [
+            Player(i, isinstance(self.agents[i], TerminalAgent))
+            for i in range(player_num)
+        ]
 
         self.skill_ids = [-1] * player_num
         self.skill_targets = [[] for _ in range(player_num)]
@@ -43,6 +88,54 @@ class Game:
         self.skill_instances = []
         self.ball_matrix = BallMatrix(player_num)
 
+        # 每个玩家各招式的实际发动次数
+        self.skill_counts = [[0] * sk.SKILL_NUM for _ in range(player_num)]
+        # 实际发动的招式记录 (回合, 玩家编号, 招式编号)
+        self.skill_history = []
+
+        # 回放记录：按顺序记录每一次决策 (回合, 玩家编号, 选择)
+        self.action_log = []
+        # 每 keyframe_interval 回合在回合开始时记录一次完整快照（state_codec 完整帧），0 表示不记录
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = {}
+
+    def get_state(self) -> dict:
+        """
+        获取回合开始时的完整游戏状态快照
+
+        Returns:
+            dict: 游戏状态
+        """
+        return {
+            "round_count": self.round_count,
+            "players": [player.get_state() for player in self.players],
+            "preselected_skill_ids": list(self.preselected_skill_ids),
+            "preselected_skill_targets": [
+                [target.id for target in targets]
+                for targets in self.preselected_skill_targets
+            ],
+        }
+
+    def load_state(self, state: dict):
+        """
+        从快照恢复游戏状态，快照必须来自相同玩家数量的游戏
+
+        Args:
+            state (dict): get_state 返回的快照
+        """
+        self.round_count = state["round_count"]
+
+        for player, player_state in zip(self.players, state["players"]):
+            player.load_state(player_state)
+
+        self.preselected_skill_ids = list(state["preselected_skill_ids"])
+        self.preselected_skill_targets = [
+            [self.players[target_id] for target_id in target_ids]
+            for target_ids in state["preselected_skill_targets"]
+        ]
+
+        self.clear_skills()
+
     def is_game_over(self):
         return len(self.get_available_players()) <= 1
 
@@ -210,64 +303,154 @@ class Game:
 
                 self.preselected_skill_targets[player.id] = []
 
-    def select_skill_id(self, player: Player, legal_skills: list[SkillInfo]) -> int:
+    async def decide(self, requests: list[DecisionRequest]) -> list:
         """
-        玩家选择招式编号
+        向玩家同时发出一批决策请求并等待全部答案
+        agent 可以直接返回答案，也可以返回 awaitable（例如网络玩家），所有请求发出后才开始等待
+        没有 agent 的玩家的请求合并为一批交给外部回答
 
         Args:
-            player (Player): 使用招式的玩家
-            legal_skills (list[SkillInfo]): 可选招式信息
+            requests (list[DecisionRequest]): 决策请求列表
 
         Returns:
-            int: 招式编号
+            list[int | list[int]]: 与请求一一对应的答案
         """
-        if not legal_skills or legal_skills[0] == sk.NONE_ACTION_ID:
-            print(f'{player} 不需要选择招式')
-            return -1
+        answers = [None] * len(requests)
+        external_indices = []
 
-        if player.is_human:
-            skill_id = self.user_select_skill_id(legal_skills)
-            
-            print(f'{player} 选择了 <{skill_info_dict[skill_id].name}>')
-            return skill_id
+        for i, request in enumerate(requests):
+            agent = self.agents[request.player_id]
+            if agent is None:
+                external_indices.append(i)
+            else:
+                answers[i] = agent.decide(self, request)
+
+        if external_indices:
+            external_answers = await ExternalDecisions(
+                [requests[i] for i in external_indices]
+            )
+            for i, answer in zip(external_indices, external_answers):
+                answers[i] = answer
+
+        for i, answer in enumerate(answers):
+            if inspect.isawaitable(answer):
+                answers[i] = await answer
+
+        for request, answer in zip(requests, answers):
+            self.action_log.append((request.round_count, request.player_id, answer))
+
+        return answers
 
-    def select_skill_targets(
-        self, player: Player, legal_targets: list[Player], target_num: int
-    ) -> list[Player]:
+    async def select_skill_ids(
+        self,
+        players: list[Player],
+        legal_skills_list: list[list[SkillInfo]],
+        kind: str = decision.SKILL,
+    ) -> list[int]:
         """
-        玩家选择招式目标
+        多个玩家同时选择招式编号
 
         Args:
-            player (Player): 使用招式的玩家
-            legal_targets (list[Player]): 可选目标列表
-            target_num (int): 目标数量
+            players (list[Player]): 使用招式的玩家
+            legal_skills_list (list[list[SkillInfo]]): 每个玩家的可选招式信息
+            kind (str): 决策类型
 
         Returns:
-            list[Player]: 选择的目标列表
-        """
-        if target_num == 0:
-            print(f'{player} 不需要选择目标')
-            return []
-        elif not legal_targets:
-            print(f'{player} 没有可选择的目标，无效')
-            return []
-        elif len(legal_targets) == 1:  # 没得选
-            print(f'{player} 只能选择目标 {legal_targets[0]}')
-            return legal_targets * target_num
-
-        if player.is_human:
-            targets = self.user_select_skill_targets(legal_targets, target_num)
-            
-            print(f'{player} 选择了 {[t.__str__() for t in targets]}')
-            return targets
+            list[int]: 每个玩家的招式编号
+        """
+        skill_ids = [sk.NONE_ACTION_ID] * len(players)
+        request_indices = []
+        requests = []
+
+        for i, (player, legal_skills) in enumerate(zip(players, legal_skills_list)):
+            if not legal_skills:
+                print(f'{player} 不需要选择招式')
+                continue
+
+            request_indices.append(i)
+            requests.append(
+                DecisionRequest(
+                    kind,
+                    player.id,
+                    self.round_count,
+                    [skill.id for skill in legal_skills],
+                )
+            )
 
-    def handle_skill_ids_selection(self, is_preselection=False):
+        answers = await self.decide(requests)
+
+        for i, skill_id in zip(request_indices, answers):
+            print(f'{players[i]} 选择了 <{skill_info_dict[skill_id].name}>')
+            skill_ids[i] = skill_id
+
+        return skill_ids
+
+    async def select_skill_targets(
+        self,
+        players: list[Player],
+        legal_targets_list: list[list[Player]],
+        skill_ids: list[int],
+        kind: str = decision.TARGETS,
+    ) -> list[list[Player]]:
         """
-        正常玩家选择招式或看透玩家选择招式
+        多个玩家同时选择招式目标
 
         Args:
-            player_list (list[Player]): 玩家列表
-            id_list (list[int]): 存储选择的 id 的目的地
+            players (list[Player]): 使用招式的玩家
+            legal_targets_list (list[list[Player]]): 每个玩家的可选目标列表
+            skill_ids (list[int]): 每个玩家选择目标的招式
+            kind (str): 决策类型
+
+        Returns:
+            list[list[Player]]: 每个玩家选择的目标列表
+        """
+        targets_list = [[] for _ in players]
+        request_indices = []
+        requests = []
+
+        for i, (player, legal_targets, skill_id) in enumerate(
+            zip(players, legal_targets_list, skill_ids)
+        ):
+            target_num = skill_info_dict[skill_id].target_num
+
+            if target_num == 0:
+                print(f'{player} 不需要选择目标')
+                continue
+            elif not legal_targets:
+                print(f'{player} 没有可选择的目标，无效')
+                continue
+            elif len(legal_targets) == 1:  # 没得选
+                print(f'{player} 只能选择目标 {legal_targets[0]}')
+                targets_list[i] = legal_targets * target_num
+                continue
+
+            request_indices.append(i)
+            requests.append(
+                DecisionRequest(
+                    kind,
+                    player.id,
+                    self.round_count,
+                    [target.id for target in legal_targets],
+                    target_num,
+                    skill_id,
+                )
+            )
+
+        answers = await self.decide(requests)
+
+        for i, target_ids in zip(request_indices, answers):
+            targets = [self.players[target_id] for target_id in target_ids]
+            print(f'{players[i]} 选择了 {[t.__str__() for t in targets]}')
+            targets_list[i] = targets
+
+        return targets_list
+
+    async def handle_skill_ids_selection(self, is_preselection=False):
+        """
+        正常玩家选择招式或看透玩家选择招式，所有玩家同时选择
+
+        Args:
+            is_preselection (bool): 是否为看透玩家的预选
         """
         player_list = (
             self.get_exposed_players()
@@ -276,24 +459,30 @@ class Game:
         )
         id_list = self.preselected_skill_ids if is_preselection else self.skill_ids
 
+        legal_skills_list = []
         for player in player_list:
             if is_preselection:
                 print(f"{player} 开始预选招式")
             else:
                 print(f"{player} 开始选择招式")
 
-            legal_skills = self.get_leagl_skills(player)
-            skill_id = self.select_skill_id(player, legal_skills)
+            legal_skills_list.append(self.get_leagl_skills(player))
+
+        skill_ids = await self.select_skill_ids(
+            player_list,
+            legal_skills_list,
+            decision.PRESELECT_SKILL if is_preselection else decision.SKILL,
+        )
 
+        for player, skill_id in zip(player_list, skill_ids):
             id_list[player.id] = skill_id
 
-    def handle_skill_targets_selection(self, is_preselection=False):
+    async def handle_skill_targets_selection(self, is_preselection=False):
         """
-        正常玩家选择目标或看透玩家选择目标
+        正常玩家选择目标或看透玩家选择目标，所有玩家同时选择
 
         Args:
-            player_list (list[Player]): 玩家列表
-            target_list (list[Player]): 存储选择的 target 的目的地
+            is_preselection (bool): 是否为看透玩家的预选
         """
         player_list = (
             self.get_exposed_players()
@@ -304,21 +493,29 @@ class Game:
             self.preselected_skill_targets if is_preselection else self.skill_targets
         )
 
+        legal_targets_list = []
+        skill_ids = []
         for player in player_list:
             if is_preselection:
                 print(f"{player} 开始预选 {skill_info_dict[self.preselected_skill_ids[player.id]].name}  的目标")
             else:
                 print(f"{player} 开始选择 {skill_info_dict[self.skill_ids[player.id]].name} 的目标")
 
-            skill_id = (
+            skill_ids.append(
                 self.preselected_skill_ids[player.id]
                 if is_preselection
                 else self.skill_ids[player.id]
             )
-            legal_targets = self.get_legal_skill_targets(player)
-            target_num = skill_info_dict[skill_id].target_num
-            targets = self.select_skill_targets(player, legal_targets, target_num)
+            legal_targets_list.append(self.get_legal_skill_targets(player))
+
+        targets_list = await self.select_skill_targets(
+            player_list,
+            legal_targets_list,
+            skill_ids,
+            decision.PRESELECT_TARGETS if is_preselection else decision.TARGETS,
+        )
 
+        for player, targets in zip(player_list, targets_list):
             target_list[player.id] = targets
 
     def instantiate_skill(
@@ -412,33 +609,50 @@ class Game:
         if not skill_instance:
             print(f'[WARNING]: 无效技能 {source} {targets} {skill_id}')
 
+        self.skill_counts[source.id][skill_id] += 1
+        self.skill_history.append((self.round_count, source.id, skill_id))
+
         if not source.is_using_sharingan:   # 用写轮眼复制的招式不额外耗蓝
-            source.use_mp(skill_instance.cost)
+            source.use_mp(skill_info_dict[skill_id].cost)
         else:
             source.use_mp(skill_info_dict[sk.SHARINGAN_ID].cost)
             source.is_using_sharingan = False   # 清空状态
+            self.skill_counts[source.id][sk.SHARINGAN_ID] += 1
 
         return skill_instance
 
+    def load_selected_skill(self, player: Player) -> Skill:
+        """
+        实例化一个玩家选择的招式，不加入招式列表
+
+        Args:
+            player (Player): 玩家
+
+        Returns:
+            Skill: 招式实例，没有选择招式或没有目标时为 None
+        """
+        skill_id = self.skill_ids[player.id]
+        skill_targets = self.skill_targets[player.id]
+
+        # 无释放招式
+        if skill_id == -1:
+            return None
+        if skill_info_dict[skill_id].target_num > len(skill_targets):
+            print(f'{player} 无目标，无法发动 <{skill_info_dict[skill_id].name}>')
+            return None
+
+        return self.instantiate_skill(skill_id, player, skill_targets)
+
     def load_selected_skills(self):
         """
         载入招式
         """
         for player in self.get_available_players():
-            skill_id = self.skill_ids[player.id]
-            skill_targets = self.skill_targets[player.id]
-
-            # 无释放招式
-            if skill_id == -1:
-                continue
-            if skill_info_dict[skill_id].target_num > len(skill_targets):
-                print(f'{player} 无目标，无法发动 <{skill_info_dict[skill_id].name}>')
-                continue
+            skill_instance = self.load_selected_skill(player)
+            if skill_instance is not None:
+                self.skill_instances.append(skill_instance)
 
-            skill_instance = self.instantiate_skill(skill_id, player, skill_targets)
-            self.skill_instances.append(skill_instance)
-
-    def handle_shadow_clone_skills(self):
+    async def handle_shadow_clone_skills(self):
         """
         载入影分身招式
         """
@@ -449,23 +663,29 @@ class Game:
         for player in shadow_clone_players:
             skill_id = self.skill_ids[player.id]
 
+            # 无行动或写轮眼（复制的招式在之后才确定）不触发影分身
+            if skill_id == sk.NONE_ACTION_ID or skill_id == sk.SHARINGAN_ID:
+                continue
+
             while (
-                player.shadow_clone_num and skill_info_dict[player.id].cost <= player.mp
+                player.shadow_clone_num and skill_info_dict[skill_id].cost <= player.mp
             ):
                 player.add_shadow_clone_num(-1)
 
                 print(f'\n{player} 开始选择 <影分身 {player.shadow_clone_num}> 的目标')
 
                 legal_targets = self.get_legal_skill_targets(player)
-                target_num = skill_info_dict[skill_id].target_num
-                targets = self.select_skill_targets(player, legal_targets, target_num)
+                (targets,) = await self.select_skill_targets(
+                    [player], [legal_targets], [skill_id], decision.SHADOW_CLONE_TARGETS
+                )
 
                 shadow_skill_instance = self.instantiate_skill(
                     skill_id, player, targets
                 )
-                self.skill_instances.append(shadow_skill_instance)
+                if shadow_skill_instance:
+                    self.skill_instances.append(shadow_skill_instance)
 
-    def handle_sharingan_skills(self):
+    async def handle_sharingan_skills(self):
         """
         选择并载入写轮眼复制的招式
         """
@@ -481,13 +701,16 @@ class Game:
             player.is_using_sharingan = True
 
             imitable_skills = self.get_imitable_skills(player)
-            skill_id = self.select_skill_id(player, imitable_skills)
+            (skill_id,) = await self.select_skill_ids(
+                [player], [imitable_skills], decision.SHARINGAN_SKILL
+            )
 
             self.skill_ids[player.id] = skill_id    # 覆盖原 id
             legal_targets = self.get_legal_skill_targets(player)
 
-            target_num = skill_info_dict[skill_id].target_num
-            skill_targets = self.select_skill_targets(player, legal_targets, target_num)
+            (skill_targets,) = await self.select_skill_targets(
+                [player], [legal_targets], [skill_id], decision.SHARINGAN_TARGETS
+            )
             
             self.skill_targets[player.id] = skill_targets   # 覆盖原 target
             
@@ -628,100 +851,114 @@ class Game:
         self.skill_instances = []
         self.ball_matrix = BallMatrix(self.player_num)
 
-    def user_select_skill_id(self, legal_skills: list[SkillInfo]) -> int:
-        print("可选择的招式如下：")
-        for skill in legal_skills:
-            print(f"{skill.id}: {skill.name}")
-
-        skill_id = input("请输入招式编号：")
+    def run_round(self):
+        """
+        执行完整的一回合，要求所有 agent 都直接返回答案
+        """
+        run_sync(self.run_round_async())
 
-        legal_skill_ids = [s.id for s in legal_skills]
-        while not str.isdigit(skill_id) or int(skill_id) not in legal_skill_ids:
-            print("可选择的招式如下：")
-            for skill in legal_skills:
-                print(f"{skill.id}: {skill.name}")
-            skill_id = input(
-                f"输入的编号 {skill_id} 不在合法编号 {legal_skill_ids} 内\n请输入合法编号："
+    async def run_round_async(self):
+        """
+        执行完整的一回合，玩家的决策可以是异步的
+        """
+        # 记录关键帧
+        if (
+            self.keyframe_interval
+            and (self.round_count - 1) % self.keyframe_interval == 0
+        ):
+            self.keyframes[self.round_count] = (
+                encode_state(self),
+                len(self.action_log),
             )
 
-        return int(skill_id)
+        await self.resolve_round_async()
+        await self.finish_round_async()
+
+    async def resolve_round_async(self):
+        """
+        执行一回合从选择招式到结算完毕的部分，不包括看透的预选
+        结算只依赖回合开始时的状态和本回合的决策，可以单独用于前瞻搜索
+        """
+        print("\n——————————————————————————————")
+        print(f"开始第 {self.round_count} 回合")
+
+        for player in self.players:
+            player.print_status()
+
+        # 加载预选招式
+        self.load_exposed_selection()
+
+        # 选择招式
+        print("\n↓↓↓↓↓↓ 玩家开始选择招式 ↓↓↓↓↓↓↓\n")
+        await self.handle_skill_ids_selection()
 
-    def user_select_skill_targets(
-        self, legal_targets: list[Player], target_num: int
-    ) -> list[Player]:
-        def is_valid_input(s: str, legal_target_ids: list[int], target_num: int):
-            if not s or not all(re.fullmatch(r"-?\d+", num) for num in s.split()):
-                return False
+        # 选择目标
+        print("\n↓↓↓↓↓↓ 玩家开始选择目标 ↓↓↓↓↓↓↓\n")
+        await self.handle_skill_targets_selection()
+        await self.handle_shadow_clone_skills()
+        await self.handle_sharingan_skills()
 
-            target_ids = list(map(int, s.split()))
-            if len(target_ids) != target_num:
-                return False
+        # 实例化
+        print("\n↓↓↓↓↓↓ 玩家选择完毕，开始执行 ↓↓↓↓↓↓↓\n")
+        self.load_selected_skills()
 
-            if any(target_id not in legal_target_ids for target_id in target_ids):
-                return False
+        # 更新玩家状态
+        self.update_player_status()
 
-            return True
+        # 执行
+        self.apply_skills()
+        self.handle_balls()
+        self.handle_life_steal()
+        self.clear_skills()
 
-        legal_target_ids = [target.id for target in legal_targets]
+    async def finish_round_async(self):
+        """
+        看透玩家预选下回合的招式和目标，然后进入下一回合
+        """
+        # 看透预选择
+        print("\n------ 开始看透的预选阶段 ------\n")
+        await self.handle_skill_ids_selection(True)
+        await self.handle_skill_targets_selection(True)
 
-        print("可选择的目标有：")
-        for target in legal_targets:
-            print(f"{target.id}：{target}")
+        self.round_count += 1
 
-        target_id_str = input(f"请输入 {target_num} 个目标（目标可重复）：")
+    def steps(self, max_rounds: int = None):
+        """
+        以生成器的方式逐步推进游戏，直到游戏结束或超过最大回合数
+        每当没有 agent 的玩家需要决策时，产出一批同时进行的决策请求 (list[DecisionRequest])，
+        调用方通过 send 传回与请求一一对应的答案列表后游戏继续
 
-        while not is_valid_input(target_id_str, legal_target_ids, target_num):
-            print("输入有误，可选择的目标有：")
-            for target in legal_targets:
-                print(f"{target.id}：{target}")
+        用法：
+            steps = game.steps()
+            requests = next(steps)
+            while True:
+                requests = steps.send(answer(requests))   # 游戏结束时抛出 StopIteration
 
-            target_id_str = input(f"请输入 {target_num} 个目标（目标可重复）：")
+        Args:
+            max_rounds (int): 最大回合数，None 表示不限
+
+        Yields:
+            list[DecisionRequest]: 待回答的决策请求
+        """
+        while not self.is_game_over() and (
+            max_rounds is None or self.round_count <= max_rounds
+        ):
+            coroutine = self.run_round_async()
+            answers = None
 
-        target_ids = list(map(int, target_id_str.split()))
+            while True:
+                try:
+                    requests = coroutine.send(answers)
+                except StopIteration:
+                    break
 
-        return [self.players[target_id] for target_id in target_ids]
+                answers = yield requests
 
     def run(self):
         print("游戏开始")
 
         while True:
-            print("\n——————————————————————————————")
-            print(f"开始第 {self.round_count} 回合")
-            self.round_count += 1
-
-            for player in self.players:
-                player.print_status()
-
-            # 加载预选招式
-            self.load_exposed_selection()
-
-            # 选择招式
-            print("\n↓↓↓↓↓↓ 玩家开始选择招式 ↓↓↓↓↓↓↓\n")
-            self.handle_skill_ids_selection()
-
-            # 选择目标
-            print("\n↓↓↓↓↓↓ 玩家开始选择目标 ↓↓↓↓↓↓↓\n")
-            self.handle_skill_targets_selection()
-            self.handle_shadow_clone_skills()
-            self.handle_sharingan_skills()
-
-            # 实例化
-            print("\n↓↓↓↓↓↓ 玩家选择完毕，开始执行 ↓↓↓↓↓↓↓\n")
-            self.load_selected_skills()
-
-            # 更新玩家状态
-            self.update_player_status()
-
-            # 执行
-            self.apply_skills()
-            self.handle_balls()
-            self.handle_life_steal()
-            self.clear_skills()
-
-            # 看透预选择
-            print("\n------ 开始看透的预选阶段 ------\n")
-            self.handle_skill_ids_selection(True)
-            self.handle_skill_targets_selection(True)
+            self.run_round()
 
             # 游戏结束判断
             if self.is_game_over():
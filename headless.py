@@ -0,0 +1,83 @@
+from contextlib import contextmanager, redirect_stdout
+
+from game import Game
+
+# 无界面模拟时的最大回合数，超过后按平局处理
+MAX_ROUNDS = 200
+
+
+class _NullWriter:
+    """
+    丢弃所有输出的 stdout 替身
+    """
+
+    def write(self, s: str) -> int:
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+@contextmanager
+def quiet():
+    """
+    屏蔽游戏过程中的所有打印，用于无界面的批量模拟
+    """
+    with redirect_stdout(_NullWriter()):
+        yield
+
+
+def play_game(agents: list, max_rounds: int = MAX_ROUNDS, **game_kwargs) -> Game:
+    """
+    不打印地进行一局全部由 agent 操作的游戏
+
+    Args:
+        agents (list[Agent]): 每个座位的 agent，数量即玩家数量
+        max_rounds (int): 最大回合数
+        **game_kwargs: 传给 Game 的其他参数
+
+    Returns:
+        Game: 结束后的游戏
+    """
+    game = Game(len(agents), agents, **game_kwargs)
+
+    with quiet():
+        while not game.is_game_over() and game.round_count <= max_rounds:
+            game.run_round()
+
+    return game
+
+
+def get_winner_id(game: Game) -> int:
+    """
+    获取胜者编号
+
+    Args:
+        game (Game): 结束后的游戏
+
+    Returns:
+        int: 胜者编号，平局或未分胜负时为 -1
+    """
+    available_players = game.get_available_players()
+    return available_players[0].id if len(available_players) == 1 else -1
+
+
+def get_game_result(game: Game) -> dict:
+    """
+    汇总一局游戏的结果
+
+    Args:
+        game (Game): 结束后的游戏
+
+    Returns:
+        dict: 胜者、回合数、各座位的 agent、每个玩家最终生命值 / 查克拉、招式使用次数以及每回合发动的招式
+    """
+    return {
+        "winner": get_winner_id(game),
+        "rounds": game.round_count - 1,
+        "agents": [agent.name if agent else "external" for agent in game.agents],
+        "hp": [player.hp for player in game.players],
+        "mp": [player.mp for player in game.players],
+        "skill_counts": [list(counts) for counts in game.skill_counts],
+        "actions": [list(action) for action in game.skill_history],
+    }
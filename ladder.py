@@ -0,0 +1,354 @@
+import argparse
+import functools
+import math
+import random
+from multiprocessing import Pool
+from statistics import NormalDist
+
+from agent import DEFAULT_HEURISTIC_PARAMS, HeuristicAgent, RandomAgent, RuleAgent
+from headless import MAX_ROUNDS, get_winner_id, play_game
+
+# TrueSkill 的默认参数
+INITIAL_MU = 25.0
+INITIAL_SIGMA = INITIAL_MU / 3
+BETA = INITIAL_SIGMA / 2  # 一局表现的标准差
+TAU = INITIAL_SIGMA / 100  # 每局前加入的不确定性，让评分能跟上策略变化
+# 排行榜使用的保守评分 mu - k * sigma
+CONSERVATIVE_K = 3
+
+STANDARD_NORMAL = NormalDist()
+# 不指定 --player-nums 时轮流使用的玩家数量，超过种群大小的部分不使用
+DEFAULT_PLAYER_NUMS = (2, 3, 4)
+
+
+class Rating:
+    """
+    高斯评分：实力的均值和标准差
+    """
+
+    __slots__ = ("mu", "sigma")
+
+    def __init__(self, mu: float = INITIAL_MU, sigma: float = INITIAL_SIGMA):
+        self.mu = mu
+        self.sigma = sigma
+
+    @property
+    def conservative(self) -> float:
+        return self.mu - CONSERVATIVE_K * self.sigma
+
+    def __repr__(self):
+        return f"Rating(mu={self.mu:.2f}, sigma={self.sigma:.2f})"
+
+
+def v_win(t: float, epsilon: float) -> float:
+    x = t - epsilon
+    return STANDARD_NORMAL.pdf(x) / max(STANDARD_NORMAL.cdf(x), 1e-12)
+
+
+def w_win(t: float, epsilon: float) -> float:
+    v = v_win(t, epsilon)
+    return v * (v + t - epsilon)
+
+
+def v_draw(t: float, epsilon: float) -> float:
+    denominator = STANDARD_NORMAL.cdf(epsilon - t) - STANDARD_NORMAL.cdf(-epsilon - t)
+    return (
+        STANDARD_NORMAL.pdf(-epsilon - t) - STANDARD_NORMAL.pdf(epsilon - t)
+    ) / max(denominator, 1e-12)
+
+
+def w_draw(t: float, epsilon: float) -> float:
+    denominator = STANDARD_NORMAL.cdf(epsilon - t) - STANDARD_NORMAL.cdf(-epsilon - t)
+    v = v_draw(t, epsilon)
+    return v * v + (
+        (epsilon - t) * STANDARD_NORMAL.pdf(epsilon - t)
+        + (epsilon + t) * STANDARD_NORMAL.pdf(epsilon + t)
+    ) / max(denominator, 1e-12)
+
+
+def get_pair_update(
+    a: Rating, b: Rating, is_draw: bool, epsilon: float
+) -> tuple[float, float, float, float]:
+    """
+    两人一局（a 胜或平局）的 TrueSkill 更新量
+
+    Returns:
+        tuple[float, float, float, float]: a 的均值变化、a 的方差缩放、b 的均值变化、b 的方差缩放
+    """
+    c2 = 2 * BETA * BETA + a.sigma ** 2 + b.sigma ** 2
+    c = math.sqrt(c2)
+    t = (a.mu - b.mu) / c
+    e = epsilon / c
+
+    if is_draw:
+        v, w = v_draw(t, e), w_draw(t, e)
+    else:
+        v, w = v_win(t, e), w_win(t, e)
+
+    return (
+        a.sigma ** 2 / c * v,
+        1 - a.sigma ** 2 / c2 * w,
+        -b.sigma ** 2 / c * v,
+        1 - b.sigma ** 2 / c2 * w,
+    )
+
+
+def get_match_quality(ratings: list[Rating]) -> float:
+    """
+    对局质量：两两平局概率的平均，越接近 1 结果越难预测，对评分的信息量越大
+
+    Args:
+        ratings (list[Rating]): 参赛者的评分
+
+    Returns:
+        float: (0, 1] 之间的质量
+    """
+    qualities = []
+
+    for i, a in enumerate(ratings):
+        for b in ratings[i + 1 :]:
+            c2 = 2 * BETA * BETA + a.sigma ** 2 + b.sigma ** 2
+            qualities.append(
+                math.sqrt(2 * BETA * BETA / c2) * math.exp(-((a.mu - b.mu) ** 2) / (2 * c2))
+            )
+
+    return sum(qualities) / len(qualities)
+
+
+def make_rule_agent(seed: int) -> RuleAgent:
+    """
+    RuleAgent 的天梯工厂，RuleAgent 是确定性的，忽略种子
+    """
+    return RuleAgent()
+
+
+def play_match(task: tuple) -> tuple[list[str], int]:
+    """
+    工作进程的入口：进行一局天梯比赛
+
+    Args:
+        task (tuple): (局种子, 各座位 agent 名称, 各座位 agent 工厂, 最大回合数)
+
+    Returns:
+        tuple[list[str], int]: 各座位 agent 名称和胜者座位，平局为 -1
+    """
+    seed, names, factories, max_rounds = task
+    player_num = len(names)
+    agents = [factory(seed * player_num + i) for i, factory in enumerate(factories)]
+    return names, get_winner_id(play_game(agents, max_rounds))
+
+
+class Ladder:
+    """
+    agent 种群的天梯：评分随结果逐局更新，按不确定性安排对局，而不是循环赛
+    """
+
+    def __init__(
+        self,
+        population: dict,
+        player_nums: tuple = (2, 3, 4),
+        seed: int = 0,
+        draw_probability: float = 0.2,
+        max_rounds: int = MAX_ROUNDS,
+    ):
+        """
+        Args:
+            population (dict[str, Callable[[int], Agent]]): agent 名称到工厂的映射，工厂接收种子，必须可被 pickle
+            player_nums (tuple[int]): 轮流使用的玩家数量
+            seed (int): 赛程和对局种子
+            draw_probability (float): 实力相同时的平局概率，决定平局区间的宽度
+            max_rounds (int): 最大回合数
+        """
+        if min(player_nums) < 2 or max(player_nums) > len(population):
+            raise ValueError(f"玩家数量 {player_nums} 必须在 2 到种群大小 {len(population)} 之间")
+
+        self.population = population
+        self.player_nums = player_nums
+        self.max_rounds = max_rounds
+        self.epsilon = STANDARD_NORMAL.inv_cdf((draw_probability + 1) / 2) * math.sqrt(2) * BETA
+
+        self.ratings = {name: Rating() for name in population}
+        self.game_counts = {name: 0 for name in population}
+        self.rng = random.Random(seed)
+        self.next_seed = seed
+        self.game_num = 0
+
+    def pick_match(self, ratings: dict, player_num: int) -> list[str]:
+        """
+        选出一局的参赛者：以最不确定的 agent 为核心，依次加入使 质量 × 总方差 最大的对手
+
+        Args:
+            ratings (dict[str, Rating]): 用于安排赛程的评分
+            player_num (int): 玩家数量
+
+        Returns:
+            list[str]: 参赛者名称，顺序即座位
+        """
+        names = list(ratings)
+        self.rng.shuffle(names)
+        match = [max(names, key=lambda name: ratings[name].sigma)]
+
+        while len(match) < player_num:
+            def score(name: str) -> float:
+                candidate = [ratings[n] for n in match] + [ratings[name]]
+                return get_match_quality(candidate) * sum(r.sigma ** 2 for r in candidate)
+
+            match.append(max((name for name in names if name not in match), key=score))
+
+        self.rng.shuffle(match)
+        return match
+
+    def schedule(self, match_num: int) -> list[tuple]:
+        """
+        根据当前评分安排一批对局
+        同一批中已安排的 agent 假设方差按一局缩小，避免一批全是同一组对手
+
+        Args:
+            match_num (int): 对局数量
+
+        Returns:
+            list[tuple]: play_match 的任务
+        """
+        ratings = {name: Rating(r.mu, r.sigma) for name, r in self.ratings.items()}
+        tasks = []
+
+        for _ in range(match_num):
+            player_num = self.player_nums[(self.game_num + len(tasks)) % len(self.player_nums)]
+            names = self.pick_match(ratings, player_num)
+
+            for name in names:
+                rating = ratings[name]
+                rating.sigma *= math.sqrt(1 - rating.sigma ** 2 / (rating.sigma ** 2 + BETA ** 2))
+
+            tasks.append(
+                (self.next_seed, names, [self.population[name] for name in names], self.max_rounds)
+            )
+            self.next_seed += 1
+
+        return tasks
+
+    def record(self, names: list[str], winner: int):
+        """
+        用一局结果更新评分
+        胜者与每个败者各算一次胜负，平局时所有人两两算平局，败者之间不提供信息
+        每个配对的更新量除以对手数量，胜者和败者的均值变化总和接近零
+
+        Args:
+            names (list[str]): 各座位的 agent 名称
+            winner (int): 胜者座位，平局为 -1
+        """
+        ratings = [self.ratings[name] for name in names]
+        for rating in ratings:
+            rating.sigma = math.sqrt(rating.sigma ** 2 + TAU ** 2)
+
+        if winner == -1:
+            pairs = [
+                (i, j, True) for i in range(len(names)) for j in range(i + 1, len(names))
+            ]
+        else:
+            pairs = [(winner, j, False) for j in range(len(names)) if j != winner]
+
+        mu_deltas = [0.0] * len(names)
+        variance_reductions = [0.0] * len(names)
+
+        for i, j, is_draw in pairs:
+            mu_i, scale_i, mu_j, scale_j = get_pair_update(
+                ratings[i], ratings[j], is_draw, self.epsilon
+            )
+            mu_deltas[i] += mu_i
+            mu_deltas[j] += mu_j
+            variance_reductions[i] += 1 - scale_i
+            variance_reductions[j] += 1 - scale_j
+
+        opponent_num = len(names) - 1
+        for rating, mu_delta, variance_reduction in zip(
+            ratings, mu_deltas, variance_reductions
+        ):
+            rating.mu += mu_delta / opponent_num
+            rating.sigma *= math.sqrt(max(1 - variance_reduction / opponent_num, 1e-6))
+
+        for name in names:
+            self.game_counts[name] += 1
+        self.game_num += 1
+
+    def run(self, game_num: int, processes: int = None, batch_size: int = 64):
+        """
+        进行 game_num 局天梯比赛，每批对局根据最新评分安排，结果到达后立即更新评分
+
+        Args:
+            game_num (int): 总局数
+            processes (int): 进程数，为 1 时在当前进程中执行
+            batch_size (int): 每批安排的对局数
+        """
+        pool = Pool(processes) if processes != 1 else None
+
+        try:
+            while self.game_num < game_num:
+                tasks = self.schedule(min(batch_size, game_num - self.game_num))
+                results = (
+                    map(play_match, tasks)
+                    if pool is None
+                    else pool.imap_unordered(play_match, tasks)
+                )
+                for names, winner in results:
+                    self.record(names, winner)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def leaderboard(self) -> list[tuple[str, Rating, int]]:
+        """
+        Returns:
+            list[tuple[str, Rating, int]]: 按保守评分从高到低排列的 (名称, 评分, 局数)
+        """
+        return sorted(
+            ((name, rating, self.game_counts[name]) for name, rating in self.ratings.items()),
+            key=lambda item: item[1].conservative,
+            reverse=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="随机、启发式、规则 agent 及随机 agent 变体的天梯")
+    parser.add_argument("game_num", type=int, help="总局数")
+    parser.add_argument(
+        "--ban", type=int, nargs="*", default=[], help="每个招式编号生成一个禁用该招式的随机 agent"
+    )
+    parser.add_argument(
+        "--player-nums",
+        type=int,
+        nargs="+",
+        default=None,
+        help=f"轮流使用的玩家数量，默认为 {DEFAULT_PLAYER_NUMS} 中不超过种群大小的部分",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    population = {
+        "random": RandomAgent,
+        "heuristic": functools.partial(HeuristicAgent, DEFAULT_HEURISTIC_PARAMS),
+        "rule": make_rule_agent,
+    }
+    for skill_id in args.ban:
+        population[f"ban-{skill_id}"] = functools.partial(
+            RandomAgent, banned_skill_ids=(skill_id,)
+        )
+
+    if args.player_nums is None:
+        args.player_nums = [
+            player_num for player_num in DEFAULT_PLAYER_NUMS if player_num <= len(population)
+        ]
+    elif min(args.player_nums) < 2 or max(args.player_nums) > len(population):
+        parser.error(f"--player-nums {args.player_nums} 必须在 2 到种群大小 {len(population)} 之间")
+
+    ladder = Ladder(population, tuple(args.player_nums), args.seed)
+    ladder.run(args.game_num, args.processes)
+
+    for name, rating, count in ladder.leaderboard():
+        print(f"{name:>12}  {rating.conservative:7.2f}  mu {rating.mu:6.2f}  sigma {rating.sigma:5.2f}  {count} 局")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+单回合前瞻的公共部分
+
+宏动作 (招式编号, 目标编号元组) 代表玩家一回合内选择招式和目标的全部决策，
+不需要选择招式的玩家（被看透或无法行动）的宏动作为 None。
+给定回合开始时的状态和所有玩家的宏动作，Game.resolve_round_async 的结算是确定的，
+影分身和写轮眼的附加决策使用默认答案，因此一次结算可以按 (状态, 联合宏动作) 缓存复用。
+"""
+
+import itertools
+from collections import OrderedDict
+
+import decision
+import skill as sk
+from agent import Agent
+from decision import DecisionRequest
+from game import Game, run_sync
+from player import Player
+from skill import skill_info_dict
+from state_codec import get_state_values, pack_values, set_state_values, unpack_values
+
+# 每个进程的回合转移缓存的最大条目数
+TRANSITION_CACHE_SIZE = 1 << 16
+# 没有可选招式（查克拉为负）时的宏动作，引擎不会发出决策请求
+NONE_MACRO = (sk.NONE_ACTION_ID, ())
+# 宏动作覆盖的决策类型
+MACRO_SKILL_KINDS = (decision.SKILL, decision.PRESELECT_SKILL)
+MACRO_TARGETS_KINDS = (decision.TARGETS, decision.PRESELECT_TARGETS)
+
+
+def get_legal_targets(game: Game, player: Player, skill_id: int) -> list[Player]:
+    """
+    玩家使用指定招式时的合法目标，不改变游戏状态
+
+    Args:
+        game (Game): 游戏
+        player (Player): 使用招式的玩家
+        skill_id (int): 招式编号
+
+    Returns:
+        list[Player]: 合法目标
+    """
+    selected_skill_id = game.skill_ids[player.id]
+    game.skill_ids[player.id] = skill_id
+    legal_targets = game.get_legal_skill_targets(player)
+    game.skill_ids[player.id] = selected_skill_id
+    return legal_targets
+
+
+def get_macro_actions(game: Game, player: Player) -> list[tuple]:
+    """
+    玩家本回合所有合法的宏动作
+    多目标招式只考虑所有目标相同的选择，没有合法目标的招式目标为空（招式无效）
+
+    Args:
+        game (Game): 回合开始时的游戏
+        player (Player): 玩家
+
+    Returns:
+        list[tuple[int, tuple]]: 宏动作列表，查克拉为负没有可选招式时只有无法行动
+    """
+    legal_skills = game.get_leagl_skills(player)
+    if not legal_skills:
+        return [NONE_MACRO]
+
+    macros = []
+
+    for skill in legal_skills:
+        legal_targets = get_legal_targets(game, player, skill.id) if skill.target_num else []
+
+        if not legal_targets:
+            macros.append((skill.id, ()))
+            continue
+
+        for target in legal_targets:
+            macros.append((skill.id, (target.id,) * skill.target_num))
+
+    return macros
+
+
+def get_preselect_macro_actions(game: Game, player: Player) -> list[tuple]:
+    """
+    看透玩家在回合结束时所有合法的预选宏动作
+    预选时本回合的招式已经清空，目标与引擎一样按没有选择招式计算
+
+    Args:
+        game (Game): 结算后、预选前的游戏
+        player (Player): 看透玩家
+
+    Returns:
+        list[tuple[int, tuple]]: 宏动作列表
+    """
+    legal_skills = game.get_leagl_skills(player)
+    if not legal_skills:
+        return [NONE_MACRO]
+
+    legal_targets = game.get_legal_skill_targets(player)
+    macros = []
+
+    for skill in legal_skills:
+        if not skill.target_num or not legal_targets:
+            macros.append((skill.id, ()))
+            continue
+
+        for target in legal_targets:
+            macros.append((skill.id, (target.id,) * skill.target_num))
+
+    return macros
+
+
+def make_skill_request(game: Game, player: Player) -> DecisionRequest:
+    return DecisionRequest(
+        decision.SKILL,
+        player.id,
+        game.round_count,
+        [skill.id for skill in game.get_leagl_skills(player)],
+    )
+
+
+def make_targets_request(game: Game, player: Player, skill_id: int) -> DecisionRequest:
+    """
+    构造与引擎相同的目标决策请求，不需要选择时返回 None
+
+    Returns:
+        DecisionRequest: 目标决策请求
+    """
+    target_num = skill_info_dict[skill_id].target_num
+    if not target_num:
+        return None
+
+    legal_targets = get_legal_targets(game, player, skill_id)
+    if len(legal_targets) <= 1:
+        return None
+
+    return DecisionRequest(
+        decision.TARGETS,
+        player.id,
+        game.round_count,
+        [target.id for target in legal_targets],
+        target_num,
+        skill_id,
+    )
+
+
+def get_forced_targets(game: Game, player: Player, skill_id: int) -> tuple:
+    """
+    不需要选择目标时引擎确定的目标：没有目标或唯一的合法目标
+    """
+    target_num = skill_info_dict[skill_id].target_num
+    legal_targets = get_legal_targets(game, player, skill_id) if target_num else []
+    return (legal_targets[0].id,) * target_num if legal_targets else ()
+
+
+def get_movable_ids(game: Game) -> set[int]:
+    return {player.id for player in game.get_movable_players()}
+
+
+def sample_macro(agent: Agent, game: Game, player: Player) -> tuple:
+    """
+    让 agent 为玩家选择一个宏动作
+
+    Args:
+        agent (Agent): 玩家的 agent
+        game (Game): 回合开始时的游戏
+        player (Player): 玩家
+
+    Returns:
+        tuple[int, tuple]: 宏动作，玩家本回合不需要选择招式时为 None
+    """
+    if player.id not in get_movable_ids(game):
+        return None
+
+    request = make_skill_request(game, player)
+    if not request.options:
+        return NONE_MACRO
+
+    skill_id = agent.decide(game, request)
+    request = make_targets_request(game, player, skill_id)
+
+    if request is None:
+        return skill_id, get_forced_targets(game, player, skill_id)
+    return skill_id, tuple(agent.decide(game, request))
+
+
+def sample_other_macros(agents: list[Agent], game: Game, player_id: int) -> dict:
+    """
+    让其他座位的 agent 各自选择一个宏动作
+
+    Args:
+        agents (list[Agent]): 每个座位的 agent
+        game (Game): 回合开始时的游戏
+        player_id (int): 不采样的玩家编号
+
+    Returns:
+        dict[int, tuple]: 需要选择招式的其他玩家编号到宏动作的映射
+    """
+    return {
+        player.id: sample_macro(agents[player.id], game, player)
+        for player in game.get_movable_players()
+        if player.id != player_id
+    }
+
+
+def get_macro_distribution(agent: Agent, game: Game, player: Player) -> list[tuple]:
+    """
+    agent 为玩家选择宏动作的概率分布，相同的宏动作合并
+
+    Args:
+        agent (Agent): 玩家的 agent
+        game (Game): 回合开始时的游戏
+        player (Player): 玩家
+
+    Returns:
+        list[tuple[tuple, float]]: (宏动作, 概率) 列表
+    """
+    if player.id not in get_movable_ids(game):
+        return [(None, 1.0)]
+
+    request = make_skill_request(game, player)
+    if not request.options:
+        return [(NONE_MACRO, 1.0)]
+
+    probabilities = {}
+
+    for skill_id, skill_probability in agent.get_answer_distribution(game, request):
+        request = make_targets_request(game, player, skill_id)
+
+        if request is None:
+            targets_distribution = [(get_forced_targets(game, player, skill_id), 1.0)]
+        else:
+            targets_distribution = agent.get_answer_distribution(game, request)
+
+        for targets, targets_probability in targets_distribution:
+            macro = (skill_id, tuple(targets))
+            probabilities[macro] = (
+                probabilities.get(macro, 0.0) + skill_probability * targets_probability
+            )
+
+    return list(probabilities.items())
+
+
+def get_joint_distribution(distributions: dict) -> list[tuple]:
+    """
+    多个玩家宏动作的联合分布，各玩家独立
+
+    Args:
+        distributions (dict[int, list[tuple[tuple, float]]]): 玩家编号到 get_macro_distribution 结果的映射
+
+    Returns:
+        list[tuple[dict[int, tuple], float]]: (玩家编号到宏动作的映射, 概率) 列表
+    """
+    player_ids = list(distributions)
+    joint_distribution = []
+
+    for combination in itertools.product(*distributions.values()):
+        probability = 1.0
+        for _, macro_probability in combination:
+            probability *= macro_probability
+        joint_distribution.append(
+            (dict(zip(player_ids, (macro for macro, _ in combination))), probability)
+        )
+
+    return joint_distribution
+
+
+class ScriptedAgent(Agent):
+    """
+    按宏动作回答本回合的招式和目标决策（或看透的预选决策），其余决策使用默认答案
+    """
+
+    def __init__(self, macro: tuple = None):
+        self.macro = macro
+
+    def decide(self, game, request: DecisionRequest):
+        if self.macro is not None:
+            skill_id, targets = self.macro
+
+            if request.kind in MACRO_SKILL_KINDS and skill_id in request.options:
+                return skill_id
+
+            if request.kind in MACRO_TARGETS_KINDS and request.is_legal(list(targets)):
+                return list(targets)
+
+        return request.default_answer()
+
+
+class LRUCache:
+    """
+    有界的 LRU 缓存，记录命中和未命中次数
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hit_num = 0
+        self.miss_num = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hit_num / max(self.hit_num + self.miss_num, 1)
+
+    def get(self, key):
+        """
+        Returns:
+            Any: 缓存的值，没有时为 None
+        """
+        value = self.items.get(key)
+
+        if value is None:
+            self.miss_num += 1
+        else:
+            self.hit_num += 1
+            self.items.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+
+class TransitionCache(LRUCache):
+    """
+    回合转移的 LRU 缓存：(回合开始时的状态序列, 联合宏动作) -> 结算后的状态序列，状态以打包形式保存
+    结算后的状态还没有进行看透预选，回合数也没有递增
+    """
+
+    def __init__(self, max_size: int = TRANSITION_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def resolve(self, game: Game, values: tuple, macros: tuple) -> tuple:
+        """
+        按联合宏动作结算一回合，结果留在 game 中
+
+        Args:
+            game (Game): 用于结算的游戏，玩家数量必须一致，原有状态会被覆盖
+            values (tuple[int]): 回合开始时的状态序列
+            macros (tuple): 每个座位的宏动作
+
+        Returns:
+            tuple[int]: 结算后的状态序列
+        """
+        # 状态以 pack_values 的定长记录缓存，每个条目只占几百字节
+        key = (pack_values(values), macros)
+        packed = self.get(key)
+
+        if packed is not None:
+            next_values = unpack_values(packed)
+            set_state_values(game, next_values)
+            return next_values
+
+        set_state_values(game, values)
+        # 用于结算的游戏不需要保留记录，避免长时间搜索时无限增长
+        game.action_log.clear()
+        game.skill_history.clear()
+        game.agents = [ScriptedAgent(macro) for macro in macros]
+        run_sync(game.resolve_round_async())
+
+        next_values = tuple(get_state_values(game))
+        self.put(key, pack_values(next_values))
+        return next_values
@@ -0,0 +1,186 @@
+from array import array
+
+import skill as sk
+from decision import DECISION_KINDS, DecisionRequest
+
+# 每个玩家编码的数值字段和布尔字段
+PLAYER_VALUE_FIELDS = (
+    "hp",
+    "mp",
+    "max_hp",
+    "second_hp",
+    "second_max_hp",
+    "bind_turns",
+    "acupoint_seal_turns",
+    "shadow_clone_num",
+    "sixpaths_mode_turns",
+)
+PLAYER_FLAG_FIELDS = (
+    "is_dead",
+    "is_in_second_life",
+    "is_exposed",
+    "is_fatal_sealed",
+    "is_in_kamui_zone",
+)
+
+
+def float_view(buffer) -> memoryview:
+    """
+    把任意可写缓冲区（bytearray、mmap、SharedMemory.buf、numpy 数组等）看作 float32 数组
+
+    Args:
+        buffer: 支持缓冲区协议的可写对象，长度为 4 的倍数
+
+    Returns:
+        memoryview: 格式为 'f' 的一维视图
+    """
+    return memoryview(buffer).cast("B").cast("f")
+
+
+class ObservationEncoder:
+    """
+    把某个玩家视角下的游戏状态编码为定长 float32 向量，原地写入调用方提供的缓冲区
+    玩家按相对座位排列（自己为 0 号位），每个座位依次为：
+        是否存在、是否有效、是否与自己同一空间、数值字段、布尔字段、
+        被谁心转身（相对座位 one-hot）、看透后可见的预选招式（one-hot）与预选目标（相对座位计数）
+    之后是全局部分：回合数、玩家数量、决策类型 one-hot、目标数量、选择目标对应的招式 one-hot、
+    合法招式掩码、合法目标掩码（相对座位）
+    """
+
+    def __init__(self, max_player_num: int = 8):
+        self.max_player_num = max_player_num
+
+        self.seat_feature_num = (
+            3
+            + len(PLAYER_VALUE_FIELDS)
+            + len(PLAYER_FLAG_FIELDS)
+            + max_player_num
+            + sk.SKILL_NUM
+            + max_player_num
+        )
+        self.round_offset = self.seat_feature_num * max_player_num
+        self.kind_offset = self.round_offset + 2
+        self.target_num_offset = self.kind_offset + len(DECISION_KINDS)
+        self.skill_offset = self.target_num_offset + 1
+        self.skill_mask_offset = self.skill_offset + sk.SKILL_NUM
+        self.target_mask_offset = self.skill_mask_offset + sk.SKILL_NUM
+        self.feature_num = self.target_mask_offset + max_player_num
+
+        self.zeros = array("f", bytes(4 * self.feature_num))
+
+    def allocate(self, row_num: int = 1) -> array:
+        """
+        分配 row_num 行的 float32 数组
+
+        Returns:
+            array: 长度为 row_num * feature_num 的数组
+        """
+        return array("f", bytes(4 * row_num * self.feature_num))
+
+    def encode(self, game, request: DecisionRequest, out: memoryview, offset: int = 0):
+        """
+        编码决策请求对应玩家的观测，与 DecisionBatcher 的编码器接口一致
+
+        Args:
+            game (Game): 请求所在的游戏
+            request (DecisionRequest): 决策请求
+            out (memoryview): float32 视图
+            offset (int): 写入的起始下标
+        """
+        self.encode_player(game, request.player_id, out, offset, request)
+
+    def encode_player(
+        self,
+        game,
+        player_id: int,
+        out: memoryview,
+        offset: int = 0,
+        request: DecisionRequest = None,
+    ):
+        """
+        编码玩家视角的观测，没有决策请求时合法招式掩码由 get_leagl_skills 计算
+
+        Args:
+            game (Game): 游戏
+            player_id (int): 视角玩家编号
+            out (memoryview): float32 视图
+            offset (int): 写入的起始下标
+            request (DecisionRequest): 该玩家当前的决策请求
+        """
+        player_num = game.player_num
+        if player_num > self.max_player_num:
+            raise ValueError(f"玩家数量 {player_num} 超过编码上限 {self.max_player_num}")
+
+        out[offset : offset + self.feature_num] = self.zeros
+
+        me = game.players[player_id]
+
+        for player in game.players:
+            seat = (player.id - player_id) % player_num
+            i = offset + seat * self.seat_feature_num
+
+            out[i] = 1.0
+            out[i + 1] = float(player.is_available())
+            out[i + 2] = float(player.is_in_kamui_zone == me.is_in_kamui_zone)
+            i += 3
+
+            for field in PLAYER_VALUE_FIELDS:
+                out[i] = getattr(player, field)
+                i += 1
+            for field in PLAYER_FLAG_FIELDS:
+                out[i] = float(getattr(player, field))
+                i += 1
+
+            if player.charmed_by != -1:
+                out[i + (player.charmed_by - player_id) % player_num] = 1.0
+            i += self.max_player_num
+
+            # 看透玩家的预选对所有人可见，回合开始后预选已载入本回合的选择
+            if player.is_exposed:
+                skill_id = game.preselected_skill_ids[player.id]
+                targets = game.preselected_skill_targets[player.id]
+                if skill_id == sk.NONE_ACTION_ID:
+                    skill_id = game.skill_ids[player.id]
+                    targets = game.skill_targets[player.id]
+
+                if skill_id != sk.NONE_ACTION_ID:
+                    out[i + skill_id] = 1.0
+                for target in targets:
+                    out[i + sk.SKILL_NUM + (target.id - player_id) % player_num] += 1.0
+
+        out[offset + self.round_offset] = game.round_count
+        out[offset + self.round_offset + 1] = player_num
+
+        if request is None:
+            for skill in game.get_leagl_skills(me):
+                out[offset + self.skill_mask_offset + skill.id] = 1.0
+            return
+
+        out[offset + self.kind_offset + DECISION_KINDS.index(request.kind)] = 1.0
+        out[offset + self.target_num_offset] = request.target_num
+
+        if request.is_skill_decision():
+            for skill_id in request.options:
+                if skill_id != sk.NONE_ACTION_ID:
+                    out[offset + self.skill_mask_offset + skill_id] = 1.0
+        else:
+            if request.skill_id != sk.NONE_ACTION_ID:
+                out[offset + self.skill_offset + request.skill_id] = 1.0
+            for target_id in request.options:
+                out[
+                    offset + self.target_mask_offset + (target_id - player_id) % player_num
+                ] = 1.0
+
+    def encode_batch(self, items: list[tuple], out: memoryview, start_row: int = 0):
+        """
+        把一批请求依次写入 out 的连续行，out 可以是共享内存或内存映射文件的视图
+
+        Args:
+            items (list[tuple[Game, DecisionRequest]]): (游戏, 请求) 列表
+            out (memoryview): float32 视图，至少有 start_row + len(items) 行
+            start_row (int): 写入的起始行
+        """
+        offset = start_row * self.feature_num
+        for game, request in items:
+            self.encode(game, request, out, offset)
+            offset += self.feature_num
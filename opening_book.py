@@ -0,0 +1,437 @@
+"""
+开局库：离线搜索每种玩家数量开局几回合的宏动作分布，对局时从内存映射文件 O(1) 查表
+
+Game(n) 的开局状态总是相同的，前几回合的搜索在每局中重复。
+构建时从初始状态出发，对每个决策状态的每个可行动玩家用 BestResponseAgent 评估所有宏动作，
+取接近最优的几个宏动作按估值分配概率，再沿库中的联合动作展开下一回合，按到达概率优先展开。
+默认的对手模型和模拟策略是随机 agent：确定性的策略下各次模拟完全相同，估值只有胜、平、负几种，无法区分宏动作。
+
+库文件是开放寻址的哈希表，键与 cfr.get_infoset_key 相同（不区分回合数，不同路径到达的相同状态共享条目），
+每个槽固定长度，读取时只映射文件，不需要载入全部内容。
+OpeningBookAgent 在库中有当前状态时按库的分布选择，离开库之后本局不再查表，交给包装的 agent。
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+from multiprocessing import Pool
+
+import decision
+import skill as sk
+from agent import Agent
+from best_response import POLICY_FACTORIES, ROLLOUT_ROUNDS, BestResponseAgent
+from cfr import SKILL_PHASE, get_infoset_key, sample_index
+from game import Game, run_sync
+from headless import MAX_ROUNDS, quiet
+from lookahead import TransitionCache, get_movable_ids
+from skill import skill_info_dict
+from state_codec import get_state_values, set_state_values
+from tournament import make_random_agents
+
+BOOK_MAGIC = b"OPBK"
+# 文件头：魔数、玩家数量、每个槽的宏动作数、槽数、条目数
+BOOK_HEADER = struct.Struct("<4sBBQQ")
+# 每个条目最多保存的宏动作数
+BOOK_MOVE_NUM = 4
+# 与最优估值相差不超过该值的宏动作进入库
+BOOK_VALUE_MARGIN = 0.02
+# 库中宏动作的最小概率，用于展开时剪掉很少出现的联合动作
+MIN_MOVE_PROBABILITY = 0.05
+# 构建时每个候选宏动作的模拟次数，远多于对局中的在线搜索
+BOOK_ROLLOUT_NUM = 64
+BOOK_BRANCH_ROLLOUT_NUM = 8
+
+
+def get_slot_struct(move_num: int) -> struct.Struct:
+    """
+    一个槽：是否占用、键，以及 move_num 个 (招式编号, 目标编号 * MAX_TARGET_NUM, 概率)，不足的招式编号为 -1
+    """
+    return struct.Struct("<Bq" + ("b" + "b" * sk.MAX_TARGET_NUM + "f") * move_num)
+
+
+def get_book_key(values, player_id: int, player_num: int) -> int:
+    return get_infoset_key(values, player_id, SKILL_PHASE, player_num)
+
+
+def make_move_distribution(macro_values: dict, rng: random.Random) -> list[tuple]:
+    """
+    由宏动作的估值生成库中的分布：与最优相差不超过 BOOK_VALUE_MARGIN 的前 BOOK_MOVE_NUM 个宏动作，
+    概率与估值成正比，同分的宏动作按随机顺序排列，不总是偏向招式编号小的
+
+    Args:
+        macro_values (dict[tuple, float]): BestResponseAgent.evaluate_macros 的结果
+        rng (random.Random): 打破同分用的随机数生成器
+
+    Returns:
+        list[tuple[tuple, float]]: (宏动作, 概率) 列表，按概率从高到低排列
+    """
+    if len(macro_values) == 1:
+        return [(next(iter(macro_values)), 1.0)]
+
+    items = list(macro_values.items())
+    rng.shuffle(items)
+    ranked = sorted(items, key=lambda item: item[1], reverse=True)
+    best_value = ranked[0][1]
+    moves = [
+        (macro, value) for macro, value in ranked[:BOOK_MOVE_NUM] if value >= best_value - BOOK_VALUE_MARGIN
+    ]
+
+    total = sum(value for _, value in moves)
+    if total <= 0:
+        return [(moves[0][0], 1.0)]
+
+    return [(macro, value / total) for macro, value in moves]
+
+
+def write_book(path: str, player_num: int, entries: dict):
+    """
+    写入库文件，写入临时文件后原子替换
+
+    Args:
+        path (str): 库文件
+        player_num (int): 玩家数量
+        entries (dict[int, list[tuple[tuple, float]]]): 键到宏动作分布的映射
+    """
+    slot_struct = get_slot_struct(BOOK_MOVE_NUM)
+    # 槽数为 2 的幂且至少是条目数的两倍，线性探测的平均长度很短
+    slot_num = 1
+    while slot_num < 2 * len(entries):
+        slot_num *= 2
+
+    slots = [None] * slot_num
+    for key in entries:
+        index = key & (slot_num - 1)
+        while slots[index] is not None:
+            index = (index + 1) & (slot_num - 1)
+        slots[index] = key
+
+    empty_slot = bytes(slot_struct.size)
+    temp_path = path + ".tmp"
+
+    with open(temp_path, "wb") as f:
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, player_num, BOOK_MOVE_NUM, slot_num, len(entries)))
+
+        for key in slots:
+            if key is None:
+                f.write(empty_slot)
+                continue
+
+            fields = [1, key]
+            moves = entries[key][:BOOK_MOVE_NUM]
+            for (skill_id, target_ids), probability in moves:
+                fields.append(skill_id)
+                fields.extend(target_ids + (-1,) * (sk.MAX_TARGET_NUM - len(target_ids)))
+                fields.append(probability)
+            for _ in range(BOOK_MOVE_NUM - len(moves)):
+                fields.extend((-1,) * (1 + sk.MAX_TARGET_NUM))
+                fields.append(0.0)
+
+            f.write(slot_struct.pack(*fields))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, path)
+
+
+class OpeningBook:
+    """
+    只读的内存映射开局库，多个进程打开同一个文件时共享页缓存
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): write_book 写入的库文件
+        """
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.player_num, move_num, self.slot_num, self.entry_num = BOOK_HEADER.unpack_from(self.mmap)
+        if magic != BOOK_MAGIC:
+            raise ValueError(f"{path} 不是开局库文件")
+
+        self.slot_struct = get_slot_struct(move_num)
+        self.move_num = move_num
+
+    def __len__(self):
+        return self.entry_num
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+    def lookup(self, key: int) -> list[tuple]:
+        """
+        Args:
+            key (int): get_book_key 计算的键
+
+        Returns:
+            list[tuple[tuple, float]]: (宏动作, 概率) 列表，库中没有时为 None
+        """
+        slot_struct = self.slot_struct
+        mask = self.slot_num - 1
+        index = key & mask
+
+        while True:
+            fields = slot_struct.unpack_from(self.mmap, BOOK_HEADER.size + index * slot_struct.size)
+            if not fields[0]:
+                return None
+            if fields[1] == key:
+                break
+            index = (index + 1) & mask
+
+        moves = []
+        width = 2 + sk.MAX_TARGET_NUM
+        for offset in range(2, 2 + self.move_num * width, width):
+            skill_id = fields[offset]
+            if skill_id == -1:
+                break
+
+            target_ids = tuple(i for i in fields[offset + 1 : offset + width - 1] if i >= 0)
+            moves.append(((skill_id, target_ids), fields[offset + width - 1]))
+
+        return moves
+
+
+class OpeningBookBuilder:
+    """
+    从初始状态出发按到达概率优先展开，搜索开局库的每个决策状态
+    """
+
+    def __init__(
+        self,
+        player_num: int,
+        policy_factory=make_random_agents,
+        depth: int = 3,
+        max_states: int = 200,
+        seed: int = 0,
+        **search_kwargs,
+    ):
+        """
+        Args:
+            player_num (int): 玩家数量
+            policy_factory (Callable[[int, int], list[Agent]]): 搜索时的对手模型和模拟策略，也用于回合结束时的看透预选
+            depth (int): 展开的回合数
+            max_states (int): 最多搜索的决策状态数
+            seed (int): 模拟种子的起点，也用于打破宏动作的同分
+            **search_kwargs: 传给 BestResponseAgent 的其他参数
+        """
+        self.player_num = player_num
+        self.policy_factory = policy_factory
+        self.depth = depth
+        self.max_states = max_states
+        self.seed = seed
+        self.search_kwargs = {
+            "rollout_num": BOOK_ROLLOUT_NUM,
+            "branch_rollout_num": BOOK_BRANCH_ROLLOUT_NUM,
+            **search_kwargs,
+        }
+
+        self.game = Game(player_num, [None] * player_num)
+        self.transitions = TransitionCache()
+        self.entries = {}
+        self.rng = random.Random(seed)
+
+    def get_children(self, values: tuple, distributions: dict) -> list[tuple]:
+        """
+        按库中的联合动作结算一回合，得到下一回合的决策状态
+
+        Returns:
+            list[tuple[tuple[int], float]]: (下一回合选择招式时的状态序列, 联合动作概率)
+        """
+        game = self.game
+        children = []
+
+        moves = [[(None, 1.0)]] * self.player_num
+        for player_id, distribution in distributions.items():
+            moves[player_id] = [
+                (macro, probability) for macro, probability in distribution if probability >= MIN_MOVE_PROBABILITY
+            ]
+
+        stack = [((), 1.0)]
+        while stack:
+            macros, probability = stack.pop()
+            if len(macros) < self.player_num:
+                for macro, macro_probability in moves[len(macros)]:
+                    stack.append((macros + (macro,), probability * macro_probability))
+                continue
+
+            with quiet():
+                self.transitions.resolve(game, values, macros)
+                game.agents = self.policy_factory(self.seed, self.player_num)
+                run_sync(game.finish_round_async())
+
+                if game.is_game_over():
+                    continue
+
+                game.load_exposed_selection()
+                children.append((tuple(get_state_values(game)), probability))
+
+        return children
+
+    def build(self, processes: int = None, callback=None) -> dict:
+        """
+        Args:
+            processes (int): 评估候选的进程数，为 1 时在当前进程中执行
+            callback (Callable[[int, int], None]): 每搜索完一个决策状态以 (已搜索状态数, 库条目数) 调用
+
+        Returns:
+            dict[int, list[tuple[tuple, float]]]: 键到宏动作分布的映射
+        """
+        pool = Pool(processes) if processes != 1 else None
+        searcher = BestResponseAgent(self.policy_factory, self.seed, pool=pool, **self.search_kwargs)
+        game = self.game
+
+        with quiet():
+            game.load_exposed_selection()
+        root = tuple(get_state_values(game))
+
+        # (-到达概率, 序号, 状态序列, 回合深度)，序号保证同概率时按加入顺序展开
+        queue = [(-1.0, 0, root, 0)]
+        pushed_num = 1
+        visited = set()
+        state_num = 0
+
+        try:
+            while queue and state_num < self.max_states:
+                negative_reach, _, values, depth = heapq.heappop(queue)
+                if values[1:] in visited:
+                    continue
+                visited.add(values[1:])
+                state_num += 1
+
+                set_state_values(game, values)
+                distributions = {}
+
+                for player_id in sorted(get_movable_ids(game)):
+                    key = get_book_key(values, player_id, self.player_num)
+                    if key not in self.entries:
+                        set_state_values(game, values)
+                        macro_values = searcher.evaluate_macros(game, player_id)
+                        self.entries[key] = make_move_distribution(macro_values, self.rng)
+                    distributions[player_id] = self.entries[key]
+
+                if callback:
+                    callback(state_num, len(self.entries))
+
+                if depth + 1 >= self.depth:
+                    continue
+
+                for child, probability in self.get_children(values, distributions):
+                    heapq.heappush(queue, (negative_reach * probability, pushed_num, child, depth + 1))
+                    pushed_num += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return self.entries
+
+
+class OpeningBookAgent(Agent):
+    """
+    开局按库中的分布选择宏动作，一局中第一次查不到（或库中的宏动作不合法）之后交给包装的 agent
+    """
+
+    def __init__(self, book: OpeningBook, agent: Agent, seed=None):
+        """
+        Args:
+            book (OpeningBook): 开局库，玩家数量必须与游戏一致
+            agent (Agent): 离开库之后以及库不覆盖的决策使用的 agent
+            seed (int): 按库中分布选择的随机种子
+        """
+        self.book = book
+        self.agent = agent
+        self.rng = random.Random(seed)
+
+        self.game = None
+        self.in_book = False
+        self.macro = None
+        self.book_decision_num = 0
+
+    def lookup(self, game, request) -> list[tuple]:
+        if game is not self.game:
+            self.game = game
+            self.in_book = game.player_num == self.book.player_num
+
+        if not self.in_book:
+            return None
+
+        moves = self.book.lookup(get_book_key(get_state_values(game), request.player_id, game.player_num))
+        if not moves or any(skill_id not in request.options for (skill_id, _), _ in moves):
+            self.in_book = False
+            return None
+
+        return moves
+
+    def decide(self, game, request):
+        if request.kind == decision.SKILL:
+            moves = self.lookup(game, request)
+
+            if moves is None:
+                self.macro = None
+                return self.agent.decide(game, request)
+
+            self.book_decision_num += 1
+            self.macro = moves[sample_index([probability for _, probability in moves], self.rng)][0]
+            return self.macro[0]
+
+        if (
+            request.kind == decision.TARGETS
+            and self.macro is not None
+            and request.skill_id == self.macro[0]
+            and request.is_legal(list(self.macro[1]))
+        ):
+            return list(self.macro[1])
+
+        return self.agent.decide(game, request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线构建开局库")
+    parser.add_argument("path", help="库文件")
+    parser.add_argument("--player-num", type=int, default=3)
+    parser.add_argument("--policy", choices=sorted(POLICY_FACTORIES), default="random")
+    parser.add_argument("--depth", type=int, default=3, help="展开的回合数")
+    parser.add_argument("--max-states", type=int, default=200, help="最多搜索的决策状态数")
+    parser.add_argument("--rollout-num", type=int, default=BOOK_ROLLOUT_NUM)
+    parser.add_argument("--branch-rollout-num", type=int, default=BOOK_BRANCH_ROLLOUT_NUM)
+    parser.add_argument("--rollout-rounds", type=int, default=ROLLOUT_ROUNDS)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    builder = OpeningBookBuilder(
+        args.player_num,
+        POLICY_FACTORIES[args.policy],
+        args.depth,
+        args.max_states,
+        rollout_num=args.rollout_num,
+        branch_rollout_num=args.branch_rollout_num,
+        rollout_rounds=args.rollout_rounds,
+        max_rounds=MAX_ROUNDS,
+    )
+
+    def report(state_num: int, entry_num: int):
+        print(f"已搜索 {state_num} 个状态，{entry_num} 个条目")
+
+    entries = builder.build(args.processes, report)
+    write_book(args.path, args.player_num, entries)
+
+    book = OpeningBook(args.path)
+    root = Game(args.player_num)
+    with quiet():
+        root.load_exposed_selection()
+    values = get_state_values(root)
+
+    print(f"开局库 {args.path}：{len(book)} 个条目，{book.slot_num} 个槽")
+    for (skill_id, targets), probability in book.lookup(get_book_key(values, 0, args.player_num)):
+        print(f"{skill_info_dict[skill_id].name:>8} {list(targets)}  {probability:.3f}")
+    book.close()
+
+
+if __name__ == "__main__":
+    main()
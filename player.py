@@ -1,4 +1,34 @@
+import struct
+
+# 玩家完整状态包含的字段，用于快照和恢复
+STATE_FIELDS = (
+    "hp",
+    "mp",
+    "max_hp",
+    "is_dead",
+    "is_in_second_life",
+    "second_hp",
+    "second_max_hp",
+    "bind_turns",
+    "is_exposed",
+    "acupoint_seal_turns",
+    "shadow_clone_num",
+    "sixpaths_mode_turns",
+    "is_fatal_sealed",
+    "is_in_kamui_zone",
+    "is_soul_stealed",
+    "is_using_sharingan",
+    "selected_skill_id",
+    "charmed_by",
+)
+# STATE_FIELDS 按顺序打包成定长记录的格式（见 state_codec）：整数用 b/h，布尔用 ?
+STATE_STRUCT = struct.Struct("<bhb??bbb?bbb????bb")
+
+
 class Player:
+    # 不使用实例 __dict__，大量挂起的对局和搜索表中的状态占用更少内存
+    __slots__ = ("id", "is_human") + STATE_FIELDS
+
     def __init__(self, id, is_human=True):
         self.id = id
         self.is_human = is_human
@@ -29,6 +59,25 @@ class Player:
     def __str__(self):
         return f"<玩家 {self.id}>"
 
+    def get_state(self) -> dict:
+        """
+        获取玩家状态快照
+
+        Returns:
+            dict: 字段名到值的映射
+        """
+        return {field: getattr(self, field) for field in STATE_FIELDS}
+
+    def load_state(self, state: dict):
+        """
+        从快照恢复玩家状态
+
+        Args:
+            state (dict): get_state 返回的快照
+        """
+        for field in STATE_FIELDS:
+            setattr(self, field, state[field])
+
     def print_status(self):
         print(self)
         
@@ -0,0 +1,94 @@
+from agent import Agent
+from decision import DecisionRequest
+from game import Game
+from headless import quiet
+from player import Player
+from state_codec import decode_state
+
+
+class ReplayAgent(Agent):
+    """
+    按顺序重放行动记录的 agent，所有玩家共用同一个实例
+    """
+
+    def __init__(self, action_log: list, cursor: int = 0):
+        self.action_log = action_log
+        self.cursor = cursor
+
+    def next_action(self, player: Player):
+        round_count, player_id, action = self.action_log[self.cursor]
+
+        if player_id != player.id:
+            raise ValueError(
+                f"回放记录与游戏不一致：第 {round_count} 回合记录的是玩家 {player_id}，实际为 {player}"
+            )
+
+        self.cursor += 1
+        return action
+
+    def decide(self, game, request: DecisionRequest):
+        return self.next_action(game.players[request.player_id])
+
+
+class Replay:
+    """
+    一局游戏的回放：行动记录加上每 K 回合一个的关键帧
+    跳转到第 R 回合时从最近的关键帧恢复，最多重新模拟 K 回合
+    """
+
+    def __init__(self, player_num: int, action_log: list, keyframes: dict):
+        self.player_num = player_num
+        self.action_log = action_log
+        self.keyframes = keyframes
+
+    @classmethod
+    def from_game(cls, game: Game) -> "Replay":
+        """
+        从已结束（或进行中）的游戏生成回放，游戏需要以 keyframe_interval > 0 创建
+
+        Args:
+            game (Game): 记录了行动和关键帧的游戏
+
+        Returns:
+            Replay: 回放
+        """
+        if 1 not in game.keyframes:
+            raise ValueError(f"游戏没有记录关键帧，keyframe_interval: {game.keyframe_interval}")
+
+        return cls(game.player_num, list(game.action_log), dict(game.keyframes))
+
+    def nearest_keyframe(self, round_count: int) -> int:
+        """
+        获取不晚于指定回合的最近关键帧所在回合
+
+        Args:
+            round_count (int): 目标回合
+
+        Returns:
+            int: 关键帧回合
+        """
+        return max(r for r in self.keyframes if r <= round_count)
+
+    def seek(self, round_count: int) -> Game:
+        """
+        恢复到第 round_count 回合开始前的游戏状态
+        如果游戏在此之前已经结束，则返回结束时的状态
+
+        Args:
+            round_count (int): 目标回合，从 1 开始
+
+        Returns:
+            Game: 处于目标回合开始前的游戏
+        """
+        keyframe_round = self.nearest_keyframe(max(round_count, 1))
+        state, cursor = self.keyframes[keyframe_round]
+
+        replay_agent = ReplayAgent(self.action_log, cursor)
+        game = Game(self.player_num, [replay_agent] * self.player_num)
+        decode_state(state, game)
+
+        with quiet():
+            while game.round_count < round_count and not game.is_game_over():
+                game.run_round()
+
+        return game
@@ -0,0 +1,469 @@
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+
+import skill as sk
+
+
+class SummaryStats:
+    """
+    在线汇总的比赛统计，只保存计数和累积量，内存与比赛局数无关
+    """
+
+    def __init__(self, player_num: int):
+        self.player_num = player_num
+        self.game_num = 0
+        self.draw_num = 0
+        self.win_counts = [0] * player_num
+        # 回合数的均值和二阶中心矩（Welford 算法）
+        self.rounds_mean = 0.0
+        self.rounds_m2 = 0.0
+        self.max_rounds = 0
+        self.skill_counts = [[0] * sk.SKILL_NUM for _ in range(player_num)]
+
+    def add(self, result: dict):
+        """
+        加入一局的结果
+
+        Args:
+            result (dict): get_game_result 返回的结果
+        """
+        self.game_num += 1
+
+        winner = result["winner"]
+        if winner == -1:
+            self.draw_num += 1
+        else:
+            self.win_counts[winner] += 1
+
+        rounds = result["rounds"]
+        delta = rounds - self.rounds_mean
+        self.rounds_mean += delta / self.game_num
+        self.rounds_m2 += delta * (rounds - self.rounds_mean)
+        self.max_rounds = max(self.max_rounds, rounds)
+
+        for player_counts, counts in zip(self.skill_counts, result["skill_counts"]):
+            for skill_id, count in enumerate(counts):
+                player_counts[skill_id] += count
+
+    def merge(self, other: "SummaryStats"):
+        """
+        合并另一份统计（例如另一个进程的统计）
+
+        Args:
+            other (SummaryStats): 相同玩家数量的统计
+        """
+        game_num = self.game_num + other.game_num
+        if not other.game_num:
+            return
+
+        delta = other.rounds_mean - self.rounds_mean
+        self.rounds_m2 += (
+            other.rounds_m2 + delta * delta * self.game_num * other.game_num / game_num
+        )
+        self.rounds_mean += delta * other.game_num / game_num
+        self.game_num = game_num
+        self.draw_num += other.draw_num
+        self.max_rounds = max(self.max_rounds, other.max_rounds)
+
+        for player_id in range(self.player_num):
+            self.win_counts[player_id] += other.win_counts[player_id]
+            for skill_id in range(sk.SKILL_NUM):
+                self.skill_counts[player_id][skill_id] += other.skill_counts[
+                    player_id
+                ][skill_id]
+
+    def win_rate(self, player_id: int) -> float:
+        return self.win_counts[player_id] / self.game_num if self.game_num else 0.0
+
+    def rounds_std(self) -> float:
+        return math.sqrt(self.rounds_m2 / (self.game_num - 1)) if self.game_num > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "game_num": self.game_num,
+            "draw_num": self.draw_num,
+            "win_counts": list(self.win_counts),
+            "win_rates": [self.win_rate(i) for i in range(self.player_num)],
+            "rounds_mean": self.rounds_mean,
+            "rounds_std": self.rounds_std(),
+            "max_rounds": self.max_rounds,
+            "skill_counts": [list(counts) for counts in self.skill_counts],
+        }
+
+    def get_state(self) -> dict:
+        """
+        获取可以完整恢复统计的快照，用于检查点
+
+        Returns:
+            dict: 全部计数和累积量
+        """
+        return {
+            "game_num": self.game_num,
+            "draw_num": self.draw_num,
+            "win_counts": list(self.win_counts),
+            "rounds_mean": self.rounds_mean,
+            "rounds_m2": self.rounds_m2,
+            "max_rounds": self.max_rounds,
+            "skill_counts": [list(counts) for counts in self.skill_counts],
+        }
+
+    def load_state(self, state: dict):
+        """
+        从快照恢复统计
+
+        Args:
+            state (dict): get_state 返回的快照
+        """
+        self.game_num = state["game_num"]
+        self.draw_num = state["draw_num"]
+        self.win_counts = list(state["win_counts"])
+        self.rounds_mean = state["rounds_mean"]
+        self.rounds_m2 = state["rounds_m2"]
+        self.max_rounds = state["max_rounds"]
+        self.skill_counts = [list(counts) for counts in state["skill_counts"]]
+
+    def __str__(self):
+        return (
+            f"共 {self.game_num} 局，平局 {self.draw_num} 局，"
+            f"各座位胜率 {[round(self.win_rate(i), 4) for i in range(self.player_num)]}，"
+            f"平均回合数 {self.rounds_mean:.2f}（标准差 {self.rounds_std():.2f}）"
+        )
+
+
+class ResultWriter:
+    """
+    流式写出比赛结果的 JSONL 文件，每局一行
+    结果按 batch_size 行攒成一批，由后台线程写盘；待写批次数有上限，内存占用固定
+    """
+
+    def __init__(
+        self,
+        path: str,
+        player_num: int,
+        batch_size: int = 1000,
+        max_pending_batches: int = 8,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = SummaryStats(player_num)
+
+        self.batch = []
+        self.file = open(path, "a", encoding="utf-8")
+        # 写盘线程遇到的异常，由 flush、sync 和 close 在调用者线程中重新抛出
+        self.error = None
+        self.pending_batches = queue.Queue(max_pending_batches)
+        self.write_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.write_thread.start()
+
+    def write_loop(self):
+        """
+        后台写盘线程，收到 None 时退出
+        写盘出错后记录异常并继续取走后续批次（不再写入），调用者的 put 和 join 不会因此永远阻塞
+        """
+        while True:
+            chunk = self.pending_batches.get()
+            try:
+                if chunk is not None and self.error is None:
+                    self.file.write(chunk)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.pending_batches.task_done()
+
+            if chunk is None:
+                break
+
+        try:
+            self.file.flush()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def raise_error(self):
+        """
+        重新抛出写盘线程记录的异常
+        """
+        if self.error is not None:
+            raise self.error
+
+    def write(self, result: dict):
+        """
+        写入一局结果并更新汇总统计
+
+        Args:
+            result (dict): get_game_result 返回的结果
+        """
+        self.stats.add(result)
+        self.batch.append(json.dumps(result, ensure_ascii=False, separators=(",", ":")))
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        将当前批次交给写盘线程，写盘线程积压过多时才会阻塞
+        """
+        self.raise_error()
+        if not self.batch:
+            return
+
+        self.pending_batches.put("\n".join(self.batch) + "\n")
+        self.batch = []
+
+    def sync(self) -> int:
+        """
+        等待所有已写入的结果落盘
+
+        Returns:
+            int: 文件当前长度，可用于 truncate 回滚到此位置
+        """
+        self.flush()
+        self.pending_batches.join()
+        self.raise_error()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def truncate(self, position: int):
+        """
+        丢弃 position 之后的内容（例如检查点之后写入的结果）
+
+        Args:
+            position (int): sync 返回的位置
+        """
+        self.sync()
+        self.file.truncate(position)
+
+    def close(self):
+        try:
+            if self.error is None and self.batch:
+                self.pending_batches.put("\n".join(self.batch) + "\n")
+                self.batch = []
+            self.pending_batches.put(None)
+            self.write_thread.join()
+        finally:
+            self.file.close()
+
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_results(path: str):
+    """
+    逐行读取结果文件
+
+    Args:
+        path (str): JSONL 结果文件
+
+    Yields:
+        dict: 一局的结果
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+RESULT_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    seed INTEGER,
+    player_num INTEGER NOT NULL,
+    winner INTEGER NOT NULL,
+    rounds INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    game_id INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    won INTEGER NOT NULL,
+    hp INTEGER NOT NULL,
+    mp INTEGER NOT NULL,
+    PRIMARY KEY (game_id, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS actions (
+    game_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    skill_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outcomes_agent_seat ON outcomes (agent, seat, won);
+CREATE INDEX IF NOT EXISTS actions_skill_round ON actions (skill_id, round, game_id, seat);
+CREATE INDEX IF NOT EXISTS actions_game_round ON actions (game_id, round, seat);
+"""
+
+
+class ResultStore:
+    """
+    SQLite 比赛结果库：games 每局一行，outcomes 每个座位一行，actions 每个发动的招式一行
+    接口与 ResultWriter 相同；结果按 batch_size 局攒批后在一个事务内批量插入
+    库只应由一个进程写入，工作进程把结果交回写入进程即可
+    """
+
+    def __init__(self, path: str, player_num: int, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = SummaryStats(player_num)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(RESULT_STORE_SCHEMA)
+
+        (self.last_game_id,) = self.connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM games"
+        ).fetchone()
+
+        self.game_rows = []
+        self.outcome_rows = []
+        self.action_rows = []
+
+    def write(self, result: dict):
+        """
+        加入一局结果并更新汇总统计
+
+        Args:
+            result (dict): get_game_result 返回的结果
+        """
+        self.stats.add(result)
+
+        self.last_game_id += 1
+        game_id = self.last_game_id
+        winner = result["winner"]
+
+        self.game_rows.append(
+            (game_id, result.get("seed"), len(result["hp"]), winner, result["rounds"])
+        )
+        self.outcome_rows.extend(
+            (game_id, seat, agent, int(seat == winner), hp, mp)
+            for seat, (agent, hp, mp) in enumerate(
+                zip(result["agents"], result["hp"], result["mp"])
+            )
+        )
+        self.action_rows.extend(
+            (game_id, round_count, seat, skill_id)
+            for round_count, seat, skill_id in result["actions"]
+        )
+
+        if len(self.game_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        在一个事务内插入当前批次
+        """
+        if not self.game_rows:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO games VALUES (?, ?, ?, ?, ?)", self.game_rows
+            )
+            self.connection.executemany(
+                "INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?)", self.outcome_rows
+            )
+            self.connection.executemany(
+                "INSERT INTO actions VALUES (?, ?, ?, ?)", self.action_rows
+            )
+
+        self.game_rows = []
+        self.outcome_rows = []
+        self.action_rows = []
+
+    def sync(self) -> int:
+        """
+        提交当前批次
+
+        Returns:
+            int: 最后一局的编号，可用于 truncate 回滚到此位置
+        """
+        self.flush()
+        return self.last_game_id
+
+    def truncate(self, position: int):
+        """
+        删除编号大于 position 的局（例如检查点之后写入的结果）
+
+        Args:
+            position (int): sync 返回的最后一局编号
+        """
+        self.flush()
+
+        with self.connection:
+            for table, column in (("games", "id"), ("outcomes", "game_id"), ("actions", "game_id")):
+                self.connection.execute(f"DELETE FROM {table} WHERE {column} > ?", (position,))
+
+        self.last_game_id = position
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        return self.connection.execute(sql, params).fetchall()
+
+    def win_rate_using_skill(
+        self, skill_id: int, before_round: int = None, agent: str = None
+    ) -> tuple[float, int]:
+        """
+        发动过某招式的玩家的胜率，例如 win_rate_using_skill(DEAD_DEMON_CONSUMING_SEAL_ID, 5)
+        即在第 5 回合之前使用过尸鬼封尽的玩家的胜率
+
+        Args:
+            skill_id (int): 招式编号
+            before_round (int): 只统计该回合之前发动的招式，None 表示不限
+            agent (str): 只统计该 agent，None 表示不限
+
+        Returns:
+            tuple[float, int]: 胜率和样本数
+        """
+        sql = """
+            SELECT COALESCE(AVG(outcomes.won), 0.0), COUNT(*)
+            FROM (
+                SELECT DISTINCT game_id, seat FROM actions
+                WHERE skill_id = ? AND round < ?
+            ) AS users
+            JOIN outcomes USING (game_id, seat)
+        """
+        params = [skill_id, before_round if before_round is not None else 2**62]
+
+        if agent is not None:
+            sql += " WHERE outcomes.agent = ?"
+            params.append(agent)
+
+        win_rate, sample_num = self.connection.execute(sql, params).fetchone()
+        return win_rate, sample_num
+
+    def win_rate_by_seat(self, agent: str = None) -> list[tuple[int, float, int]]:
+        """
+        各座位的胜率
+
+        Args:
+            agent (str): 只统计该 agent，None 表示不限
+
+        Returns:
+            list[tuple[int, float, int]]: (座位, 胜率, 样本数) 列表
+        """
+        if agent is None:
+            return self.query(
+                "SELECT seat, AVG(won), COUNT(*) FROM outcomes GROUP BY seat ORDER BY seat"
+            )
+        return self.query(
+            "SELECT seat, AVG(won), COUNT(*) FROM outcomes WHERE agent = ? GROUP BY seat ORDER BY seat",
+            (agent,),
+        )
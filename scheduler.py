@@ -0,0 +1,91 @@
+from game import Game
+from headless import MAX_ROUNDS, quiet
+
+
+class GameScheduler:
+    """
+    在一个线程中交替推进多局游戏
+    每一步把所有进行中的游戏的待决策请求合并为一批，调用一次 answer_batch 回答后分发回各局
+    适合批量决策的 agent（例如神经网络策略）一次回答大量游戏的请求
+    """
+
+    def __init__(self, max_rounds: int = MAX_ROUNDS):
+        self.max_rounds = max_rounds
+        # 进行中的游戏：[游戏, 步进生成器, 待回答的请求]
+        self.active_games = []
+        self.finished_games = []
+
+    def add(self, game: Game):
+        """
+        加入一局游戏，没有 agent 的玩家的决策由 answer_batch 回答
+
+        Args:
+            game (Game): 游戏
+        """
+        steps = game.steps(self.max_rounds)
+
+        requests = next(steps, None)
+        if requests is None:
+            self.finished_games.append(game)
+        else:
+            self.active_games.append([game, steps, requests])
+
+    def pending_decisions(self) -> list[tuple]:
+        """
+        获取所有待回答的请求
+
+        Returns:
+            list[tuple[Game, DecisionRequest]]: (游戏, 请求) 列表
+        """
+        return [
+            (game, request)
+            for game, _, requests in self.active_games
+            for request in requests
+        ]
+
+    def step(self, answer_batch) -> int:
+        """
+        回答所有待回答的请求，并把各局推进到下一批请求或结束
+
+        Args:
+            answer_batch (Callable[[list[tuple[Game, DecisionRequest]]], list]): 批量回答函数，
+                返回与输入一一对应的答案
+
+        Returns:
+            int: 本步回答的请求数量
+        """
+        pending = self.pending_decisions()
+        answers = answer_batch(pending)
+
+        still_active = []
+        offset = 0
+        for entry in self.active_games:
+            game, steps, requests = entry
+            game_answers = answers[offset : offset + len(requests)]
+            offset += len(requests)
+
+            try:
+                entry[2] = steps.send(game_answers)
+            except StopIteration:
+                self.finished_games.append(game)
+            else:
+                still_active.append(entry)
+
+        self.active_games = still_active
+        return len(pending)
+
+    def run(self, answer_batch) -> list[Game]:
+        """
+        不打印地推进所有游戏直到全部结束
+
+        Args:
+            answer_batch (Callable[[list[tuple[Game, DecisionRequest]]], list]): 批量回答函数
+
+        Returns:
+            list[Game]: 结束的游戏，按结束顺序排列
+        """
+        with quiet():
+            while self.active_games:
+                self.step(answer_batch)
+
+        return self.finished_games
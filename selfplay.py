@@ -0,0 +1,380 @@
+import argparse
+import json
+import mmap
+import os
+from array import array
+from multiprocessing import Pool
+
+import skill as sk
+from agent import Agent
+from decision import DecisionRequest
+from headless import MAX_ROUNDS, get_winner_id, play_game
+from observation import ObservationEncoder
+from tournament import make_random_agents, split_seed_range
+
+# .npy 文件头固定为 128 字节，关闭分片时可以原地改写实际行数
+NPY_HEADER_SIZE = 128
+MAX_TARGET_NUM = sk.MAX_TARGET_NUM
+
+# 分片中每个数组的 (numpy 类型描述, memoryview 格式, 单个元素字节数)
+NPY_TYPES = {
+    "f4": ("<f4", "f", 4),
+    "i1": ("|i1", "b", 1),
+    "u1": ("|u1", "B", 1),
+}
+
+
+def make_npy_header(descr: str, shape: tuple) -> bytes:
+    """
+    生成 .npy 1.0 格式的文件头，用空格补齐到 NPY_HEADER_SIZE 字节
+
+    Args:
+        descr (str): numpy 类型描述，例如 '<f4'
+        shape (tuple): 数组形状
+
+    Returns:
+        bytes: 文件头
+    """
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {shape!r}, }}"
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class NpyMemmap:
+    """
+    预先分配容量的内存映射 .npy 文件，通过 view 原地写入，关闭时截断到实际行数
+    生成的文件可以直接用 numpy.load(path, mmap_mode='r') 零拷贝读取
+    """
+
+    def __init__(self, path: str, type_name: str, capacity: int, row_width: int = 0):
+        """
+        Args:
+            path (str): 文件路径
+            type_name (str): NPY_TYPES 中的类型
+            capacity (int): 最大行数
+            row_width (int): 每行元素数，0 表示一维数组
+        """
+        self.path = path
+        self.descr, view_format, self.item_size = NPY_TYPES[type_name]
+        self.row_width = row_width
+
+        row_bytes = self.item_size * max(row_width, 1)
+        self.file = open(path, "w+b")
+        self.file.truncate(NPY_HEADER_SIZE + capacity * row_bytes)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.view = memoryview(self.mmap)[NPY_HEADER_SIZE:].cast(view_format)
+
+    def close(self, rows: int):
+        """
+        写入实际形状的文件头并截断文件
+
+        Args:
+            rows (int): 实际写入的行数
+        """
+        shape = (rows, self.row_width) if self.row_width else (rows,)
+        self.mmap[:NPY_HEADER_SIZE] = make_npy_header(self.descr, shape)
+
+        self.view.release()
+        self.mmap.flush()
+        self.mmap.close()
+
+        self.file.truncate(NPY_HEADER_SIZE + rows * self.item_size * max(self.row_width, 1))
+        self.file.close()
+
+
+class Shard:
+    """
+    一个定长分片，由同名前缀的几个 .npy 文件组成：
+        obs (rows, feature_num) float32       决策时的观测
+        action (rows, 1 + MAX_TARGET_NUM) int8 招式编号，以及选择的目标相对座位（不足补 -1）
+        legal_mask (rows, SKILL_NUM + max_player_num) uint8  合法招式掩码 + 合法目标掩码（相对座位）
+        seat (rows,) int8                     决策的玩家编号
+        outcome (rows,) int8                  该玩家最终胜 1 / 平 0 / 负 -1
+    """
+
+    def __init__(self, directory: str, name: str, encoder: ObservationEncoder, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.rows = 0
+        self.game_num = 0
+
+        prefix = os.path.join(directory, name)
+        self.obs = NpyMemmap(f"{prefix}.obs.npy", "f4", capacity, encoder.feature_num)
+        self.action = NpyMemmap(f"{prefix}.action.npy", "i1", capacity, 1 + MAX_TARGET_NUM)
+        self.legal_mask = NpyMemmap(
+            f"{prefix}.legal_mask.npy", "u1", capacity, sk.SKILL_NUM + encoder.max_player_num
+        )
+        self.seat = NpyMemmap(f"{prefix}.seat.npy", "i1", capacity)
+        self.outcome = NpyMemmap(f"{prefix}.outcome.npy", "i1", capacity)
+
+    def is_full(self) -> bool:
+        return self.rows >= self.capacity
+
+    def close(self) -> dict:
+        """
+        Returns:
+            dict: 索引中的分片信息
+        """
+        for array in (self.obs, self.action, self.legal_mask, self.seat, self.outcome):
+            array.close(self.rows)
+
+        return {"name": self.name, "rows": self.rows, "games": self.game_num}
+
+
+class SelfPlayWriter:
+    """
+    把决策样本直接写入内存映射分片，分片写满后换新分片
+    一局的样本可能跨越分片，旧分片在这局结束、胜负回填后才关闭
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        encoder: ObservationEncoder = None,
+        shard_rows: int = 65536,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.encoder = encoder or ObservationEncoder()
+        self.shard_rows = shard_rows
+
+        # 清空一行动作 / 掩码用的模板
+        self.empty_action = array("b", [-1] * (1 + MAX_TARGET_NUM))
+        self.empty_mask = array("B", bytes(sk.SKILL_NUM + self.encoder.max_player_num))
+
+        self.open_shards = []
+        self.closed_shards = []
+        # 当前这局写入的样本位置：(分片, 行)
+        self.game_rows = []
+
+    def current_shard(self) -> Shard:
+        if not self.open_shards or self.open_shards[-1].is_full():
+            name = f"{self.prefix}-{len(self.open_shards) + len(self.closed_shards):04d}"
+            self.open_shards.append(
+                Shard(self.directory, name, self.encoder, self.shard_rows)
+            )
+
+        return self.open_shards[-1]
+
+    def record(self, game, request: DecisionRequest, answer):
+        """
+        写入一个决策样本，胜负在 end_game 时回填
+
+        Args:
+            game (Game): 游戏
+            request (DecisionRequest): 决策请求
+            answer (int | list[int]): 答案
+        """
+        shard = self.current_shard()
+        row = shard.rows
+        shard.rows += 1
+        self.game_rows.append((shard, row))
+
+        player_id = request.player_id
+        player_num = game.player_num
+
+        self.encoder.encode(game, request, shard.obs.view, row * self.encoder.feature_num)
+
+        action_width = 1 + MAX_TARGET_NUM
+        action = shard.action.view
+        action_offset = row * action_width
+        action[action_offset : action_offset + action_width] = self.empty_action
+
+        mask_width = sk.SKILL_NUM + self.encoder.max_player_num
+        mask = shard.legal_mask.view
+        mask_offset = row * mask_width
+        mask[mask_offset : mask_offset + mask_width] = self.empty_mask
+
+        if request.is_skill_decision():
+            action[action_offset] = answer
+            for skill_id in request.options:
+                if skill_id != sk.NONE_ACTION_ID:
+                    mask[mask_offset + skill_id] = 1
+        else:
+            action[action_offset] = request.skill_id
+            for i, target_id in enumerate(answer):
+                action[action_offset + 1 + i] = (target_id - player_id) % player_num
+            for target_id in request.options:
+                mask[mask_offset + sk.SKILL_NUM + (target_id - player_id) % player_num] = 1
+
+        shard.seat.view[row] = player_id
+
+    def end_game(self, game):
+        """
+        回填这局所有样本的胜负，并关闭已写满的分片
+
+        Args:
+            game (Game): 结束的游戏
+        """
+        winner_id = get_winner_id(game)
+
+        for shard, row in self.game_rows:
+            seat = shard.seat.view[row]
+            if winner_id == -1:
+                shard.outcome.view[row] = 0
+            else:
+                shard.outcome.view[row] = 1 if seat == winner_id else -1
+
+        if self.game_rows:
+            self.game_rows[-1][0].game_num += 1
+        self.game_rows = []
+
+        while len(self.open_shards) > 1 or self.open_shards and self.open_shards[0].is_full():
+            self.closed_shards.append(self.open_shards.pop(0).close())
+
+    def close(self) -> list[dict]:
+        """
+        Returns:
+            list[dict]: 所有分片的信息
+        """
+        while self.open_shards:
+            self.closed_shards.append(self.open_shards.pop(0).close())
+
+        return self.closed_shards
+
+
+class RecordingAgent(Agent):
+    """
+    包装另一个同步 agent，把它的每个决策写入 SelfPlayWriter
+    """
+
+    def __init__(self, agent: Agent, writer: SelfPlayWriter):
+        self.agent = agent
+        self.writer = writer
+
+    @property
+    def name(self) -> str:
+        return self.agent.name
+
+    def decide(self, game, request: DecisionRequest):
+        answer = self.agent.decide(game, request)
+        self.writer.record(game, request, answer)
+        return answer
+
+
+def generate_seed_range(task: tuple) -> list[dict]:
+    """
+    工作进程的入口：进行一段种子的自对弈，样本直接写入该段自己的分片
+
+    Args:
+        task (tuple): (起始种子, 结束种子, 玩家数量, agent 工厂, 输出目录, 分片行数, 最大玩家数, 最大回合数)
+
+    Returns:
+        list[dict]: 分片信息
+    """
+    (
+        start,
+        stop,
+        player_num,
+        agent_factory,
+        directory,
+        shard_rows,
+        max_player_num,
+        max_rounds,
+    ) = task
+    writer = SelfPlayWriter(
+        directory, f"shard-{start:010d}", ObservationEncoder(max_player_num), shard_rows
+    )
+
+    for seed in range(start, stop):
+        agents = [
+            RecordingAgent(agent, writer) for agent in agent_factory(seed, player_num)
+        ]
+        writer.end_game(play_game(agents, max_rounds))
+
+    shards = writer.close()
+    for shard in shards:
+        shard["first_seed"] = start
+        shard["last_seed"] = stop - 1
+    return shards
+
+
+def generate_selfplay(
+    directory: str,
+    player_num: int,
+    game_num: int,
+    first_seed: int = 0,
+    agent_factory=make_random_agents,
+    processes: int = None,
+    chunk_size: int = 1000,
+    shard_rows: int = 65536,
+    max_player_num: int = 8,
+    max_rounds: int = MAX_ROUNDS,
+) -> dict:
+    """
+    并行生成自对弈数据，每段种子由一个工作进程写入自己的分片，最后写出 index.json
+
+    Args:
+        directory (str): 输出目录
+        player_num (int): 玩家数量
+        game_num (int): 局数
+        first_seed (int): 起始种子
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂，必须可被 pickle
+        processes (int): 进程数，为 1 时在当前进程中执行
+        chunk_size (int): 每个任务的局数
+        shard_rows (int): 每个分片的最大样本数
+        max_player_num (int): 观测编码的最大玩家数
+        max_rounds (int): 最大回合数
+
+    Returns:
+        dict: 索引内容
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    tasks = [
+        (
+            start,
+            stop,
+            player_num,
+            agent_factory,
+            directory,
+            shard_rows,
+            max_player_num,
+            max_rounds,
+        )
+        for start, stop in split_seed_range(first_seed, first_seed + game_num, chunk_size)
+    ]
+
+    if processes == 1:
+        shard_lists = [generate_seed_range(task) for task in tasks]
+    else:
+        with Pool(processes) as pool:
+            shard_lists = pool.map(generate_seed_range, tasks)
+
+    encoder = ObservationEncoder(max_player_num)
+    index = {
+        "player_num": player_num,
+        "max_player_num": max_player_num,
+        "feature_num": encoder.feature_num,
+        "action_width": 1 + MAX_TARGET_NUM,
+        "mask_width": sk.SKILL_NUM + max_player_num,
+        "rows": sum(shard["rows"] for shards in shard_lists for shard in shards),
+        "shards": [shard for shards in shard_lists for shard in shards],
+    }
+
+    with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成自对弈训练数据（内存映射 .npy 分片）")
+    parser.add_argument("directory", help="输出目录")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("game_num", type=int, help="局数")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--shard-rows", type=int, default=65536)
+    args = parser.parse_args()
+
+    index = generate_selfplay(
+        args.directory,
+        args.player_num,
+        args.game_num,
+        first_seed=args.first_seed,
+        processes=args.processes,
+        shard_rows=args.shard_rows,
+    )
+    print(f"共 {index['rows']} 个样本，{len(index['shards'])} 个分片")
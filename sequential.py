@@ -0,0 +1,205 @@
+import argparse
+import math
+from multiprocessing import Pool
+
+from balance import Arm, parse_cost_override, play_paired_games
+from headless import MAX_ROUNDS
+from tournament import split_seed_range
+
+A_BETTER = "A"
+B_BETTER = "B"
+NO_DIFFERENCE = "="
+
+
+class SPRT:
+    """
+    比较 A / B 两组胜率的序贯概率比检验（Sobel-Wald 三假设检验）
+    只使用不一致的配对（一组赢另一组没赢），记 p 为不一致配对中 A 获胜的比例，同时进行两个 SPRT：
+        A 检验 p = 0.5 vs p = 0.5 + delta
+        B 检验 p = 0.5 vs p = 0.5 - delta
+    某个检验接受备择假设时判定对应组更强，两个检验都接受 p = 0.5 时判定差异小于 delta
+    alpha 为每个单侧检验误判对应组更强的概率上限，两个单侧检验合起来误判某组更强的概率接近 2 * alpha
+    beta 为差异达到 delta 时漏判的概率上限
+    """
+
+    def __init__(self, delta: float = 0.1, alpha: float = 0.05, beta: float = 0.05):
+        self.upper_bound = math.log((1 - beta) / alpha)
+        self.lower_bound = math.log(beta / (1 - alpha))
+        # A 检验中 A 独胜 / B 独胜一次的对数似然比增量，B 检验与之对称
+        self.more_llr = math.log((0.5 + delta) / 0.5)
+        self.less_llr = math.log((0.5 - delta) / 0.5)
+
+        self.a_only_num = 0  # 只有 A 获胜的配对
+        self.b_only_num = 0  # 只有 B 获胜的配对
+        self.a_llr = 0.0
+        self.b_llr = 0.0
+        # 检验得出结论后不再更新：True 为接受备择假设，False 为接受 p = 0.5
+        self.a_test_result = None
+        self.b_test_result = None
+
+    def add(self, a_won: int, b_won: int):
+        if a_won == b_won:
+            return
+
+        if a_won:
+            self.a_only_num += 1
+            self.a_llr += self.more_llr
+            self.b_llr += self.less_llr
+        else:
+            self.b_only_num += 1
+            self.a_llr += self.less_llr
+            self.b_llr += self.more_llr
+
+        if self.a_test_result is None:
+            self.a_test_result = self.check(self.a_llr)
+        if self.b_test_result is None:
+            self.b_test_result = self.check(self.b_llr)
+
+    def check(self, llr: float) -> bool:
+        if llr >= self.upper_bound:
+            return True
+        if llr <= self.lower_bound:
+            return False
+        return None
+
+    @property
+    def decision(self) -> str:
+        """
+        Returns:
+            str: A_BETTER、B_BETTER、NO_DIFFERENCE，或尚无结论时为 None
+        """
+        if self.a_test_result:
+            return A_BETTER
+        if self.b_test_result:
+            return B_BETTER
+        if self.a_test_result is False and self.b_test_result is False:
+            return NO_DIFFERENCE
+        return None
+
+
+class SequentialResult:
+    """
+    序贯对比实验的结果
+    """
+
+    def __init__(self, sprt: SPRT):
+        self.sprt = sprt
+        self.game_num = 0
+        self.a_win_num = 0
+        self.b_win_num = 0
+
+    def add(self, a_won: int, b_won: int):
+        self.game_num += 1
+        self.a_win_num += a_won
+        self.b_win_num += b_won
+        self.sprt.add(a_won, b_won)
+
+    @property
+    def decision(self) -> str:
+        return self.sprt.decision
+
+    def __str__(self):
+        conclusion = {
+            A_BETTER: "A 更强",
+            B_BETTER: "B 更强",
+            NO_DIFFERENCE: "差异小于 delta",
+            None: "未得出结论",
+        }[self.decision]
+        return (
+            f"{conclusion}：共 {self.game_num} 对比赛，"
+            f"A 胜率 {self.a_win_num / max(self.game_num, 1):.4f}，"
+            f"B 胜率 {self.b_win_num / max(self.game_num, 1):.4f}，"
+            f"不一致配对 A {self.sprt.a_only_num} / B {self.sprt.b_only_num}，"
+            f"对数似然比 A {self.sprt.a_llr:.3f} / B {self.sprt.b_llr:.3f}"
+        )
+
+
+def run_sequential_test(
+    arm_a: Arm,
+    arm_b: Arm,
+    player_num: int,
+    delta: float = 0.1,
+    alpha: float = 0.05,
+    beta: float = 0.05,
+    batch_size: int = 100,
+    max_games: int = 100000,
+    focal_seat: int = 0,
+    first_seed: int = 0,
+    antithetic: bool = True,
+    processes: int = None,
+    max_rounds: int = MAX_ROUNDS,
+) -> SequentialResult:
+    """
+    按批次进行 A / B 配对比赛，每批结束后检验，一旦得出结论就停止
+
+    Args:
+        arm_a (Arm): A 组
+        arm_b (Arm): B 组
+        player_num (int): 玩家数量
+        delta (float): 不一致配对中需要检出的 A 胜率与 0.5 的差
+        alpha (float): 每个单侧检验误判对应组更强的概率上限，总的误判概率接近 2 * alpha
+        beta (float): 真实差异达到 delta 时漏判（判定差异小于 delta）的概率上限
+        batch_size (int): 每批的种子数
+        max_games (int): 最多的种子数，达到后不再继续
+        focal_seat (int): 关注的座位
+        first_seed (int): 起始种子
+        antithetic (bool): 是否使用对偶随机数
+        processes (int): 进程数，为 1 时在当前进程中执行
+        max_rounds (int): 最大回合数
+
+    Returns:
+        SequentialResult: 实验结果
+    """
+    tasks = [
+        (start, stop, arm_a, arm_b, player_num, focal_seat, antithetic, max_rounds)
+        for start, stop in split_seed_range(
+            first_seed, first_seed + max_games, batch_size
+        )
+    ]
+    result = SequentialResult(SPRT(delta, alpha, beta))
+
+    def consume(outcome_batches):
+        for outcomes in outcome_batches:
+            for a_won, b_won in outcomes:
+                result.add(a_won, b_won)
+            if result.decision:
+                return
+
+    if processes == 1:
+        consume(map(play_paired_games, tasks))
+    else:
+        # 按顺序取回批次保证结果可复现，得出结论后退出 with 会终止剩余的任务
+        with Pool(processes) as pool:
+            consume(pool.imap(play_paired_games, tasks))
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A / B 规则变体的序贯对比实验")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("--ban-a", type=int, nargs="*", default=(), help="A 组关注座位禁用的招式")
+    parser.add_argument("--ban-b", type=int, nargs="*", default=(), help="B 组关注座位禁用的招式")
+    parser.add_argument("--cost-a", type=parse_cost_override, nargs="*", default=())
+    parser.add_argument("--cost-b", type=parse_cost_override, nargs="*", default=())
+    parser.add_argument("--delta", type=float, default=0.1)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-games", type=int, default=100000)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    print(
+        run_sequential_test(
+            Arm(args.ban_a, dict(args.cost_a)),
+            Arm(args.ban_b, dict(args.cost_b)),
+            args.player_num,
+            delta=args.delta,
+            alpha=args.alpha,
+            beta=args.beta,
+            batch_size=args.batch_size,
+            max_games=args.max_games,
+            processes=args.processes,
+        )
+    )
@@ -0,0 +1,557 @@
+"""
+基于 asyncio 的对局服务器，一个进程同时托管任意多桌游戏
+协议为每行一个 JSON 对象：
+    客户端 -> 服务器
+        {"type": "join", "player_num": 3}                    加入等待队列，凑满人数后开局
+        {"type": "answer", "id": 7, "answer": 2}              回答决策请求，选择目标时 answer 为目标编号列表
+        {"type": "watch", "table": 0}                         观战一桌正在进行的游戏
+    服务器 -> 客户端
+        {"type": "start", "table": 0, "seat": 1, "player_num": 3}
+        {"type": "round", "table": 0, "round_count": 1, "state": {...}}
+        {"type": "decision", "id": 7, "table": 0, "kind": "skill", "options": [...], ...}
+        {"type": "timeout", "id": 7, "table": 0, "answer": 0}  超时，使用默认答案
+        {"type": "error", "message": "..."}
+        {"type": "end", "table": 0, "winner": 1, "rounds": 12}
+    服务器 -> 观战者
+        {"type": "frame", "table": 0, "round_count": 1, "keyframe": true, "data": "..."}
+            data 为 base64 编码的 state_codec 帧，keyframe 为 true 时是完整帧，否则是相对上一帧的增量帧
+        {"type": "end", "table": 0, "winner": 1, "rounds": 12}
+同一连接可以加入多桌，消息中的 table 用于区分
+同一批同时进行的决策（同一回合、同一决策类型）共享一个截止时间，超时的玩家使用默认答案；
+写轮眼和影分身的决策逐个玩家依次进行，每个玩家各自有一个截止时间
+每回合的帧只序列化一次，所有观战者共享同一份字节；观战者的发送队列满时丢弃积压的帧，之后从完整帧重新同步，不会拖慢对局
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+from collections import defaultdict
+
+from agent import Agent
+from decision import SHADOW_CLONE_TARGETS, SHARINGAN_SKILL, SHARINGAN_TARGETS, DecisionRequest
+from game import Game
+from headless import MAX_ROUNDS, get_winner_id, quiet
+from state_codec import FULL_FRAME, DeltaDecoder, DeltaEncoder, encode_state
+
+# 逐个玩家依次请求的决策类型，每个玩家的决策单独计时
+SEQUENTIAL_DECISION_KINDS = (SHADOW_CLONE_TARGETS, SHARINGAN_SKILL, SHARINGAN_TARGETS)
+# 每个观战者最多积压的消息数量
+MAX_SPECTATOR_PENDING = 16
+
+
+def encode_message(message: dict) -> bytes:
+    return (json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+class Connection:
+    """
+    一个客户端连接
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.is_closed = False
+        # 等待回答的决策：请求编号 -> (决策请求, future)
+        self.pending_decisions = {}
+
+    def send(self, message: dict):
+        self.write(encode_message(message))
+
+    def write(self, data: bytes):
+        if self.is_closed:
+            return
+        self.writer.write(data)
+
+    async def messages(self):
+        """
+        逐行读取客户端消息，连接断开时结束
+
+        Yields:
+            dict: 消息
+        """
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                self.send({"type": "error", "message": "无法解析的消息"})
+                continue
+
+            if not isinstance(message, dict):
+                self.send({"type": "error", "message": "消息必须是 JSON 对象"})
+                continue
+
+            yield message
+
+    def resolve(self, message: dict):
+        """
+        处理客户端的回答，非法的回答会被拒绝，玩家可以在截止时间前重新回答
+
+        Args:
+            message (dict): answer 消息
+        """
+        pending = self.pending_decisions.get(message.get("id"))
+        if not pending:
+            self.send({"type": "error", "message": f"没有等待回答的决策 {message.get('id')}"})
+            return
+
+        request, future = pending
+        answer = message.get("answer")
+
+        if not request.is_legal(answer):
+            self.send(
+                {
+                    "type": "error",
+                    "message": f"决策 {message['id']} 的答案 {answer} 不合法",
+                }
+            )
+            return
+
+        if not future.done():
+            future.set_result(answer)
+
+    def close(self):
+        """
+        关闭连接，所有等待中的决策使用默认答案
+        """
+        self.is_closed = True
+
+        for request, future in self.pending_decisions.values():
+            if not future.done():
+                future.set_result(request.default_answer())
+
+        self.pending_decisions.clear()
+        self.writer.close()
+
+
+class RemoteAgent(Agent):
+    """
+    通过网络连接决策的 agent，decide 发出请求后立即返回 future，不阻塞其他玩家和其他桌
+    """
+
+    decision_ids = itertools.count()
+
+    def __init__(self, table: "Table", connection: Connection):
+        self.table = table
+        self.connection = connection
+
+    def decide(self, game, request: DecisionRequest):
+        return asyncio.ensure_future(self.ask(request))
+
+    async def ask(self, request: DecisionRequest):
+        """
+        向客户端发出请求并等待回答，超过截止时间或连接断开时使用默认答案
+        """
+        if self.connection.is_closed:
+            return request.default_answer()
+
+        loop = asyncio.get_running_loop()
+        decision_id = next(self.decision_ids)
+        future = loop.create_future()
+
+        self.connection.pending_decisions[decision_id] = (request, future)
+        self.connection.send(
+            {"type": "decision", "id": decision_id, "table": self.table.id, **request.to_dict()}
+        )
+
+        timeout = max(self.table.get_deadline(request) - loop.time(), 0)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            answer = request.default_answer()
+            self.connection.send(
+                {"type": "timeout", "id": decision_id, "table": self.table.id, "answer": answer}
+            )
+            return answer
+        finally:
+            self.connection.pending_decisions.pop(decision_id, None)
+
+
+class Spectator:
+    """
+    一个观战连接，消息通过有界队列由独立的任务写出，慢速连接只会阻塞自己的写任务
+    """
+
+    def __init__(self, connection: Connection, max_pending: int = MAX_SPECTATOR_PENDING):
+        self.connection = connection
+        self.queue = asyncio.Queue(max_pending)
+        # 新加入或丢过帧的观战者需要先收到完整帧
+        self.needs_keyframe = True
+        self.dropped_num = 0
+        self.task = asyncio.create_task(self.write_loop())
+
+    def offer(self, data: bytes, is_keyframe: bool = False) -> bool:
+        """
+        把一条消息放入发送队列，队列已满时清空积压并等待下一个完整帧
+
+        Args:
+            data (bytes): 已经序列化的消息
+            is_keyframe (bool): 是否是完整帧
+
+        Returns:
+            bool: 是否放入了队列
+        """
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_keyframe = True
+            self.dropped_num += 1
+            return False
+
+        self.queue.put_nowait(data)
+        if is_keyframe:
+            self.needs_keyframe = False
+        return True
+
+    def close(self):
+        """
+        发送完已排队的消息后结束写任务，队列已满时与 offer 一样清空积压
+        """
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_keyframe = True
+            self.dropped_num += 1
+        self.queue.put_nowait(None)
+
+    async def write_loop(self):
+        writer = self.connection.writer
+
+        while (data := await self.queue.get()) is not None:
+            if self.connection.is_closed:
+                return
+            self.connection.write(data)
+
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+
+
+class Table:
+    """
+    一桌游戏
+    """
+
+    def __init__(
+        self,
+        id: int,
+        connections: list[Connection],
+        round_timeout: float,
+        max_rounds: int,
+    ):
+        self.id = id
+        self.connections = connections
+        self.round_timeout = round_timeout
+        self.max_rounds = max_rounds
+
+        self.game = Game(
+            len(connections), [RemoteAgent(self, connection) for connection in connections]
+        )
+
+        self.deadline_key = None
+        self.deadline = 0.0
+
+        self.spectators = []
+        self.frame_encoder = DeltaEncoder()
+
+    def get_deadline(self, request: DecisionRequest) -> float:
+        """
+        获取请求的截止时间，同一回合同一类型的决策共享一个截止时间，
+        逐个玩家依次请求的决策（写轮眼、影分身）每个玩家单独计时
+
+        Args:
+            request (DecisionRequest): 决策请求
+
+        Returns:
+            float: 事件循环时间
+        """
+        key = (request.round_count, request.kind)
+        if request.kind in SEQUENTIAL_DECISION_KINDS:
+            key += (request.player_id,)
+        if key != self.deadline_key:
+            self.deadline_key = key
+            self.deadline = asyncio.get_running_loop().time() + self.round_timeout
+
+        return self.deadline
+
+    def broadcast(self, message: dict):
+        for connection in self.connections:
+            connection.send(message)
+
+    def watch(self, connection: Connection) -> Spectator:
+        """
+        添加观战者，下一帧会向其发送完整帧
+
+        Args:
+            connection (Connection): 观战连接
+
+        Returns:
+            Spectator: 观战者
+        """
+        spectator = Spectator(connection)
+        self.spectators.append(spectator)
+        return spectator
+
+    def encode_frame(self, frame: bytes, is_keyframe: bool) -> bytes:
+        return encode_message(
+            {
+                "type": "frame",
+                "table": self.id,
+                "round_count": self.game.round_count,
+                "keyframe": is_keyframe,
+                "data": base64.b64encode(frame).decode(),
+            }
+        )
+
+    def publish_frame(self):
+        """
+        向所有观战者发送当前状态：增量帧和完整帧各最多序列化一次
+        """
+        # 结束已断开的观战者的写任务，否则它会一直等待队列
+        for spectator in self.spectators:
+            if spectator.connection.is_closed:
+                spectator.close()
+        self.spectators = [
+            spectator for spectator in self.spectators if not spectator.connection.is_closed
+        ]
+        if not self.spectators:
+            # 没有观战者时下一帧从完整帧开始
+            self.frame_encoder.reset()
+            return
+
+        frame = self.frame_encoder.encode(self.game)
+        is_full_frame = frame[0] == FULL_FRAME
+        delta_data = self.encode_frame(frame, is_full_frame)
+        keyframe_data = delta_data if is_full_frame else None
+
+        for spectator in self.spectators:
+            if spectator.needs_keyframe:
+                if keyframe_data is None:
+                    keyframe_data = self.encode_frame(encode_state(self.game), True)
+                spectator.offer(keyframe_data, True)
+            else:
+                spectator.offer(delta_data)
+
+    def close_spectators(self, end_message: dict):
+        data = encode_message(end_message)
+
+        for spectator in self.spectators:
+            # 队列已满时 offer 清空积压后放弃这条消息，结束消息需要再放入一次
+            if not spectator.offer(data):
+                spectator.offer(data)
+            spectator.close()
+
+        self.spectators = []
+
+    async def run(self):
+        game = self.game
+
+        for seat, connection in enumerate(self.connections):
+            connection.send(
+                {"type": "start", "table": self.id, "seat": seat, "player_num": game.player_num}
+            )
+
+        while not game.is_game_over() and game.round_count <= self.max_rounds:
+            self.broadcast(
+                {
+                    "type": "round",
+                    "table": self.id,
+                    "round_count": game.round_count,
+                    "state": game.get_state(),
+                }
+            )
+            self.publish_frame()
+            await game.run_round_async()
+
+        self.publish_frame()
+
+        end_message = {
+            "type": "end",
+            "table": self.id,
+            "winner": get_winner_id(game),
+            "rounds": game.round_count - 1,
+        }
+        self.broadcast(end_message)
+        self.close_spectators(end_message)
+
+
+class GameServer:
+    """
+    对局服务器：按玩家数量匹配等待中的玩家，每桌一个 asyncio 任务
+    """
+
+    def __init__(self, round_timeout: float = 30.0, max_rounds: int = MAX_ROUNDS):
+        self.round_timeout = round_timeout
+        self.max_rounds = max_rounds
+
+        self.waiting_connections = defaultdict(list)  # 玩家数量 -> 等待中的连接
+        self.tables = {}
+        self.table_ids = itertools.count()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        connection = Connection(reader, writer)
+
+        try:
+            async for message in connection.messages():
+                message_type = message.get("type")
+
+                if message_type == "answer":
+                    connection.resolve(message)
+                elif message_type == "join":
+                    self.join(connection, message.get("player_num"))
+                elif message_type == "watch":
+                    self.watch(connection, message.get("table"))
+                else:
+                    connection.send({"type": "error", "message": f"未知的消息类型 {message_type}"})
+        except ConnectionError:
+            pass
+        finally:
+            for waiting in self.waiting_connections.values():
+                while connection in waiting:
+                    waiting.remove(connection)
+            connection.close()
+
+    def join(self, connection: Connection, player_num: int):
+        """
+        加入等待队列，凑满人数后开局
+
+        Args:
+            connection (Connection): 客户端连接
+            player_num (int): 玩家数量
+        """
+        if type(player_num) is not int or player_num < 2:
+            connection.send({"type": "error", "message": f"玩家数量 {player_num} 不合法"})
+            return
+
+        waiting = self.waiting_connections[player_num]
+        waiting.append(connection)
+
+        if len(waiting) < player_num:
+            return
+
+        table = Table(
+            next(self.table_ids), waiting[:player_num], self.round_timeout, self.max_rounds
+        )
+        del waiting[:player_num]
+
+        self.tables[table.id] = table
+        asyncio.create_task(self.run_table(table))
+
+    def watch(self, connection: Connection, table_id: int):
+        """
+        观战一桌正在进行的游戏
+
+        Args:
+            connection (Connection): 客户端连接
+            table_id (int): 桌号
+        """
+        table = self.tables.get(table_id)
+        if table is None:
+            connection.send({"type": "error", "message": f"没有正在进行的桌 {table_id}"})
+            return
+
+        table.watch(connection)
+
+    async def run_table(self, table: Table):
+        try:
+            await table.run()
+        finally:
+            del self.tables[table.id]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def run_random_client(
+    host: str, port: int, player_num: int, table_num: int = 1, seed=None
+) -> list[dict]:
+    """
+    随机决策的测试客户端：加入 table_num 桌游戏并随机回答所有决策，直到全部结束
+
+    Returns:
+        list[dict]: 每桌的 end 消息
+    """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    def send(message: dict):
+        writer.write((json.dumps(message) + "\n").encode())
+
+    for _ in range(table_num):
+        send({"type": "join", "player_num": player_num})
+
+    end_messages = []
+    while len(end_messages) < table_num:
+        line = await reader.readline()
+        if not line:
+            break
+
+        message = json.loads(line)
+
+        if message["type"] == "decision":
+            options = message["options"]
+            if message["target_num"]:
+                answer = [rng.choice(options) for _ in range(message["target_num"])]
+            else:
+                answer = rng.choice(options)
+            send({"type": "answer", "id": message["id"], "answer": answer})
+        elif message["type"] == "end":
+            end_messages.append(message)
+
+    writer.close()
+    return end_messages
+
+
+async def run_spectator_client(host: str, port: int, table_id: int) -> tuple[list, dict]:
+    """
+    观战测试客户端：观战一桌直到结束，并用 DeltaDecoder 还原每一帧
+
+    Returns:
+        tuple[list[list[int]], dict]: 每一帧解码后的状态序列，以及 end 消息
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps({"type": "watch", "table": table_id}) + "\n").encode())
+
+    decoder = DeltaDecoder()
+    states = []
+    end_message = None
+
+    while line := await reader.readline():
+        message = json.loads(line)
+
+        if message["type"] == "frame":
+            states.append(decoder.decode(base64.b64decode(message["data"])))
+        elif message["type"] in ("end", "error"):
+            end_message = message
+            break
+
+    writer.close()
+    return states, end_message
+
+
+async def serve(host: str, port: int, round_timeout: float):
+    server = await GameServer(round_timeout).start(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Naruto 游戏对局服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--round-timeout", type=float, default=30.0, help="每批决策的时限（秒）")
+    args = parser.parse_args()
+
+    # 服务器同时运行大量对局，不输出游戏过程
+    with quiet():
+        asyncio.run(serve(args.host, args.port, args.round_timeout))
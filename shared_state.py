@@ -0,0 +1,290 @@
+import argparse
+import time
+from multiprocessing import Pool, shared_memory
+
+import skill as sk
+from game import Game
+from headless import MAX_ROUNDS, quiet
+from player import STATE_FIELDS, Player
+from tournament import make_random_agents, split_seed_range
+
+# 每局头部字段
+GAME_FIELDS = ("seed", "round_count", "winner")
+# 未结束的局的 winner 取值，结束后为胜者编号或 -1（平局、达到最大回合数）
+UNFINISHED = -2
+MAX_TARGET_NUM = sk.MAX_TARGET_NUM
+# 布尔类型的玩家字段，读回时需要从整数还原
+BOOL_FIELDS = frozenset(
+    field for field in STATE_FIELDS if isinstance(getattr(Player(0), field), bool)
+)
+# 每个玩家占用的整数数量：状态字段、预选招式、预选目标
+PLAYER_WIDTH = len(STATE_FIELDS) + 1 + MAX_TARGET_NUM
+INT_SIZE = 4
+
+
+class SharedGameStates:
+    """
+    放在共享内存中的多局游戏状态，每局一行 int32
+
+    行布局为 GAME_FIELDS 后接每个玩家的 STATE_FIELDS、预选招式编号和预选目标编号（不足补 -1）。
+    各进程按名字挂载同一块内存，直接就地读写，不需要 pickle 游戏对象
+    """
+
+    def __init__(self, game_num: int, player_num: int, name: str = None):
+        """
+        Args:
+            game_num (int): 游戏局数
+            player_num (int): 每局玩家数量
+            name (str): 已有共享内存的名字，为 None 时新建
+        """
+        self.game_num = game_num
+        self.player_num = player_num
+        self.row_width = len(GAME_FIELDS) + player_num * PLAYER_WIDTH
+
+        size = game_num * self.row_width * INT_SIZE
+        self.is_owner = name is None
+        self.memory = shared_memory.SharedMemory(
+            name=name, create=self.is_owner, size=size if self.is_owner else 0
+        )
+        self.view = self.memory.buf[:size].cast("i")
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def get_offset(self, game_index: int, field: str) -> int:
+        return game_index * self.row_width + GAME_FIELDS.index(field)
+
+    def get_seed(self, game_index: int) -> int:
+        return self.view[self.get_offset(game_index, "seed")]
+
+    def get_round_count(self, game_index: int) -> int:
+        return self.view[self.get_offset(game_index, "round_count")]
+
+    def get_winner(self, game_index: int) -> int:
+        return self.view[self.get_offset(game_index, "winner")]
+
+    def is_finished(self, game_index: int) -> bool:
+        return self.get_winner(game_index) != UNFINISHED
+
+    def reset(self, game_index: int, seed: int):
+        """
+        把一局写成新游戏的初始状态
+
+        Args:
+            game_index (int): 局编号
+            seed (int): 局种子
+        """
+        self.store(game_index, Game(self.player_num, [None] * self.player_num))
+        self.view[self.get_offset(game_index, "seed")] = seed
+
+    def store(self, game_index: int, game: Game):
+        """
+        把游戏状态写入共享内存
+
+        Args:
+            game_index (int): 局编号
+            game (Game): 回合开始时的游戏
+        """
+        view = self.view
+        offset = game_index * self.row_width
+
+        view[offset + 1] = game.round_count
+        view[offset + 2] = UNFINISHED
+        offset += len(GAME_FIELDS)
+
+        for player in game.players:
+            for field in STATE_FIELDS:
+                view[offset] = getattr(player, field)
+                offset += 1
+
+            view[offset] = game.preselected_skill_ids[player.id]
+            offset += 1
+
+            targets = game.preselected_skill_targets[player.id]
+            for i in range(MAX_TARGET_NUM):
+                view[offset + i] = targets[i].id if i < len(targets) else -1
+            offset += MAX_TARGET_NUM
+
+    def load(self, game_index: int, game: Game):
+        """
+        从共享内存恢复游戏状态，游戏的玩家数量必须一致
+
+        Args:
+            game_index (int): 局编号
+            game (Game): 要恢复的游戏
+        """
+        view = self.view
+        offset = game_index * self.row_width
+
+        game.round_count = view[offset + 1]
+        offset += len(GAME_FIELDS)
+
+        for player in game.players:
+            for field in STATE_FIELDS:
+                value = view[offset]
+                setattr(player, field, bool(value) if field in BOOL_FIELDS else value)
+                offset += 1
+
+            game.preselected_skill_ids[player.id] = view[offset]
+            offset += 1
+
+            game.preselected_skill_targets[player.id] = [
+                game.players[target_id]
+                for target_id in view[offset : offset + MAX_TARGET_NUM]
+                if target_id >= 0
+            ]
+            offset += MAX_TARGET_NUM
+
+        game.clear_skills()
+
+    def finish(self, game_index: int, winner: int):
+        self.view[self.get_offset(game_index, "winner")] = winner
+
+    def close(self):
+        """
+        释放本进程的映射，创建者同时删除共享内存
+        """
+        self.view.release()
+        self.memory.close()
+
+        if self.is_owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def advance_games(task: tuple) -> int:
+    """
+    worker 进程入口：挂载共享内存，把一段局就地推进若干回合
+
+    每次推进都用局种子和当前回合数重新生成 agent，因此结果与分段方式和进程数无关
+
+    Args:
+        task (tuple): (共享内存名, 局数, 玩家数, 起始局, 结束局, 推进回合数, agent 工厂, 最大回合数)
+
+    Returns:
+        int: 本次推进的回合总数
+    """
+    name, game_num, player_num, start, stop, rounds, agent_factory, max_rounds = task
+    states = SharedGameStates(game_num, player_num, name)
+    round_num = 0
+
+    try:
+        with quiet():
+            for game_index in range(start, stop):
+                if states.is_finished(game_index):
+                    continue
+
+                round_count = states.get_round_count(game_index)
+                seed = states.get_seed(game_index) * max_rounds + round_count
+                game = Game(player_num, agent_factory(seed, player_num))
+                states.load(game_index, game)
+
+                for _ in range(rounds):
+                    if game.is_game_over() or game.round_count > max_rounds:
+                        break
+                    game.run_round()
+                    round_num += 1
+
+                states.store(game_index, game)
+
+                if game.is_game_over() or game.round_count > max_rounds:
+                    available_players = game.get_available_players()
+                    states.finish(
+                        game_index,
+                        available_players[0].id if len(available_players) == 1 else -1,
+                    )
+    finally:
+        states.close()
+
+    return round_num
+
+
+def simulate_shared(
+    player_num: int,
+    game_num: int,
+    first_seed: int = 0,
+    agent_factory=make_random_agents,
+    processes: int = 1,
+    rounds_per_step: int = 10,
+    chunk_size: int = 64,
+    max_rounds: int = MAX_ROUNDS,
+) -> list[int]:
+    """
+    在共享内存中批量模拟多局游戏，worker 按段就地推进，协调进程只读取结果
+
+    Args:
+        player_num (int): 每局玩家数量
+        game_num (int): 游戏局数
+        first_seed (int): 第一局的种子，之后依次加一
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂，必须可被 pickle
+        processes (int): 进程数量
+        rounds_per_step (int): 每个任务推进的回合数
+        chunk_size (int): 每个任务包含的局数
+        max_rounds (int): 最大回合数
+
+    Returns:
+        list[int]: 每局的胜者编号，-1 表示平局或达到最大回合数
+    """
+    with SharedGameStates(game_num, player_num) as states:
+        for game_index in range(game_num):
+            states.reset(game_index, first_seed + game_index)
+
+        def make_tasks():
+            unfinished = [i for i in range(game_num) if not states.is_finished(i)]
+            if not unfinished:
+                return []
+
+            return [
+                (states.name, game_num, player_num, start, stop,
+                 rounds_per_step, agent_factory, max_rounds)
+                for start, stop in split_seed_range(
+                    unfinished[0], unfinished[-1] + 1, chunk_size
+                )
+            ]
+
+        if processes == 1:
+            while tasks := make_tasks():
+                for task in tasks:
+                    advance_games(task)
+        else:
+            with Pool(processes) as pool:
+                while tasks := make_tasks():
+                    for _ in pool.imap_unordered(advance_games, tasks):
+                        pass
+
+        return [states.get_winner(i) for i in range(game_num)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在共享内存中批量模拟随机对局")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("game_num", type=int, help="局数")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--rounds-per-step", type=int, default=10, help="每个任务推进的回合数")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    winners = simulate_shared(
+        args.player_num,
+        args.game_num,
+        args.first_seed,
+        processes=args.processes,
+        rounds_per_step=args.rounds_per_step,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    for player_id in range(-1, args.player_num):
+        label = "平局" if player_id == -1 else f"玩家 {player_id}"
+        print(f"{label}: {winners.count(player_id)}")
+    print(f"用时 {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -120,7 +120,7 @@ class Expose(Ball):
         if self.target.is_exposed:
             print(f'{self.target} 已被看透，{self} 无效')
         self.target.expose()
-        self.target.charmed_by = self.source
+        self.target.charmed_by = self.source.id
 
 
 class SealAcupoint(Ball):
@@ -148,6 +148,8 @@ class BallMatrix:
     球邻接矩阵
     """
 
+    __slots__ = ("size", "matrix")
+
     def __init__(self, player_num: int):
         self.size = player_num
         self.matrix = [
@@ -208,6 +210,8 @@ skill_info_dict = {
     KAMUI_ID: SkillInfo('神威', KAMUI_ID, 7, 0),
     HEAVENLY_TRANSFER_ID: SkillInfo('天送之术', HEAVENLY_TRANSFER_ID, 8, 1),
 }
+# 单个招式最多的目标数量（修罗道）
+MAX_TARGET_NUM = max(info.target_num for info in skill_info_dict.values())
 
 
 class Skill:
@@ -0,0 +1,379 @@
+"""
+游戏状态的二进制编码
+
+完整状态是一个定长的整数序列：回合数，之后每个玩家依次为 STATE_FIELDS、已选招式、预选招式、
+已选目标和预选目标（各 MAX_TARGET_NUM 个，不足补 -1）。完整帧按固定的 struct 格式打包，
+增量帧只记录与上一帧相比发生变化的 (下标, 值)。
+相比 pickle Game，编码不包含 Python 对象图，也不会把技能目标引用的 Player 一起带上。
+
+挂起的游戏和搜索缓存中的状态都使用打包形式：
+    pack_values / unpack_values 在状态序列和不带帧头的定长记录之间转换，3 人局为 89 字节
+    suspend_game / resume_game 把回合之间的游戏保存为完整帧，可选地附带招式统计、行动记录和关键帧
+"""
+
+import struct
+from functools import lru_cache
+
+import skill as sk
+from player import STATE_FIELDS, STATE_STRUCT
+
+# 帧头：帧类型、玩家数量、完整帧为 0 / 增量帧为变化数量
+HEADER_STRUCT = struct.Struct("<BBH")
+FULL_FRAME = 0
+DELTA_FRAME = 1
+# 增量帧中每个变化的 (下标, 值)
+CHANGE_STRUCT = struct.Struct("<Hh")
+# 每个玩家在 STATE_FIELDS 之后附加的整数：已选招式、预选招式、已选目标、预选目标
+PLAYER_EXTRA_WIDTH = 2 + 2 * sk.MAX_TARGET_NUM
+PLAYER_WIDTH = len(STATE_FIELDS) + PLAYER_EXTRA_WIDTH
+# 挂起的游戏中历史部分的各项：招式统计、招式记录 (回合, 玩家, 招式)、
+# 行动记录 (回合, 玩家, 目标数量，-1 表示答案是招式编号) 和关键帧 (回合, 行动记录位置, 帧长度)
+HISTORY_HEADER_STRUCT = struct.Struct("<HIIH")
+SKILL_RECORD_STRUCT = struct.Struct("<HBb")
+ACTION_RECORD_STRUCT = struct.Struct("<HBb")
+KEYFRAME_RECORD_STRUCT = struct.Struct("<HIH")
+# 布尔类型字段在整数序列中的下标（相对于玩家起始位置），解码时还原为 bool
+BOOL_INDICES = tuple(
+    i for i, code in enumerate(STATE_STRUCT.format.lstrip("<")) if code == "?"
+)
+
+
+@lru_cache(maxsize=None)
+def get_state_struct(player_num: int) -> struct.Struct:
+    """
+    获取指定玩家数量的完整帧格式
+
+    Args:
+        player_num (int): 玩家数量
+
+    Returns:
+        struct.Struct: 回合数 + 每个玩家的定长记录
+    """
+    player_format = STATE_STRUCT.format.lstrip("<") + "b" * PLAYER_EXTRA_WIDTH
+    return struct.Struct("<H" + player_format * player_num)
+
+
+def pack_values(values) -> bytes:
+    """
+    把状态序列打包成不带帧头的定长记录，玩家数量由序列长度确定
+
+    Args:
+        values (Sequence[int]): get_state_values 返回的序列
+
+    Returns:
+        bytes: 打包后的记录
+    """
+    return get_state_struct((len(values) - 1) // PLAYER_WIDTH).pack(*values)
+
+
+def unpack_values(data) -> tuple:
+    """
+    pack_values 的逆变换
+
+    Args:
+        data (bytes-like): pack_values 返回的记录
+
+    Returns:
+        tuple[int]: 状态序列
+    """
+    player_num = (len(data) - 2) // (get_state_struct(1).size - 2)
+    return get_state_struct(player_num).unpack(data)
+
+
+def pad_targets(targets: list) -> list[int]:
+    ids = [target.id for target in targets]
+    return ids + [-1] * (sk.MAX_TARGET_NUM - len(ids))
+
+
+def get_state_values(game) -> list[int]:
+    """
+    把游戏状态展开成定长整数序列
+
+    Args:
+        game (Game): 游戏
+
+    Returns:
+        list[int]: 状态序列
+    """
+    values = [game.round_count]
+
+    for player in game.players:
+        values.extend(getattr(player, field) for field in STATE_FIELDS)
+        values.append(game.skill_ids[player.id])
+        values.append(game.preselected_skill_ids[player.id])
+        values.extend(pad_targets(game.skill_targets[player.id]))
+        values.extend(pad_targets(game.preselected_skill_targets[player.id]))
+
+    return values
+
+
+def set_state_values(game, values: list[int]):
+    """
+    从定长整数序列恢复游戏状态，游戏的玩家数量必须一致
+    回合内的招式实例和球会被清空
+
+    Args:
+        game (Game): 要恢复的游戏
+        values (list[int]): get_state_values 返回的序列
+    """
+    target_num = sk.MAX_TARGET_NUM
+    players = game.players
+    game.round_count = values[0]
+    game.skill_instances = []
+    game.ball_matrix = sk.BallMatrix(game.player_num)
+
+    offset = 1
+    for player in players:
+        for i, field in enumerate(STATE_FIELDS):
+            value = values[offset + i]
+            setattr(player, field, bool(value) if i in BOOL_INDICES else value)
+        offset += len(STATE_FIELDS)
+
+        game.skill_ids[player.id] = values[offset]
+        game.preselected_skill_ids[player.id] = values[offset + 1]
+        offset += 2
+
+        game.skill_targets[player.id] = [
+            players[i] for i in values[offset : offset + target_num] if i >= 0
+        ]
+        offset += target_num
+
+        game.preselected_skill_targets[player.id] = [
+            players[i] for i in values[offset : offset + target_num] if i >= 0
+        ]
+        offset += target_num
+
+
+def encode_values(values: list[int], player_num: int) -> bytes:
+    return HEADER_STRUCT.pack(FULL_FRAME, player_num, 0) + get_state_struct(
+        player_num
+    ).pack(*values)
+
+
+def encode_delta(previous: list[int], values: list[int], player_num: int) -> bytes:
+    changes = [
+        (i, value) for i, (old, value) in enumerate(zip(previous, values)) if old != value
+    ]
+    frame = bytearray(HEADER_STRUCT.pack(DELTA_FRAME, player_num, len(changes)))
+
+    for change in changes:
+        frame += CHANGE_STRUCT.pack(*change)
+
+    return bytes(frame)
+
+
+def decode_frame(data, previous: list[int] = None) -> list[int]:
+    """
+    解码一帧得到完整的状态序列
+
+    Args:
+        data (bytes-like): 完整帧或增量帧
+        previous (list[int]): 上一帧的状态序列，解码增量帧时必须提供
+
+    Returns:
+        list[int]: 状态序列
+    """
+    frame_type, player_num, change_num = HEADER_STRUCT.unpack_from(data)
+
+    if frame_type == FULL_FRAME:
+        return list(get_state_struct(player_num).unpack_from(data, HEADER_STRUCT.size))
+
+    if previous is None:
+        raise ValueError("解码增量帧需要上一帧的状态")
+
+    values = list(previous)
+    for i, value in CHANGE_STRUCT.iter_unpack(
+        memoryview(data)[HEADER_STRUCT.size : HEADER_STRUCT.size + change_num * CHANGE_STRUCT.size]
+    ):
+        values[i] = value
+
+    return values
+
+
+def encode_state(game) -> bytes:
+    """
+    把游戏状态编码为完整帧
+
+    Args:
+        game (Game): 游戏
+
+    Returns:
+        bytes: 完整帧
+    """
+    return encode_values(get_state_values(game), game.player_num)
+
+
+def decode_state(data, game):
+    """
+    把完整帧解码到游戏中
+
+    Args:
+        data (bytes-like): encode_state 返回的完整帧
+        game (Game): 玩家数量相同的游戏
+    """
+    set_state_values(game, decode_frame(data))
+
+
+def suspend_game(game, include_history: bool = False) -> bytes:
+    """
+    把回合之间（没有进行中的决策）的游戏保存为字节串
+
+    Args:
+        game (Game): 游戏
+        include_history (bool): 是否附带招式统计、招式记录、行动记录和关键帧，
+            不附带时恢复后这些记录为空
+
+    Returns:
+        bytes: 完整帧，附带历史时后接历史部分
+    """
+    data = bytearray(encode_state(game))
+    if not include_history:
+        return bytes(data)
+
+    data += HISTORY_HEADER_STRUCT.pack(
+        game.keyframe_interval, len(game.skill_history), len(game.action_log), len(game.keyframes)
+    )
+    data += struct.pack(f"<{game.player_num * sk.SKILL_NUM}H", *sum(game.skill_counts, []))
+
+    for record in game.skill_history:
+        data += SKILL_RECORD_STRUCT.pack(*record)
+
+    for round_count, player_id, answer in game.action_log:
+        if isinstance(answer, int):
+            data += ACTION_RECORD_STRUCT.pack(round_count, player_id, -1)
+            data += struct.pack("<b", answer)
+        else:
+            data += ACTION_RECORD_STRUCT.pack(round_count, player_id, len(answer))
+            data += struct.pack(f"<{len(answer)}b", *answer)
+
+    for round_count, (frame, position) in game.keyframes.items():
+        data += KEYFRAME_RECORD_STRUCT.pack(round_count, position, len(frame))
+        data += frame
+
+    return bytes(data)
+
+
+def resume_game(data, game):
+    """
+    从 suspend_game 的结果恢复游戏，游戏的玩家数量必须一致，agent 不变
+
+    Args:
+        data (bytes-like): suspend_game 返回的字节串
+        game (Game): 要恢复的游戏
+    """
+    player_num = game.player_num
+    data = memoryview(data)
+    offset = HEADER_STRUCT.size + get_state_struct(player_num).size
+    set_state_values(game, decode_frame(data[:offset]))
+
+    game.skill_counts = [[0] * sk.SKILL_NUM for _ in range(player_num)]
+    game.skill_history = []
+    game.action_log = []
+    game.keyframes = {}
+    if offset == len(data):
+        return
+
+    keyframe_interval, skill_num, action_num, keyframe_num = HISTORY_HEADER_STRUCT.unpack_from(
+        data, offset
+    )
+    offset += HISTORY_HEADER_STRUCT.size
+    game.keyframe_interval = keyframe_interval
+
+    counts = struct.unpack_from(f"<{player_num * sk.SKILL_NUM}H", data, offset)
+    offset += 2 * player_num * sk.SKILL_NUM
+    game.skill_counts = [
+        list(counts[i * sk.SKILL_NUM : (i + 1) * sk.SKILL_NUM]) for i in range(player_num)
+    ]
+
+    for _ in range(skill_num):
+        game.skill_history.append(SKILL_RECORD_STRUCT.unpack_from(data, offset))
+        offset += SKILL_RECORD_STRUCT.size
+
+    for _ in range(action_num):
+        round_count, player_id, answer_num = ACTION_RECORD_STRUCT.unpack_from(data, offset)
+        offset += ACTION_RECORD_STRUCT.size
+
+        if answer_num < 0:
+            answer = struct.unpack_from("<b", data, offset)[0]
+            offset += 1
+        else:
+            answer = list(struct.unpack_from(f"<{answer_num}b", data, offset))
+            offset += answer_num
+        game.action_log.append((round_count, player_id, answer))
+
+    for _ in range(keyframe_num):
+        round_count, position, frame_size = KEYFRAME_RECORD_STRUCT.unpack_from(data, offset)
+        offset += KEYFRAME_RECORD_STRUCT.size
+        game.keyframes[round_count] = (bytes(data[offset : offset + frame_size]), position)
+        offset += frame_size
+
+
+class DeltaEncoder:
+    """
+    状态流编码器：首帧和每 full_interval 帧输出完整帧，其余只输出变化的字段
+    """
+
+    def __init__(self, full_interval: int = 0):
+        """
+        Args:
+            full_interval (int): 每隔多少帧强制输出一次完整帧，0 表示只有首帧是完整帧
+        """
+        self.full_interval = full_interval
+        self.previous = None
+        self.frame_num = 0
+
+    def encode(self, game) -> bytes:
+        """
+        编码游戏的当前状态
+
+        Args:
+            game (Game): 游戏
+
+        Returns:
+            bytes: 完整帧或增量帧
+        """
+        values = get_state_values(game)
+
+        if self.previous is None or (
+            self.full_interval and self.frame_num % self.full_interval == 0
+        ):
+            frame = encode_values(values, game.player_num)
+        else:
+            frame = encode_delta(self.previous, values, game.player_num)
+
+        self.previous = values
+        self.frame_num += 1
+        return frame
+
+    def reset(self):
+        """
+        下一帧输出完整帧，例如接收方丢失了状态
+        """
+        self.previous = None
+
+
+class DeltaDecoder:
+    """
+    状态流解码器，与 DeltaEncoder 对应
+    """
+
+    def __init__(self):
+        self.values = None
+
+    def decode(self, data, game=None) -> list[int]:
+        """
+        解码一帧，并可选地把结果加载到游戏中
+
+        Args:
+            data (bytes-like): 完整帧或增量帧
+            game (Game): 要同步的游戏，为 None 时只更新状态序列
+
+        Returns:
+            list[int]: 解码后的状态序列
+        """
+        self.values = decode_frame(data, self.values)
+
+        if game is not None:
+            set_state_values(game, self.values)
+
+        return self.values
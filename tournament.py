@@ -0,0 +1,195 @@
+import argparse
+import time
+from multiprocessing import Pool
+
+from agent import RandomAgent
+from checkpoint import TournamentCheckpoint, is_covered
+from headless import MAX_ROUNDS, get_game_result, play_game
+from results import ResultStore, ResultWriter, SummaryStats
+
+
+def make_random_agents(seed: int, player_num: int) -> list:
+    """
+    默认的 agent 工厂：每个座位一个随机 agent，种子由局种子和座位决定
+
+    Args:
+        seed (int): 局种子
+        player_num (int): 玩家数量
+
+    Returns:
+        list[Agent]: 每个座位的 agent
+    """
+    return [RandomAgent(seed * player_num + i) for i in range(player_num)]
+
+
+def play_seed(seed: int, player_num: int, agent_factory, max_rounds: int) -> dict:
+    """
+    用指定种子进行一局游戏并返回结果
+
+    Args:
+        seed (int): 局种子
+        player_num (int): 玩家数量
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂，必须可被 pickle
+        max_rounds (int): 最大回合数
+
+    Returns:
+        dict: 带有 seed 的比赛结果
+    """
+    game = play_game(agent_factory(seed, player_num), max_rounds)
+
+    result = get_game_result(game)
+    result["seed"] = seed
+    return result
+
+
+def play_seed_range(task: tuple) -> list[dict]:
+    """
+    工作进程的入口：进行一段连续种子的比赛
+
+    Args:
+        task (tuple): (起始种子, 结束种子, 玩家数量, agent 工厂, 最大回合数)
+
+    Returns:
+        list[dict]: 各局结果
+    """
+    start, stop, player_num, agent_factory, max_rounds = task
+    return [
+        play_seed(seed, player_num, agent_factory, max_rounds)
+        for seed in range(start, stop)
+    ]
+
+
+def split_seed_range(start: int, stop: int, chunk_size: int) -> list[tuple[int, int]]:
+    """
+    将种子区间切分为若干段
+
+    Returns:
+        list[tuple[int, int]]: [起始, 结束) 区间列表
+    """
+    return [
+        (chunk_start, min(chunk_start + chunk_size, stop))
+        for chunk_start in range(start, stop, chunk_size)
+    ]
+
+
+def run_tournament(
+    player_num: int,
+    game_num: int,
+    writer: ResultWriter | ResultStore,
+    first_seed: int = 0,
+    agent_factory=make_random_agents,
+    processes: int = None,
+    chunk_size: int = 256,
+    max_rounds: int = MAX_ROUNDS,
+    checkpoint: TournamentCheckpoint = None,
+    checkpoint_interval: float = 60.0,
+) -> SummaryStats:
+    """
+    用进程池并行进行 game_num 局比赛，结果边产生边交给 writer
+    提供检查点时定期保存进度；检查点已存在则先把 writer 回滚到检查点的位置，
+    恢复汇总统计并跳过已完成的区间，因此不会重复计入任何一局
+
+    Args:
+        player_num (int): 玩家数量
+        game_num (int): 比赛局数，种子为 [first_seed, first_seed + game_num)
+        writer (ResultWriter | ResultStore): 结果写出器
+        first_seed (int): 起始种子
+        agent_factory (Callable[[int, int], list[Agent]]): agent 工厂
+        processes (int): 进程数，为 1 时在当前进程中执行
+        chunk_size (int): 每个任务包含的局数
+        max_rounds (int): 最大回合数
+        checkpoint (TournamentCheckpoint): 检查点，为 None 时不保存进度
+        checkpoint_interval (float): 保存检查点的最短间隔（秒）
+
+    Returns:
+        SummaryStats: 汇总统计
+    """
+    config = {
+        "player_num": player_num,
+        "game_num": game_num,
+        "first_seed": first_seed,
+        "chunk_size": chunk_size,
+        "max_rounds": max_rounds,
+    }
+    completed = []
+    saved = checkpoint.load() if checkpoint else None
+
+    if saved:
+        if saved["config"] != config:
+            raise ValueError(f"检查点的比赛设置 {saved['config']} 与本次 {config} 不一致")
+
+        writer.truncate(saved["position"])
+        writer.stats.load_state(saved["stats"])
+        completed = [tuple(seed_range) for seed_range in saved["completed"]]
+
+    tasks = [
+        (start, stop, player_num, agent_factory, max_rounds)
+        for start, stop in split_seed_range(
+            first_seed, first_seed + game_num, chunk_size
+        )
+        if not (saved and is_covered(saved["completed"], start, stop))
+    ]
+
+    def save_checkpoint():
+        checkpoint.save(config, completed, writer.stats.get_state(), writer.sync())
+
+    last_save_time = time.monotonic()
+
+    def write_results(task: tuple, results: list[dict]):
+        nonlocal last_save_time
+
+        for result in results:
+            writer.write(result)
+        completed.append(task[:2])
+
+        if checkpoint and time.monotonic() - last_save_time >= checkpoint_interval:
+            save_checkpoint()
+            last_save_time = time.monotonic()
+
+    if processes == 1:
+        for task in tasks:
+            write_results(task, play_seed_range(task))
+    else:
+        with Pool(processes) as pool:
+            for task, results in pool.imap_unordered(play_task, tasks):
+                write_results(task, results)
+
+    writer.flush()
+    if checkpoint:
+        save_checkpoint()
+
+    return writer.stats
+
+
+def play_task(task: tuple) -> tuple[tuple, list[dict]]:
+    """
+    进程池入口：返回任务本身和结果，便于按完成顺序记录检查点
+    """
+    return task, play_seed_range(task)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="随机 agent 之间的批量比赛")
+    parser.add_argument("player_num", type=int, help="玩家数量")
+    parser.add_argument("game_num", type=int, help="比赛局数")
+    parser.add_argument("output", help="结果文件，以 .db 结尾时写入 SQLite 结果库，否则为 JSONL")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None, help="检查点文件，存在时从中恢复")
+    parser.add_argument("--checkpoint-interval", type=float, default=60.0, help="保存检查点的间隔（秒）")
+    args = parser.parse_args()
+
+    writer_class = ResultStore if args.output.endswith(".db") else ResultWriter
+
+    with writer_class(args.output, args.player_num) as writer:
+        stats = run_tournament(
+            args.player_num,
+            args.game_num,
+            writer,
+            first_seed=args.first_seed,
+            processes=args.processes,
+            checkpoint=TournamentCheckpoint(args.checkpoint) if args.checkpoint else None,
+            checkpoint_interval=args.checkpoint_interval,
+        )
+
+    print(stats)